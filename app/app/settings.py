@@ -30,9 +30,15 @@ ALLOWED_HOSTS = []
 
 # Application definition
 
+# workers can skip importing the admin modules of every app at boot,
+# they are discovered on the first admin request instead (see urls.py)
+# management commands keep the default so the admin checks see them
+ADMIN_LAZY_DISCOVERY = os.environ.get('ADMIN_LAZY_DISCOVERY', '0') == '1'
+
 INSTALLED_APPS = [
     'core',
-    'django.contrib.admin',
+    'django.contrib.admin.apps.SimpleAdminConfig'
+    if ADMIN_LAZY_DISCOVERY else 'django.contrib.admin',
     'django.contrib.auth',
     'django.contrib.contenttypes',
     'django.contrib.sessions',
@@ -45,7 +51,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.AccessLogMiddleware',
+    'core.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'core.middleware.ReplicaRoutingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -88,6 +97,57 @@ DATABASES = {
     }
 }
 
+# Read replicas, comma separated hosts sharing the primary credentials
+# DB_REPLICA_NAME allows a second local database to act as a replica
+DATABASE_REPLICAS = []
+for index, host in enumerate(
+        filter(None, os.environ.get('DB_REPLICA_HOSTS', '').split(','))):
+    alias = f'replica_{index}'
+    DATABASES[alias] = dict(
+        DATABASES['default'],
+        HOST=host,
+        NAME=os.environ.get('DB_REPLICA_NAME', DATABASES['default']['NAME']),
+        # tests run against the primary only
+        TEST={'MIRROR': 'default'},
+    )
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['core.db_router.PrimaryReplicaRouter']
+
+# cache shared by every worker process
+# CACHE_URL is memcached://host:port[,host:port] or db://table_name
+# (created by manage.py createcachetable), the default is local memory
+CACHE_URL = os.environ.get('CACHE_URL', '')
+if CACHE_URL.startswith('memcached://'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+            'LOCATION': CACHE_URL[len('memcached://'):].split(','),
+        }
+    }
+elif CACHE_URL.startswith('db://'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': CACHE_URL[len('db://'):] or 'cache_table',
+        }
+    }
+# the recipe detail and facet caches, the in-memory recipe indexes,
+# the replica stickiness and the idempotency keys go through the cache,
+# a local memory cache is only seen by every request of the single
+# process development server, elsewhere these features are turned off
+CACHE_SHARED = os.environ.get(
+    'CACHE_SHARED', '1' if CACHE_URL or DEBUG else '0'
+) == '1'
+
+# safe requests under these paths read from a replica
+DATABASE_REPLICA_PATHS = ('/api/recipe/', '/api/user/')
+
+# seconds a client keeps reading from the primary after a write
+DATABASE_PRIMARY_STICKY_SECONDS = int(
+    os.environ.get('DB_PRIMARY_STICKY_SECONDS', 10)
+)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -132,6 +192,159 @@ MEDIA_URL = '/media/'
 MEDIA_ROOT = '/vol/web/media'
 STATIC_ROOT = '/vol/web/static'
 
+# store each unique upload once, named by the hash of its content
+if os.environ.get('MEDIA_DEDUP_STORAGE') == '1':
+    DEFAULT_FILE_STORAGE = 'core.storage.ContentAddressedStorage'
+
+# how media files are delivered
+# 'python' streams them from the worker
+# 'x-accel-redirect' hands them to nginx through MEDIA_ACCEL_REDIRECT_URL
+# 'x-sendfile' hands them to apache or lighttpd
+MEDIA_SERVE_MODE = os.environ.get('MEDIA_SERVE_MODE', 'python')
+# internal nginx location aliased to MEDIA_ROOT
+MEDIA_ACCEL_REDIRECT_URL = '/protected-media/'
+# uploaded file names never change content so clients can keep them
+MEDIA_CACHE_MAX_AGE = 60 * 60 * 24 * 365
+# orphaned uploads younger than this are kept by the sweep_media command
+MEDIA_SWEEP_GRACE_SECONDS = 60 * 60 * 24
+
+# uploaded recipe images are re-encoded to this format ('jpeg', 'webp')
+# and quality, and scaled down to fit the maximum width and height
+RECIPE_IMAGE_FORMAT = os.environ.get('RECIPE_IMAGE_FORMAT', 'jpeg')
+RECIPE_IMAGE_QUALITY = int(os.environ.get('RECIPE_IMAGE_QUALITY', 82))
+RECIPE_IMAGE_MAX_DIMENSION = 2048
+
+# resized image variants served on /images/, kept in this directory
+# of MEDIA_ROOT so the front web server can send them too
+IMAGE_DERIVATIVE_DIR = 'derived'
+# the only widths and qualities clients can ask for
+IMAGE_DERIVATIVE_WIDTHS = (160, 320, 640, 1280)
+IMAGE_DERIVATIVE_QUALITIES = (60, 80, 90)
+IMAGE_DERIVATIVE_DEFAULT_QUALITY = 80
+# least recently used variants are deleted past this size
+IMAGE_DERIVATIVE_CACHE_BYTES = int(
+    os.environ.get('IMAGE_DERIVATIVE_CACHE_BYTES', 1024 ** 3)
+)
+
+# admin changelists of unfiltered tables over this many rows
+# show the postgres row estimate instead of running COUNT(*)
+ADMIN_ESTIMATED_COUNT_THRESHOLD = 100000
+
+# deleted accounts are purged in transactions of this many rows
+USER_PURGE_BATCH_SIZE = 500
+# purge in a thread of the web worker, otherwise run purge_users
+USER_PURGE_IN_THREAD = os.environ.get('USER_PURGE_IN_THREAD', '1') == '1'
+
+# responses of POST requests sent with an Idempotency-Key are replayed
+# to retries for this many seconds, the keys are ignored unless the
+# cache is shared by every worker (CACHE_SHARED)
+IDEMPOTENCY_KEY_TIMEOUT = int(
+    os.environ.get('IDEMPOTENCY_KEY_TIMEOUT', 60 * 60 * 24)
+)
+# a request holding a key is presumed dead after this many seconds
+IDEMPOTENCY_LOCK_TIMEOUT = 60
+# seconds a duplicate waits for the first request before a 409
+IDEMPOTENCY_WAIT_SECONDS = 10
+
+# the browsable API pulls in templates and forms on the first request
+# rendered with it, production workers only need to speak JSON
+BROWSABLE_API = os.environ.get('BROWSABLE_API', '1' if DEBUG else '0') == '1'
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'rest_framework.renderers.JSONRenderer',
+    ] + (['rest_framework.renderers.BrowsableAPIRenderer']
+         if BROWSABLE_API else []),
+}
+
+# per view latency, status and database time served on /metrics
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'
+# directory shared by the worker processes of a server, each one writes
+# its metrics there and /metrics adds them up, empty for one process
+# clear it when the server starts so old workers are not counted
+METRICS_DIR = os.environ.get('METRICS_DIR', '')
+# seconds between two writes of a worker to METRICS_DIR
+METRICS_FLUSH_SECONDS = 5
+# upper bounds in seconds of the latency and database time buckets
+METRICS_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+# bearer token required to read /metrics, without one the endpoint is
+# only served with DEBUG on
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+# one JSON line per request on the access logger
+ACCESS_LOG_ENABLED = os.environ.get(
+    'ACCESS_LOG_ENABLED', '0' if DEBUG else '1'
+) == '1'
+# share of the requests logged, 5xx and slow requests are always logged
+ACCESS_LOG_SAMPLE_RATE = float(os.environ.get('ACCESS_LOG_SAMPLE_RATE', 1))
+ACCESS_LOG_SLOW_SECONDS = 1.0
+
+# the access log is written by a background thread from a bounded queue
+# so request threads never wait on stdout or a slow disk
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'json': {
+            '()': 'core.access_log.JSONFormatter',
+        },
+    },
+    'handlers': {
+        'access': {
+            'class': 'core.access_log.BackgroundHandler',
+            'formatter': 'json',
+            # a file reopened when rotated, empty for stdout
+            'filename': os.environ.get('ACCESS_LOG_FILE') or None,
+            'maxsize': 10000,
+        },
+    },
+    'loggers': {
+        'access': {
+            'handlers': ['access'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
+
 # core.User(name of our model in app)
 # New stetting assigned as the custom user model
-AUTH_USER_MODEL = 'core.User'
\ No newline at end of file
+AUTH_USER_MODEL = 'core.User'
+
+
+# Recipe API
+# seconds to keep the facet counts of a recipe collection cached
+# 0 disables caching of the facet counts
+RECIPE_FACETS_CACHE_TIMEOUT = int(
+    os.environ.get('RECIPE_FACETS_CACHE_TIMEOUT', 300)
+)
+# seconds to keep a rendered recipe detail cached, 0 disables the cache
+RECIPE_DETAIL_CACHE_TIMEOUT = int(
+    os.environ.get('RECIPE_DETAIL_CACHE_TIMEOUT', 60 * 60)
+)
+# most recipes returned by a single batch request
+RECIPE_BATCH_MAX_IDS = 100
+# most recipes changed by a single bulk update or delete
+RECIPE_BULK_MAX_IDS = 1000
+# most images uploaded by a single bulk request and the threads
+# encoding them
+RECIPE_BULK_MAX_IMAGES = 20
+RECIPE_IMAGE_UPLOAD_WORKERS = 4
+# tag and ingredient names returned by autocomplete by default
+RECIPE_AUTOCOMPLETE_LIMIT = 10
+# serve autocomplete from sorted names kept in memory per user
+RECIPE_AUTOCOMPLETE_IN_MEMORY = (
+    os.environ.get('RECIPE_AUTOCOMPLETE_IN_MEMORY', '0') == '1'
+)
+# hash partitions of the recipe tables for very large deployments
+# the tables are moved by running the partition_recipes command after
+# migrate, set it once they are so updates look up a single partition,
+# 0 keeps plain tables
+RECIPE_PARTITIONS = int(os.environ.get('RECIPE_PARTITIONS', 0))
+# upper bounds of the price ranges counted by the recipe stats
+RECIPE_STATS_PRICE_BUCKETS = (5, 10, 20, 50)
+# most used tags listed by the recipe stats
+RECIPE_STATS_TOP_TAGS = 5
+# users whose in-memory recipe indexes each worker process keeps
+RECIPE_INDEX_MAX_USERS = int(os.environ.get('RECIPE_INDEX_MAX_USERS', 1000))
@@ -13,17 +13,43 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
-from django.contrib import admin
-from django.urls import path, include
-from django.conf.urls.static import static
+from django.urls import path, include, URLResolver
+from django.urls.resolvers import RoutePattern
+from django.utils.functional import cached_property
 from django.conf import settings
 
+from core.views import serve_media, serve_image_variant, metrics
+
+
+class LazyAdminURLConf:
+    # Admin URL patterns built the first time the admin is resolved or a
+    # URL is reversed, API requests never load the registered admins
+    # with ADMIN_LAZY_DISCOVERY the admin modules are only imported then
+
+    @cached_property
+    def urlpatterns(self):
+        from django.contrib import admin
+        admin.autodiscover()
+
+        return admin.site.get_urls()
+
+
 urlpatterns = [
-    path('admin/', admin.site.urls),
+    URLResolver(
+        RoutePattern('admin/'), LazyAdminURLConf(),
+        app_name='admin', namespace='admin'
+    ),
     # identify the user app and it will get the URLs module
     path('api/user/', include('user.urls')),
     # map the urls correctly to our recipe
     path('api/recipe/', include('recipe.urls')),
-    # makes the media url available in a development server
-    # we can test uploading images without set up a separate web server
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    # serve uploaded media, in production the worker only checks the
+    # request and the front web server sends the file (MEDIA_SERVE_MODE)
+    path(f'{settings.MEDIA_URL.lstrip("/")}<path:path>', serve_media),
+    # resized variants of uploaded images, ?width=&format=&quality=
+    path('images/<path:path>', serve_image_variant),
+]
+
+if settings.METRICS_ENABLED:
+    # scraped by prometheus, see core.metrics
+    urlpatterns.append(path('metrics', metrics))
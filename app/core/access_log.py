@@ -0,0 +1,104 @@
+import copy
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+from logging.handlers import QueueHandler, QueueListener, WatchedFileHandler
+
+
+class JSONFormatter(logging.Formatter):
+    # Format a record as one JSON object per line
+    # the fields passed as extra={'fields': {...}} become top level keys
+
+    def format(self, record):
+        data = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        data.update(getattr(record, 'fields', None) or {})
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data['exception'] = record.exc_text
+
+        return json.dumps(data, default=str)
+
+
+class BackgroundHandler(QueueHandler):
+    # Hand records to a bounded queue written out by a background thread
+    # a request thread only copies the record and never waits on the
+    # output, records are dropped and counted when the queue is full
+
+    def __init__(self, filename=None, maxsize=10000):
+        super().__init__(queue.Queue(maxsize))
+        if filename:
+            self.target = WatchedFileHandler(filename)
+        else:
+            self.target = logging.StreamHandler(sys.stdout)
+        self.dropped = 0
+        self._listener = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def setFormatter(self, fmt):
+        # records are formatted by the writer thread, not the caller
+        self.target.setFormatter(fmt)
+
+    def _start(self):
+        # the writer thread doesn't survive a fork, start one per process
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            # a queue inherited from the parent may hold its records
+            self.queue = queue.Queue(self.queue.maxsize)
+            self._listener = QueueListener(
+                self.queue, self.target, respect_handler_level=True
+            )
+            self._listener.start()
+            self._pid = os.getpid()
+
+    def prepare(self, record):
+        # keep the extra fields for the formatter, resolve what only
+        # makes sense in the calling thread
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(
+                record.exc_info
+            )
+            record.exc_info = None
+
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def emit(self, record):
+        if self._pid != os.getpid():
+            self._start()
+        super().emit(record)
+
+    def _running(self):
+        return self._listener is not None and self._pid == os.getpid()
+
+    def flush(self):
+        # Wait for the writer thread to write every queued record
+        if self._running():
+            self.queue.join()
+        self.target.flush()
+
+    def close(self):
+        # called by logging at exit, the queued records are written first
+        if self._running():
+            self._listener.stop()
+        self._listener = self._pid = None
+        self.target.close()
+        super().close()
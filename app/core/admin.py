@@ -1,15 +1,68 @@
+from django.conf import settings
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
 # converting tring in python to human readable text
 from django.utils.translation import gettext as _
 
 from core import models
 
 
+# rows of a table summed over its partitions (core.partitioning), the
+# parent of partitioned tables holds no rows of its own
+ESTIMATED_COUNT = '''
+WITH RECURSIVE tree(oid) AS (
+    SELECT to_regclass(%s)::oid
+    UNION ALL
+    SELECT inhrelid FROM pg_inherits JOIN tree ON inhparent = tree.oid
+)
+SELECT COALESCE(SUM(GREATEST(reltuples, 0)), 0)::bigint
+FROM pg_class JOIN tree USING (oid)
+WHERE relkind = 'r'
+'''
+
+
+# counting every row of a huge table takes longer than the page itself
+class EstimatedCountPaginator(Paginator):
+    # Use the postgres planner estimate to count unfiltered big tables
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql' and not queryset.query.where:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    ESTIMATED_COUNT, [queryset.model._meta.db_table]
+                )
+                row = cursor.fetchone()
+            if row and row[0] >= settings.ADMIN_ESTIMATED_COUNT_THRESHOLD:
+                return row[0]
+
+        return super().count
+
+
+# admin options shared by the models with millions of rows
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    # skip the second count of the whole table shown next to search results
+    show_full_result_count = False
+    # a select box would load every user
+    raw_id_fields = ('user',)
+    list_select_related = ('user',)
+    ordering = ('-id',)
+
+
 # extends the base user admin
 class UserAdmin(BaseUserAdmin):
     ordering = ['id']
     list_display = ['email', 'name']
+    # prefix search backed by an UPPER(email) index
+    search_fields = ['^email']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     # define the sections in our change and create page
     # first part is the tittle of the section
     # second part contains the fields
@@ -28,8 +81,32 @@ class UserAdmin(BaseUserAdmin):
     )
 
 
+class RecipeAttrAdmin(LargeTableAdmin):
+    list_display = ['name', 'user']
+    # prefix search backed by an UPPER(name) index,
+    # also used by the recipe autocomplete widgets
+    search_fields = ['^name']
+
+
+class RecipeAdmin(LargeTableAdmin):
+    list_display = ['title', 'user', 'time_minutes', 'price']
+    search_fields = ['^title']
+    # search tags and ingredients instead of loading all of them
+    autocomplete_fields = ['tags', 'ingredients']
+
+
+class UserPurgeAdmin(admin.ModelAdmin):
+    list_display = [
+        'email', 'status', 'recipes_deleted', 'tags_deleted',
+        'ingredients_deleted', 'images_deleted', 'created_at', 'finished_at'
+    ]
+    list_filter = ['status']
+    readonly_fields = [field.name for field in models.UserPurge._meta.fields]
+    ordering = ['-id']
+
+
 admin.site.register(models.User, UserAdmin)
-# we dont need to specify the admin tht we want to register with
-admin.site.register(models.Tag)
-admin.site.register(models.Ingredient)
-admin.site.register(models.Recipe)
+admin.site.register(models.Tag, RecipeAttrAdmin)
+admin.site.register(models.Ingredient, RecipeAttrAdmin)
+admin.site.register(models.Recipe, RecipeAdmin)
+admin.site.register(models.UserPurge, UserPurgeAdmin)
@@ -0,0 +1,60 @@
+import random
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+# the replica chosen for the current request, None reads from the primary
+_state = threading.local()
+
+# tokens are read right after they are created on login
+# so they always come from the primary to avoid replication lag
+# as do the entries of a database cache backend
+PRIMARY_ONLY_MODELS = ('authtoken.Token', 'django_cache.CacheEntry')
+
+
+def choose_replica():
+    # Return a random replica alias or None when there are no replicas
+    replicas = settings.DATABASE_REPLICAS
+    if not replicas:
+        return None
+
+    return random.choice(replicas)
+
+
+@contextmanager
+def use_replica(alias):
+    # Route the reads made inside the block to the given replica
+    previous = getattr(_state, 'replica', None)
+    _state.replica = alias
+    try:
+        yield
+    finally:
+        _state.replica = previous
+
+
+class PrimaryReplicaRouter:
+    # Send reads to the replica of the current request, writes to primary
+
+    def db_for_read(self, model, **hints):
+        replica = getattr(_state, 'replica', None)
+        if replica is None or model._meta.label in PRIMARY_ONLY_MODELS:
+            return DEFAULT_DB_ALIAS
+        # reads inside a transaction must see its own writes
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+
+        return replica
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # every database holds the same data
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # replicas receive the schema through replication
+        return db == DEFAULT_DB_ALIAS
@@ -0,0 +1,126 @@
+import hashlib
+import json
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+from rest_framework.response import Response
+
+
+IDEMPOTENCY_HEADER = 'HTTP_IDEMPOTENCY_KEY'
+MAX_KEY_LENGTH = 255
+# seconds between two looks at a request still in progress
+POLL_INTERVAL = 0.05
+
+logger = logging.getLogger(__name__)
+
+
+class IdempotencyKeyInUse(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'A request with this Idempotency-Key is in progress.'
+    default_code = 'idempotency_key_in_use'
+
+
+class IdempotencyKeyReused(APIException):
+    status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+    default_detail = 'This Idempotency-Key was used for another request.'
+    default_code = 'idempotency_key_reused'
+
+
+def _fingerprint(request):
+    # Hash of what makes two requests the same, never the raw payload
+    # so passwords sent to create a user are not kept in the cache
+    data = request.data
+    if hasattr(data, 'lists'):
+        data = sorted(data.lists())
+    payload = json.dumps(
+        [request.method, request.path, data], sort_keys=True, default=str
+    )
+
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _cache_key(request, key):
+    user_id = request.user.id if request.user.is_authenticated else 'anon'
+    digest = hashlib.sha256(f'{request.path}:{key}'.encode()).hexdigest()
+
+    return f'idempotency:{user_id}:{digest}'
+
+
+class IdempotentCreateMixin:
+    # Make POST requests sent with an Idempotency-Key safe to retry
+    # the first request claims the key with an atomic cache add and its
+    # response is stored, retries get that response replayed and
+    # duplicates arriving while it runs wait for it instead of racing
+    # keys are only honoured when the cache is shared by every worker
+
+    def create(self, request, *args, **kwargs):
+        key = request.META.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return super().create(request, *args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            raise ValidationError({'Idempotency-Key': (
+                f'Use at most {MAX_KEY_LENGTH} characters.'
+            )})
+
+        if not settings.CACHE_SHARED:
+            # a key claimed in the cache of one process is not seen by
+            # a retry landing on another, rather than pretending the
+            # request is safe to retry the key is ignored
+            logger.warning(
+                'Idempotency-Key ignored, the cache is not shared.'
+            )
+            return super().create(request, *args, **kwargs)
+
+        cache_key = _cache_key(request, key)
+        fingerprint = _fingerprint(request)
+        deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT_SECONDS
+        while True:
+            # the claim expires so a crashed worker doesn't hold the key
+            if cache.add(cache_key, {'fingerprint': fingerprint},
+                         settings.IDEMPOTENCY_LOCK_TIMEOUT):
+                return self._create_once(
+                    cache_key, fingerprint, request, *args, **kwargs
+                )
+
+            entry = cache.get(cache_key)
+            if entry is None:
+                # the first request failed and released the key
+                continue
+            if entry['fingerprint'] != fingerprint:
+                raise IdempotencyKeyReused()
+            if 'status' in entry:
+                return self._replay(entry)
+            if time.monotonic() >= deadline:
+                raise IdempotencyKeyInUse()
+            time.sleep(POLL_INTERVAL)
+
+    def _create_once(self, cache_key, fingerprint, request, *args, **kwargs):
+        # Run the create and store its response under the claimed key
+        try:
+            response = super().create(request, *args, **kwargs)
+        except Exception:
+            # nothing was created, let a retry run the request again
+            cache.delete(cache_key)
+            raise
+
+        cache.set(cache_key, {
+            'fingerprint': fingerprint,
+            'status': response.status_code,
+            'data': response.data,
+            'location': response.get('Location'),
+        }, settings.IDEMPOTENCY_KEY_TIMEOUT)
+
+        return response
+
+    def _replay(self, entry):
+        # Return the stored response of the first request
+        headers = {'Idempotent-Replayed': 'true'}
+        if entry['location']:
+            headers['Location'] = entry['location']
+
+        return Response(entry['data'], status=entry['status'], headers=headers)
@@ -0,0 +1,226 @@
+import hashlib
+import io
+import mimetypes
+import os
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+
+
+# not known to the mimetypes module of older pythons
+mimetypes.add_type('image/webp', '.webp')
+
+FORMATS = {
+    # format parameter: (pillow format, file extension)
+    'jpeg': ('JPEG', 'jpg'),
+    'webp': ('WEBP', 'webp'),
+    'png': ('PNG', 'png'),
+}
+# hits refresh the access time of a variant at most this often
+TOUCH_INTERVAL = 60 * 60
+# seconds a variant being generated elsewhere is waited for
+GENERATE_WAIT_SECONDS = 10
+POLL_INTERVAL = 0.05
+
+
+class ImageError(Exception):
+    # The source image is missing or can't be decoded
+    pass
+
+
+def derived_root():
+    return os.path.join(settings.MEDIA_ROOT, settings.IMAGE_DERIVATIVE_DIR)
+
+
+def variant_name(name, source_mtime, width, image_format, quality):
+    # Return the path of a variant relative to MEDIA_ROOT
+    # the source mtime is part of the key so a replaced file is redone
+    digest = hashlib.sha1(
+        f'{name}:{int(source_mtime)}'.encode()
+    ).hexdigest()
+    extension = FORMATS[image_format][1]
+
+    return '/'.join([
+        settings.IMAGE_DERIVATIVE_DIR, digest[:2],
+        f'{digest}-w{width}-q{quality}.{extension}',
+    ])
+
+
+def _save(image, destination, image_format, quality):
+    # Encode an image, only the pixels and the color profile are kept
+    from PIL import Image
+
+    pillow_format = FORMATS[image_format][0]
+    if pillow_format == 'JPEG' and image.mode != 'RGB':
+        if 'A' in image.getbands() or 'transparency' in image.info:
+            # flatten transparent pixels on white instead of black
+            rgba = image.convert('RGBA')
+            image = Image.new('RGB', rgba.size, 'white')
+            image.paste(rgba, mask=rgba.getchannel('A'))
+        else:
+            image = image.convert('RGB')
+    options = {'optimize': True}
+    if image.info.get('icc_profile'):
+        options['icc_profile'] = image.info['icc_profile']
+    if pillow_format == 'JPEG':
+        options.update(quality=quality, progressive=True)
+    elif pillow_format == 'WEBP':
+        options.update(quality=quality, method=4)
+    image.save(destination, pillow_format, **options)
+
+
+def _resize(source, destination, width, image_format, quality):
+    # Write a copy of the image at most width pixels wide
+    from PIL import Image, ImageOps
+
+    try:
+        with Image.open(source) as image:
+            image = ImageOps.exif_transpose(image)
+            if image.width > width:
+                height = max(round(image.height * width / image.width), 1)
+                image = image.resize((width, height), Image.LANCZOS)
+            _save(image, destination, image_format, quality)
+    except (OSError, ValueError, Image.DecompressionBombError) as exc:
+        raise ImageError(str(exc))
+
+
+def reencode(upload, image_format, quality, max_dimension):
+    # Return an uploaded image as a compact ContentFile
+    # upright as the camera meant it, no bigger than max_dimension on
+    # either side and without EXIF or other metadata
+    from PIL import Image, ImageOps
+
+    output = io.BytesIO()
+    try:
+        upload.seek(0)
+        with Image.open(upload) as image:
+            # jpegs can be decoded straight at a fraction of their size
+            image.draft('RGB', (max_dimension, max_dimension))
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+            _save(image, output, image_format, quality)
+    except (OSError, ValueError, Image.DecompressionBombError) as exc:
+        raise ImageError(str(exc))
+
+    name = os.path.splitext(os.path.basename(upload.name))[0]
+
+    return ContentFile(
+        output.getvalue(), name=f'{name}.{FORMATS[image_format][1]}'
+    )
+
+
+class VariantCache:
+    # Resized variants kept on disk up to IMAGE_DERIVATIVE_CACHE_BYTES
+    # the least recently used variants are deleted past the limit, use
+    # is tracked with the access time of the files so every worker
+    # process shares the same cache
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._size = None
+        self._scanned = 0
+
+    def get(self, name, width, image_format, quality):
+        # Return the path of a variant, generating it on first use
+        source = os.path.join(settings.MEDIA_ROOT, name)
+        try:
+            source_mtime = os.stat(source).st_mtime
+        except OSError:
+            raise ImageError('Image not found')
+        relative = variant_name(
+            name, source_mtime, width, image_format, quality
+        )
+        path = os.path.join(settings.MEDIA_ROOT, relative)
+
+        deadline = time.monotonic() + GENERATE_WAIT_SECONDS
+        lock_key = f'images:generating:{relative}'
+        while not self._touch(path):
+            # one request generates a variant, the others wait for it
+            if cache.add(lock_key, True, GENERATE_WAIT_SECONDS):
+                try:
+                    self._generate(source, path, width, image_format, quality)
+                finally:
+                    cache.delete(lock_key)
+                break
+            if time.monotonic() >= deadline:
+                # whoever held the lock is gone, do it ourselves
+                self._generate(source, path, width, image_format, quality)
+                break
+            time.sleep(POLL_INTERVAL)
+
+        return relative
+
+    def _touch(self, path):
+        # Mark a variant as used, False when it doesn't exist
+        try:
+            file_stat = os.stat(path)
+        except OSError:
+            return False
+        now = time.time()
+        if now - file_stat.st_atime > TOUCH_INTERVAL:
+            # explicit times are set even on noatime mounts
+            os.utime(path, (now, file_stat.st_mtime))
+
+        return True
+
+    def _generate(self, source, path, width, image_format, quality):
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        descriptor, temporary = tempfile.mkstemp(dir=directory)
+        os.close(descriptor)
+        try:
+            _resize(source, temporary, width, image_format, quality)
+            # readers never see a partly written variant
+            os.replace(temporary, path)
+        except BaseException:
+            os.remove(temporary)
+            raise
+        self._added(os.path.getsize(path))
+
+    def _added(self, size):
+        # Evict when this process thinks the cache is over its size
+        # other workers add variants too, so the size is also rescanned
+        # once in a while
+        with self._lock:
+            stale = time.monotonic() - self._scanned > 60
+            if self._size is not None and not stale:
+                self._size += size
+                if self._size <= settings.IMAGE_DERIVATIVE_CACHE_BYTES:
+                    return
+            self._size = self.evict()
+            self._scanned = time.monotonic()
+
+    def evict(self):
+        # Delete the least recently used variants over the cache size
+        # down to 90% of it, return the size left
+        files = []
+        for directory, _, names in os.walk(derived_root()):
+            for name in names:
+                path = os.path.join(directory, name)
+                try:
+                    file_stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((file_stat.st_atime, file_stat.st_size, path))
+
+        total = sum(size for _, size, _ in files)
+        limit = settings.IMAGE_DERIVATIVE_CACHE_BYTES
+        if total <= limit:
+            return total
+        for _, size, path in sorted(files):
+            if total <= limit * 0.9:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+
+        return total
+
+
+variants = VariantCache()
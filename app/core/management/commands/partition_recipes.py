@@ -0,0 +1,41 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from core.partitioning import PartitioningError, partition_tables
+
+
+class Command(BaseCommand):
+    # Django command to move the recipe tables to hash partitions
+
+    help = 'Move the recipes and their links to hash partitioned tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--partitions', type=int, default=settings.RECIPE_PARTITIONS,
+            help='Number of partitions, RECIPE_PARTITIONS by default'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=10000,
+            help='Rows copied per statement'
+        )
+
+    def handle(self, *args, **options):
+        def progress(table, copied):
+            self.stdout.write(f'{table}: {copied} rows copied')
+
+        self.stdout.write(
+            f'Partitioning in {options["partitions"]} partitions, '
+            'writes to recipes wait until it is done...'
+        )
+        try:
+            copied = partition_tables(
+                connection, options['partitions'], options['batch_size'],
+                progress
+            )
+        except PartitioningError as exc:
+            raise CommandError(str(exc))
+        self.stdout.write(self.style.SUCCESS(
+            f'Partitioned {", ".join(copied)}, '
+            f'{sum(copied.values())} rows moved.'
+        ))
@@ -0,0 +1,116 @@
+import json
+import os
+import re
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+# boots the wsgi application and serves one request in a fresh
+# interpreter, this process has already imported everything
+BOOT_SCRIPT = '''
+import io, json, sys, time
+from importlib import import_module
+
+module, attribute, path = sys.argv[1:4]
+start = time.perf_counter()
+application = getattr(import_module(module), attribute)
+booted = time.perf_counter()
+statuses = []
+body = application({
+    'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': '',
+    'SERVER_NAME': 'localhost', 'SERVER_PORT': '80',
+    'wsgi.url_scheme': 'http', 'wsgi.input': io.BytesIO(),
+    'wsgi.errors': sys.stderr,
+}, lambda status, headers, exc_info=None: statuses.append(status))
+b''.join(body)
+served = time.perf_counter()
+print(json.dumps({
+    'boot': booted - start, 'request': served - booted,
+    'status': statuses[0], 'loaded': len(sys.modules),
+}))
+'''
+
+IMPORT_TIME = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+
+def parse_import_times(lines):
+    # Return (module, self us, cumulative us, depth) from -X importtime
+    for line in lines:
+        match = IMPORT_TIME.match(line)
+        if match:
+            own, cumulative, indent, module = match.groups()
+            yield module, int(own), int(cumulative), (len(indent) - 1) // 2
+
+
+def owner(module, app_modules):
+    # Return the installed app a module belongs to, or its top package
+    parts = module.split('.')
+    for end in range(len(parts), 0, -1):
+        label = app_modules.get('.'.join(parts[:end]))
+        if label:
+            return label
+
+    return parts[0]
+
+
+class Command(BaseCommand):
+    # Django command to report where worker startup time goes
+
+    help = 'Profile the import time of a fresh worker and its first request'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--path', default='/api/recipe/tags/',
+            help='Path of the first request served after boot'
+        )
+        parser.add_argument(
+            '--limit', type=int, default=20,
+            help='Slowest modules and apps to list'
+        )
+
+    def handle(self, *args, **options):
+        module, attribute = settings.WSGI_APPLICATION.rsplit('.', 1)
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', BOOT_SCRIPT,
+             module, attribute, options['path']],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            universal_newlines=True, env=os.environ.copy(),
+        )
+        if result.returncode:
+            raise CommandError(result.stderr.strip().splitlines()[-1])
+        timings = json.loads(result.stdout.strip().splitlines()[-1])
+        modules = list(parse_import_times(result.stderr.splitlines()))
+
+        app_modules = {
+            config.name: config.label for config in apps.get_app_configs()
+        }
+        per_owner = defaultdict(int)
+        for name, own, _, _ in modules:
+            per_owner[owner(name, app_modules)] += own
+
+        self.stdout.write(
+            f'Boot: {timings["boot"] * 1000:.1f} ms, '
+            f'first request to {options["path"]}: '
+            f'{timings["request"] * 1000:.1f} ms ({timings["status"]}), '
+            f'{timings["loaded"]} modules loaded'
+        )
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            'Slowest imports (cumulative ms, self ms):'
+        ))
+        slowest = sorted(modules, key=lambda item: -item[2])
+        for name, own, cumulative, depth in slowest[:options['limit']]:
+            self.stdout.write(
+                f'{cumulative / 1000:9.1f} {own / 1000:9.1f}  '
+                f'{"  " * depth}{name}'
+            )
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            'Import time per app or package (ms):'
+        ))
+        ranked = sorted(per_owner.items(), key=lambda item: -item[1])
+        for name, own in ranked[:options['limit']]:
+            self.stdout.write(f'{own / 1000:9.1f}  {name}')
@@ -0,0 +1,54 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.models import UserPurge
+from core.purge import run_purge
+
+
+class Command(BaseCommand):
+    # Django command to purge the data of deleted users in the background
+
+    help = 'Run the pending purges of deleted user accounts'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=None,
+            help='Rows deleted per transaction'
+        )
+        parser.add_argument(
+            '--retry', action='store_true',
+            help='Also run interrupted and failed purges'
+        )
+        parser.add_argument(
+            '--interval', type=int, default=0,
+            help='Keep running and look for purges every this many seconds'
+        )
+
+    def handle(self, *args, **options):
+        statuses = [UserPurge.PENDING]
+        if options['retry']:
+            statuses += [UserPurge.RUNNING, UserPurge.FAILED]
+
+        while True:
+            purges = UserPurge.objects.filter(
+                status__in=statuses
+            ).order_by('created_at')
+            for purge in purges:
+                self.stdout.write(f'Purging user {purge.user_id}...')
+                try:
+                    run = run_purge(purge, options['batch_size'], statuses)
+                except Exception as exc:
+                    self.stdout.write(self.style.ERROR(f'Failed: {exc}'))
+                    continue
+                if run:
+                    purge.refresh_from_db()
+                    self.stdout.write(self.style.SUCCESS(
+                        f'Deleted {purge.recipes_deleted} recipes, '
+                        f'{purge.tags_deleted} tags, '
+                        f'{purge.ingredients_deleted} ingredients and '
+                        f'{purge.images_deleted} images.'
+                    ))
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,29 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from recipe import stats
+
+
+class Command(BaseCommand):
+    # Django command to compute the recipe stats again from the recipes
+
+    help = 'Rebuild the recipe stats of every user or of the given ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user', type=int, action='append', dest='users',
+            help='Id of a user to rebuild, can be repeated'
+        )
+
+    def handle(self, *args, **options):
+        user_ids = options['users'] or get_user_model().objects.order_by(
+            'id'
+        ).values_list('id', flat=True).iterator()
+
+        rebuilt = 0
+        for user_id in user_ids:
+            stats.rebuild(user_id)
+            rebuilt += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt the recipe stats of {rebuilt} users.'
+        ))
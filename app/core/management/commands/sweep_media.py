@@ -0,0 +1,132 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.models import Recipe, ImageBlob
+
+
+def iter_files(root, relative_to):
+    # Yield (name, path, stat) for every file below root
+    # walks one directory at a time so memory stays flat
+    try:
+        entries = os.scandir(root)
+    except FileNotFoundError:
+        return
+    with entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                yield from iter_files(entry.path, relative_to)
+            elif entry.is_file(follow_symlinks=False):
+                name = os.path.relpath(entry.path, relative_to)
+                yield name.replace(os.sep, '/'), entry.path, entry.stat()
+
+
+def iter_batches(iterable, size):
+    # Group an iterable in lists of up to size items
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class Command(BaseCommand):
+    # Django command to delete recipe images no recipe references
+
+    help = 'Delete orphaned recipe image files older than a grace period'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--directory', default='uploads/recipe',
+            help='Directory inside MEDIA_ROOT to sweep'
+        )
+        parser.add_argument(
+            '--grace-seconds', type=int,
+            default=settings.MEDIA_SWEEP_GRACE_SECONDS,
+            help='Keep orphans younger than this, uploads in flight '
+                 'are not referenced yet'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Files checked against the database per query'
+        )
+        parser.add_argument(
+            '--max-deletes-per-second', type=float, default=0,
+            help='Throttle deletions, 0 for no limit'
+        )
+        parser.add_argument(
+            '--interval', type=int, default=0,
+            help='Keep running and sweep every this many seconds'
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Report the orphans without deleting them'
+        )
+
+    def _referenced(self, names):
+        # Return the names still used by a recipe or a stored blob
+        referenced = set(
+            Recipe.objects.filter(image__in=names).values_list(
+                'image', flat=True
+            )
+        )
+        referenced.update(
+            ImageBlob.objects.filter(
+                name__in=names, ref_count__gt=0
+            ).values_list('name', flat=True)
+        )
+
+        return referenced
+
+    def sweep(self, options):
+        # Sweep the directory once, return (scanned, deleted, bytes)
+        root = os.path.join(settings.MEDIA_ROOT, options['directory'])
+        cutoff = time.time() - options['grace_seconds']
+        rate = options['max_deletes_per_second']
+        scanned = deleted = freed = 0
+        last_delete = 0
+
+        files = iter_files(root, settings.MEDIA_ROOT)
+        for batch in iter_batches(files, options['batch_size']):
+            scanned += len(batch)
+            # only old files are worth a database lookup
+            old = [item for item in batch if item[2].st_mtime < cutoff]
+            if not old:
+                continue
+            referenced = self._referenced([name for name, _, _ in old])
+            for name, path, file_stat in old:
+                if name in referenced:
+                    continue
+                if options['dry_run']:
+                    self.stdout.write(f'Would delete {name}')
+                else:
+                    if rate:
+                        wait = last_delete + 1 / rate - time.monotonic()
+                        if wait > 0:
+                            time.sleep(wait)
+                        last_delete = time.monotonic()
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        continue
+                deleted += 1
+                freed += file_stat.st_size
+
+        return scanned, deleted, freed
+
+    def handle(self, *args, **options):
+        while True:
+            scanned, deleted, freed = self.sweep(options)
+            verb = 'Would delete' if options['dry_run'] else 'Deleted'
+            self.stdout.write(self.style.SUCCESS(
+                f'Scanned {scanned} files. '
+                f'{verb} {deleted} orphans ({freed} bytes).'
+            ))
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
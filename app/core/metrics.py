@@ -0,0 +1,176 @@
+import glob
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+
+
+METRICS = {
+    # name: (type, help)
+    'api_requests_total': (
+        'counter', 'Requests served by view, action, method and status.'
+    ),
+    'api_request_duration_seconds': (
+        'histogram', 'Time spent serving a request.'
+    ),
+    'api_request_db_seconds': (
+        'histogram', 'Time spent in database queries during a request.'
+    ),
+}
+
+
+def _escape(value):
+    return (
+        str(value).replace('\\', r'\\').replace('"', r'\"')
+        .replace('\n', r'\n')
+    )
+
+
+def _labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+
+    return '{%s}' % ','.join(
+        f'{key}="{_escape(value)}"' for key, value in pairs
+    )
+
+
+class MetricsRegistry:
+    # Counters and histograms of one process, updated under a lock
+    # with a directory set each process writes its values to its own
+    # file now and then, the endpoint adds up the files of every worker
+
+    def __init__(self, buckets):
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            # (name, labels) -> value
+            self._counters = {}
+            # (name, labels) -> [count per bucket..., over the last, sum]
+            self._histograms = {}
+            self._pid = os.getpid()
+            self._flushed = time.monotonic()
+
+    def _check_fork(self):
+        # a forked worker starts with a copy of the parent values
+        if self._pid != os.getpid():
+            self._counters, self._histograms = {}, {}
+            self._pid = os.getpid()
+
+    def inc(self, name, labels, amount=1):
+        # Add to a counter, labels are a tuple of (name, value) pairs
+        with self._lock:
+            self._check_fork()
+            key = (name, labels)
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, labels, value):
+        # Count a value in the bucket of a histogram
+        position = bisect_left(self.buckets, value)
+        with self._lock:
+            self._check_fork()
+            key = (name, labels)
+            values = self._histograms.get(key)
+            if values is None:
+                values = self._histograms[key] = [0] * (len(self.buckets) + 2)
+            values[position] += 1
+            values[-1] += value
+
+    def snapshot(self):
+        # Return the values of this process as JSON friendly lists
+        with self._lock:
+            self._check_fork()
+            return {
+                'buckets': list(self.buckets),
+                'counters': [
+                    [name, list(labels), value]
+                    for (name, labels), value in self._counters.items()
+                ],
+                'histograms': [
+                    [name, list(labels), list(values)]
+                    for (name, labels), values in self._histograms.items()
+                ],
+            }
+
+    def flush(self, directory):
+        # Write the values of this process to its file in the directory
+        path = os.path.join(directory, f'{os.getpid()}.json')
+        temporary = f'{path}.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(self.snapshot(), f)
+        # readers never see a half written file
+        os.replace(temporary, path)
+        self._flushed = time.monotonic()
+
+    def maybe_flush(self):
+        # Flush to the shared directory at most every few seconds
+        directory = settings.METRICS_DIR
+        if directory and (time.monotonic() - self._flushed >=
+                          settings.METRICS_FLUSH_SECONDS):
+            self.flush(directory)
+
+    def collect(self):
+        # Return the snapshots of every worker, or of this process only
+        directory = settings.METRICS_DIR
+        if not directory:
+            return [self.snapshot()]
+
+        self.flush(directory)
+        snapshots = []
+        for path in glob.glob(os.path.join(directory, '*.json')):
+            try:
+                with open(path) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            # values counted with other buckets can't be added up
+            if tuple(snapshot['buckets']) == self.buckets:
+                snapshots.append(snapshot)
+
+        return snapshots
+
+    def render(self):
+        # Return every metric in the Prometheus text format
+        counters, histograms = {}, {}
+        for snapshot in self.collect():
+            for name, labels, value in snapshot['counters']:
+                key = (name, tuple(map(tuple, labels)))
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, values in snapshot['histograms']:
+                key = (name, tuple(map(tuple, labels)))
+                total = histograms.setdefault(key, [0] * len(values))
+                for position, value in enumerate(values):
+                    total[position] += value
+
+        lines = []
+        for name, (kind, description) in METRICS.items():
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} {kind}')
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f'{name}{_labels(labels)} {value}')
+            for (metric, labels), values in sorted(histograms.items()):
+                if metric == name:
+                    lines.extend(self._histogram_lines(name, labels, values))
+
+        return '\n'.join(lines) + '\n'
+
+    def _histogram_lines(self, name, labels, values):
+        cumulative = 0
+        bounds = [repr(float(bound)) for bound in self.buckets] + ['+Inf']
+        for bound, count in zip(bounds, values):
+            cumulative += count
+            yield f'{name}_bucket{_labels(labels, [("le", bound)])} ' \
+                  f'{cumulative}'
+        yield f'{name}_sum{_labels(labels)} {values[-1]}'
+        yield f'{name}_count{_labels(labels)} {cumulative}'
+
+
+registry = MetricsRegistry(settings.METRICS_BUCKETS)
@@ -0,0 +1,195 @@
+import hashlib
+import logging
+import random
+import time
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from core import db_router
+
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+access_logger = logging.getLogger('access')
+
+# other methods share a label so clients can't add time series
+METRICS_METHODS = SAFE_METHODS + ('POST', 'PUT', 'PATCH', 'DELETE')
+
+
+class ReplicaRoutingMiddleware:
+    # Read from a replica on safe requests to the API
+    # clients that wrote recently stick to the primary for a while
+    # so they always read their own writes
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def _sticky_key(self, request):
+        # identify the client by its credentials, anonymous clients
+        # are never pinned to the primary
+        credentials = request.META.get('HTTP_AUTHORIZATION')
+        if not credentials:
+            return None
+        digest = hashlib.sha1(credentials.encode()).hexdigest()
+
+        return f'db:primary-sticky:{digest}'
+
+    def __call__(self, request):
+        sticky_key = self._sticky_key(request)
+        replica = None
+        # without a shared cache a write on another worker would not
+        # pin the client, it could miss its own writes on a replica
+        if (settings.CACHE_SHARED and request.method in SAFE_METHODS and
+                request.path.startswith(settings.DATABASE_REPLICA_PATHS) and
+                not (sticky_key and cache.get(sticky_key))):
+            replica = db_router.choose_replica()
+
+        with db_router.use_replica(replica):
+            response = self.get_response(request)
+
+        if (request.method not in SAFE_METHODS and sticky_key and
+                settings.DATABASE_REPLICAS):
+            cache.set(
+                sticky_key, True, settings.DATABASE_PRIMARY_STICKY_SECONDS
+            )
+
+        return response
+
+
+class QueryStats:
+    # Count and time the queries run on every connection of this thread
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self._wrappers = None
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - start
+
+    def __enter__(self):
+        self._wrappers = ExitStack()
+        for connection in connections.all():
+            self._wrappers.enter_context(connection.execute_wrapper(self))
+
+        return self
+
+    def __exit__(self, *exc_info):
+        self._wrappers.close()
+
+
+@contextmanager
+def track_queries(request):
+    # Measure the queries of a request once for every middleware using it
+    stats = getattr(request, 'query_stats', None)
+    if stats is not None:
+        yield stats
+        return
+    with QueryStats() as stats:
+        request.query_stats = stats
+        yield stats
+
+
+def set_view_labels(request, view_func):
+    # Keep the view and viewset action serving a request on the request
+    view = getattr(view_func, 'cls', None)
+    name = view.__name__ if view else view_func.__name__
+    method = request.method.lower()
+    # viewsets map the method to an action, other views handle it
+    actions = getattr(view_func, 'actions', None) or {method: method}
+    request.view_labels = (name, actions.get(method, method))
+
+
+class MetricsMiddleware:
+    # Record the latency, status and database time of every request
+    # labelled by the view and viewset action that served it
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        set_view_labels(request, view_func)
+
+    def __call__(self, request):
+        from core.metrics import registry
+
+        start = time.perf_counter()
+        with track_queries(request) as queries:
+            response = self.get_response(request)
+        duration = time.perf_counter() - start
+
+        # requests that didn't resolve to a view are counted together
+        view, action = getattr(request, 'view_labels', ('none', 'none'))
+        method = request.method
+        if method not in METRICS_METHODS:
+            method = 'other'
+        labels = (('action', action), ('view', view))
+        registry.inc('api_requests_total', (
+            ('action', action), ('method', method),
+            ('status', str(response.status_code)), ('view', view),
+        ))
+        registry.observe('api_request_duration_seconds', labels, duration)
+        registry.observe('api_request_db_seconds', labels, queries.duration)
+        registry.maybe_flush()
+
+        return response
+
+
+class AccessLogMiddleware:
+    # Log one JSON line per request to the access logger
+    # the handler in LOGGING queues the record for a background thread
+    # (core.access_log), a sample of the requests is logged under load
+    # but errors and slow requests always are
+
+    def __init__(self, get_response):
+        if not settings.ACCESS_LOG_ENABLED:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        set_view_labels(request, view_func)
+
+    def __call__(self, request):
+        start = time.perf_counter()
+        with track_queries(request) as queries:
+            response = self.get_response(request)
+        duration = time.perf_counter() - start
+
+        rate = settings.ACCESS_LOG_SAMPLE_RATE
+        if (response.status_code < 500 and
+                duration < settings.ACCESS_LOG_SLOW_SECONDS and
+                random.random() >= rate):
+            return response
+
+        user = getattr(request, 'user', None)
+        view, action = getattr(request, 'view_labels', (None, None))
+        access_logger.info(
+            '%s %s %s', request.method, request.path, response.status_code,
+            extra={'fields': {
+                'user_id': user.id if user and user.is_authenticated
+                else None,
+                'method': request.method,
+                'path': request.path,
+                'view': view,
+                'action': action,
+                'status': response.status_code,
+                'duration_ms': round(duration * 1000, 2),
+                'queries': queries.count,
+                'db_ms': round(queries.duration * 1000, 2),
+                'bytes': None if response.streaming
+                else len(response.content),
+                'sample_rate': rate,
+            }}
+        )
+
+        return response
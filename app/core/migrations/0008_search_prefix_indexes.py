@@ -0,0 +1,39 @@
+from django.db import migrations
+
+
+# UPPER(column::text) LIKE 'PREFIX%' is the SQL django generates for
+# istartswith on postgres, text_pattern_ops lets it use a btree index
+INDEXES = (
+    ('core_user_email_prefix_idx', 'core_user', 'email'),
+    ('core_recipe_title_prefix_idx', 'core_recipe', 'title'),
+    ('core_tag_name_prefix_idx', 'core_tag', 'name'),
+    ('core_ingredient_name_prefix_idx', 'core_ingredient', 'name'),
+)
+
+
+def create_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, table, column in INDEXES:
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {name} ON {table} '
+            f'(UPPER({column}::text) text_pattern_ops)'
+        )
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, table, column in INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_recipe_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
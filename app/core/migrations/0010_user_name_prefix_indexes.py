@@ -0,0 +1,37 @@
+from django.db import migrations
+
+
+# per user prefix lookups of the tag and ingredient autocomplete
+# user_id = %s AND UPPER(name::text) LIKE 'PREFIX%'
+INDEXES = (
+    ('core_tag_user_name_prefix_idx', 'core_tag'),
+    ('core_ingredient_user_name_prefix_idx', 'core_ingredient'),
+)
+
+
+def create_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, table in INDEXES:
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {name} ON {table} '
+            f'(user_id, UPPER(name::text) text_pattern_ops)'
+        )
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, table in INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_userpurge'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
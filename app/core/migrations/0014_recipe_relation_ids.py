@@ -0,0 +1,48 @@
+# Generated by Django 2.2.28 on 2026-10-19 19:46
+
+import django.contrib.postgres.fields
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+
+# copy the links existing before the arrays were kept in sync
+BACKFILL = '''
+UPDATE core_recipe SET
+    tag_ids = ARRAY(
+        SELECT tag_id FROM core_recipe_tags
+        WHERE recipe_id = core_recipe.id ORDER BY tag_id
+    ),
+    ingredient_ids = ARRAY(
+        SELECT ingredient_id FROM core_recipe_ingredients
+        WHERE recipe_id = core_recipe.id ORDER BY ingredient_id
+    )
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_recipestats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='ingredient_ids',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), blank=True, default=list, size=None),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='tag_ids',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), blank=True, default=list, size=None),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['tag_ids'], name='core_recipe_tag_ids_gin'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['ingredient_ids'], name='core_recipe_ingredient_ids_gin'),
+        ),
+        migrations.RunSQL(BACKFILL, migrations.RunSQL.noop),
+    ]
@@ -1,6 +1,8 @@
 import uuid
 import os
 from django.db import models
+from django.contrib.postgres.fields import ArrayField, JSONField
+from django.contrib.postgres.indexes import GinIndex
 # we need this to create or user manager class
 # to extend our user model with import
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, \
@@ -108,7 +110,137 @@ class Recipe(models.Model):
     # many to many fields as Foreign key and the name of the class as parameter
     ingredients = models.ManyToManyField('Ingredient')
     tags = models.ManyToManyField('Tag')
-    image = models.ImageField(null=True, upload_to=recipe_image_file_patch)
+    # copies of the linked ids kept in sync by recipe.signals, recipes
+    # are filtered and listed without joining the m2m tables
+    ingredient_ids = ArrayField(
+        models.IntegerField(), default=list, blank=True
+    )
+    tag_ids = ArrayField(models.IntegerField(), default=list, blank=True)
+    # indexed for the reference lookups of the sweep_media command
+    image = models.ImageField(
+        null=True, upload_to=recipe_image_file_patch, db_index=True
+    )
+    # size of the image as uploaded and as stored after re-encoding
+    image_original_bytes = models.PositiveIntegerField(null=True, blank=True)
+    image_bytes = models.PositiveIntegerField(null=True, blank=True)
+    # incremented by every update, clients send it back in If-Match
+    version = models.PositiveIntegerField(default=1)
+
+    class Meta:
+        # every recipe list is filtered by user and sorted on one of these
+        # columns, id breaks ties so a page is a single index range scan
+        indexes = [
+            models.Index(
+                fields=['user', 'id'], name='core_recipe_user_id_idx'
+            ),
+            models.Index(
+                fields=['user', 'title', 'id'], name='core_recipe_title_idx'
+            ),
+            models.Index(
+                fields=['user', 'time_minutes', 'id'],
+                name='core_recipe_time_idx'
+            ),
+            models.Index(
+                fields=['user', 'price', 'id'], name='core_recipe_price_idx'
+            ),
+            # containment (@>) and overlap (&&) of the linked ids
+            GinIndex(fields=['tag_ids'], name='core_recipe_tag_ids_gin'),
+            GinIndex(
+                fields=['ingredient_ids'],
+                name='core_recipe_ingredient_ids_gin'
+            ),
+        ]
 
     def __str__(self):
         return self.title
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        recipe = super().from_db(db, field_names, values)
+        recipe._stored_user_id = recipe.__dict__.get('user_id')
+
+        return recipe
+
+    @property
+    def stored_user_id(self):
+        # The owner as stored in the database, the row is found with it
+        # even when the recipe is being given to another user
+        return getattr(self, '_stored_user_id', None) or self.user_id
+
+    def _do_update(self, base_qs, *args, **kwargs):
+        # on partitioned tables saves name the stored owner too, so the
+        # single partition of the user is searched, see core.partitioning
+        if settings.RECIPE_PARTITIONS:
+            base_qs = base_qs.filter(user_id=self.stored_user_id)
+        updated = super()._do_update(base_qs, *args, **kwargs)
+        self._stored_user_id = self.user_id
+
+        return updated
+
+
+class ImageBlob(models.Model):
+    # A stored file shared by every upload with the same content
+    # used by the content addressed storage to count references
+    name = models.CharField(max_length=255, unique=True)
+    size = models.PositiveIntegerField()
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.name
+
+
+class UserPurge(models.Model):
+    # Progress of the background deletion of a user and their data
+    # the user id is not a foreign key, the row outlives the user
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+
+    user_id = models.IntegerField(db_index=True)
+    email = models.EmailField(max_length=255)
+    status = models.CharField(
+        max_length=10, choices=STATUS_CHOICES, default=PENDING
+    )
+    recipes_deleted = models.PositiveIntegerField(default=0)
+    tags_deleted = models.PositiveIntegerField(default=0)
+    ingredients_deleted = models.PositiveIntegerField(default=0)
+    images_deleted = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f'{self.email} ({self.status})'
+
+
+class RecipeStats(models.Model):
+    # Summary of the recipes of a user, updated by every recipe write
+    # so dashboards read a single row, see recipe.stats
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='recipe_stats'
+    )
+    recipe_count = models.PositiveIntegerField(default=0)
+    time_minutes_total = models.BigIntegerField(default=0)
+    price_total = models.DecimalField(
+        max_digits=14, decimal_places=2, default=0
+    )
+    # recipes per range of RECIPE_STATS_PRICE_BUCKETS
+    price_histogram = JSONField(default=list)
+    # recipes per tag id
+    tag_counts = JSONField(default=dict)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'Recipe stats of user {self.user_id}'
@@ -0,0 +1,151 @@
+import re
+
+from django.db import transaction
+
+from core.models import Recipe
+
+
+# hash partitioned tables and their partition key, the recipes by user
+# and their links by recipe since the links have no user column and
+# are always looked up by recipe, the links come first so nothing
+# references the recipe table anymore when it is replaced
+# queries naming the user of the recipes are planned against a single
+# partition, the recipe views and Recipe.save always do, deletes go
+# through the django collector by id and check every partition's key
+TABLES = (
+    (Recipe.tags.through._meta.db_table, 'recipe_id'),
+    (Recipe.ingredients.through._meta.db_table, 'recipe_id'),
+    (Recipe._meta.db_table, 'user_id'),
+)
+# temporary suffix of the new tables, indexes and constraints
+SUFFIX = '_new'
+
+CONSTRAINTS = '''
+SELECT conname, contype, pg_get_constraintdef(oid), confrelid::regclass::text
+FROM pg_constraint
+WHERE conrelid = %s::regclass AND contype IN ('p', 'u', 'f')
+'''
+# indexes not created by a constraint
+INDEXES = '''
+SELECT indexrelid::regclass::text, pg_get_indexdef(indexrelid)
+FROM pg_index
+WHERE indrelid = %s::regclass AND NOT EXISTS (
+    SELECT 1 FROM pg_constraint WHERE conindid = pg_index.indexrelid
+)
+'''
+INDEX_DEFINITION = re.compile(r'^CREATE (UNIQUE )?INDEX \S+ ON (ONLY )?\S+')
+
+
+class PartitioningError(Exception):
+    # The tables can't be partitioned by this database
+    pass
+
+
+def is_partitioned(connection, table):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT 1 FROM pg_partitioned_table '
+            'WHERE partrelid = %s::regclass', [table]
+        )
+        return cursor.fetchone() is not None
+
+
+def _create_partitioned(cursor, table, key, partitions):
+    # Create an empty copy of a table made of hash partitions
+    # with the same columns, defaults, checks, keys and indexes
+    new = f'{table}{SUFFIX}'
+    cursor.execute(
+        f'CREATE TABLE {new} (LIKE {table} INCLUDING DEFAULTS '
+        f'INCLUDING CONSTRAINTS) PARTITION BY HASH ({key})'
+    )
+    for remainder in range(partitions):
+        cursor.execute(
+            f'CREATE TABLE {table}_p{remainder} PARTITION OF {new} '
+            f'FOR VALUES WITH (MODULUS {partitions}, '
+            f'REMAINDER {remainder})'
+        )
+
+    renames = []
+    partitioned = {name for name, _ in TABLES}
+    cursor.execute(CONSTRAINTS, [table])
+    for name, kind, definition, referenced in cursor.fetchall():
+        if kind == 'f' and referenced in partitioned:
+            # a partitioned table can only be referenced on its whole
+            # key, the links are deleted by django with their recipe
+            continue
+        if kind == 'p':
+            # unique keys of a partitioned table include its key
+            definition = f'PRIMARY KEY (id, {key})'
+        cursor.execute(
+            f'ALTER TABLE {new} ADD CONSTRAINT {name}{SUFFIX} {definition}'
+        )
+        renames.append(
+            f'ALTER TABLE {table} RENAME CONSTRAINT {name}{SUFFIX} TO {name}'
+        )
+
+    cursor.execute(INDEXES, [table])
+    for name, definition in cursor.fetchall():
+        cursor.execute(INDEX_DEFINITION.sub(
+            lambda match: (
+                f'CREATE {match.group(1) or ""}INDEX {name}{SUFFIX} ON {new}'
+            ),
+            definition
+        ))
+        renames.append(f'ALTER INDEX {name}{SUFFIX} RENAME TO {name}')
+
+    return renames
+
+
+def _copy_rows(cursor, table, batch_size, progress):
+    # Copy the rows to the new table in batches of increasing ids
+    last_id, copied = 0, 0
+    while True:
+        cursor.execute(
+            f'WITH copied AS (INSERT INTO {table}{SUFFIX} '
+            f'SELECT * FROM {table} WHERE id > %s ORDER BY id LIMIT %s '
+            f'RETURNING id) SELECT count(*), max(id) FROM copied',
+            [last_id, batch_size]
+        )
+        count, last_id = cursor.fetchone()
+        if not count:
+            return copied
+        copied += count
+        progress(table, copied)
+
+
+def _replace(cursor, table, renames):
+    # Put the partitioned table in place of the old one
+    cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [table])
+    sequence = cursor.fetchone()[0]
+    # the sequence would be dropped with the column owning it
+    cursor.execute(f'ALTER SEQUENCE {sequence} OWNED BY {table}{SUFFIX}.id')
+    cursor.execute(f'DROP TABLE {table}')
+    cursor.execute(f'ALTER TABLE {table}{SUFFIX} RENAME TO {table}')
+    for rename in renames:
+        cursor.execute(rename)
+
+
+def partition_tables(connection, partitions, batch_size=10000,
+                     progress=lambda table, copied: None):
+    # Move the recipes and their links to hash partitioned tables
+    # writes wait for the move, reads go on until the tables are swapped
+    # return the number of rows copied per table
+    if connection.vendor != 'postgresql' or connection.pg_version < 110000:
+        raise PartitioningError('Hash partitioning needs PostgreSQL 11.')
+    if partitions < 1:
+        raise PartitioningError('Use at least one partition.')
+    copied = {}
+    with transaction.atomic(using=connection.alias), \
+            connection.cursor() as cursor:
+        # deferred key checks pending on the old tables block dropping
+        cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+        tables = [table for table, _ in TABLES]
+        cursor.execute(f'LOCK TABLE {", ".join(tables)} IN EXCLUSIVE MODE')
+        if any(is_partitioned(connection, table) for table in tables):
+            raise PartitioningError('The recipe tables are partitioned.')
+        for table, key in TABLES:
+            renames = _create_partitioned(cursor, table, key, partitions)
+            copied[table] = _copy_rows(cursor, table, batch_size, progress)
+            _replace(cursor, table, renames)
+
+    return copied
@@ -0,0 +1,119 @@
+import logging
+import threading
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction, connection
+from django.db.models import F
+from django.utils import timezone
+
+from core.models import Recipe, Tag, Ingredient, UserPurge
+from recipe import stats
+
+
+logger = logging.getLogger(__name__)
+
+
+def _progress(purge, **counts):
+    # Add the counts of a finished batch to the purge progress
+    UserPurge.objects.filter(pk=purge.pk).update(
+        updated_at=timezone.now(),
+        **{field: F(field) + count for field, count in counts.items()}
+    )
+
+
+def _purge_recipes(purge, batch_size):
+    # Delete the recipes of the user and their links, batch by batch
+    storage = Recipe._meta.get_field('image').storage
+    while True:
+        with transaction.atomic():
+            ids = list(Recipe.objects.filter(
+                user_id=purge.user_id
+            ).values_list('id', flat=True)[:batch_size])
+            if not ids:
+                return
+            images = [
+                name for name in Recipe.objects.filter(
+                    id__in=ids
+                ).values_list('image', flat=True)
+                if name
+            ]
+            # the tags/ingredients links go with a single delete each
+            Recipe.objects.filter(id__in=ids).delete()
+
+        # files can't be rolled back, remove them once the rows are gone
+        # a reference counting storage already released them on delete
+        if not getattr(storage, 'tracks_references', False):
+            for name in images:
+                storage.delete(name)
+        _progress(purge, recipes_deleted=len(ids), images_deleted=len(images))
+
+
+def _purge_model(purge, model, field, batch_size):
+    # Delete the tags or ingredients of the user, batch by batch
+    while True:
+        with transaction.atomic():
+            ids = list(model.objects.filter(
+                user_id=purge.user_id
+            ).values_list('id', flat=True)[:batch_size])
+            if not ids:
+                return
+            model.objects.filter(id__in=ids).delete()
+        _progress(purge, **{field: len(ids)})
+
+
+def run_purge(purge, batch_size=None, statuses=(UserPurge.PENDING,)):
+    # Delete everything a user owns in short transactions, then the user
+    # the purge is claimed first so two workers never run the same one,
+    # interrupted or failed purges can be run again with their status
+    batch_size = batch_size or settings.USER_PURGE_BATCH_SIZE
+    claimed = UserPurge.objects.filter(
+        pk=purge.pk, status__in=statuses
+    ).update(status=UserPurge.RUNNING, updated_at=timezone.now())
+    if not claimed:
+        return False
+    try:
+        # the stats of the user go with it, not worth keeping up to date
+        with stats.paused():
+            _purge_recipes(purge, batch_size)
+            _purge_model(purge, Tag, 'tags_deleted', batch_size)
+            _purge_model(
+                purge, Ingredient, 'ingredients_deleted', batch_size
+            )
+        # nothing big is left to cascade from the user row
+        get_user_model().objects.filter(id=purge.user_id).delete()
+    except Exception as exc:
+        logger.exception('Purge of user %s failed', purge.user_id)
+        UserPurge.objects.filter(pk=purge.pk).update(
+            status=UserPurge.FAILED, error=str(exc)
+        )
+        raise
+
+    UserPurge.objects.filter(pk=purge.pk).update(
+        status=UserPurge.DONE, error='', finished_at=timezone.now()
+    )
+    return True
+
+
+def _run_in_thread(purge_id):
+    try:
+        run_purge(UserPurge.objects.get(pk=purge_id))
+    except Exception:
+        # already recorded on the purge, the worker command can retry it
+        pass
+    finally:
+        connection.close()
+
+
+def schedule_purge(user):
+    # Deactivate a user right away and purge their data in the background
+    user.is_active = False
+    user.save(update_fields=['is_active'])
+    purge = UserPurge.objects.create(user_id=user.id, email=user.email)
+    if settings.USER_PURGE_IN_THREAD:
+        # start once the purge row is committed and visible to the thread
+        transaction.on_commit(lambda: threading.Thread(
+            target=_run_in_thread, args=(purge.pk,), daemon=True
+        ).start())
+
+    return purge
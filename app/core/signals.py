@@ -0,0 +1,52 @@
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from core.models import Recipe
+
+
+def _image_storage():
+    # Return the recipe image storage when it counts references
+    storage = Recipe._meta.get_field('image').storage
+    if getattr(storage, 'tracks_references', False):
+        return storage
+
+    return None
+
+
+@receiver(pre_save, sender=Recipe)
+def remember_previous_image(sender, instance, **kwargs):
+    # Keep the stored image name to release it if it gets replaced
+    if _image_storage() is None or instance.pk is None:
+        return
+    # a pending upload adds a reference when the field saves it, the
+    # bulk upload stores its files itself and sets the flag
+    if instance.image and not instance.image._committed:
+        instance._image_stored = True
+    instance._previous_image = Recipe.objects.filter(
+        user_id=instance.stored_user_id, pk=instance.pk
+    ).values_list('image', flat=True).first()
+
+
+@receiver(post_save, sender=Recipe)
+def release_replaced_image(sender, instance, **kwargs):
+    # Release the reference held by an image replaced by a new upload
+    # clearing the image goes through FieldFile.delete which releases it
+    # the same content uploaded again has the same name but still added
+    # a reference
+    storage = _image_storage()
+    previous = getattr(instance, '_previous_image', None)
+    stored = getattr(instance, '_image_stored', False)
+    instance._previous_image = None
+    instance._image_stored = False
+    if storage is None or not previous or not instance.image:
+        return
+    if stored or previous != instance.image.name:
+        storage.delete(previous)
+
+
+@receiver(post_delete, sender=Recipe)
+def release_deleted_image(sender, instance, **kwargs):
+    # Release the reference held by the image of a deleted recipe
+    storage = _image_storage()
+    if storage is not None and instance.image:
+        storage.delete(instance.image.name)
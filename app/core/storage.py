@@ -0,0 +1,71 @@
+import hashlib
+import posixpath
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import F
+
+from core.models import ImageBlob
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    # Store each unique file once, named after the sha256 of its content
+    # every save of the same content adds a reference to the stored file
+    # and the file is removed when its last reference is deleted
+    tracks_references = True
+
+    def _hashed_name(self, name, content):
+        # Return the content addressed name inside the upload directory
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        hexdigest = digest.hexdigest()
+        ext = posixpath.splitext(name)[1].lower()
+
+        # two character fan out keeps directories small
+        return posixpath.join(
+            posixpath.dirname(name), hexdigest[:2], f'{hexdigest}{ext}'
+        )
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self._hashed_name(name.replace('\\', '/'), content)
+
+        with transaction.atomic():
+            # the row lock serializes concurrent uploads of the same file
+            blob, created = ImageBlob.objects.select_for_update(
+            ).get_or_create(name=name, defaults={'size': content.size})
+            # re-uploads of stored content skip the write completely
+            if not self.exists(name):
+                self._save(name, content)
+            ImageBlob.objects.filter(pk=blob.pk).update(
+                ref_count=F('ref_count') + 1
+            )
+
+        return name
+
+    def delete(self, name):
+        # Drop one reference, the file goes with the last one
+        with transaction.atomic():
+            blob = ImageBlob.objects.select_for_update().filter(
+                name=name
+            ).first()
+            if blob is not None and blob.ref_count > 1:
+                ImageBlob.objects.filter(pk=blob.pk).update(
+                    ref_count=F('ref_count') - 1
+                )
+                return
+            if blob is not None:
+                blob.delete()
+        # a rolled back delete leaves rows pointing at the file
+        transaction.on_commit(lambda: self._unlink(name))
+
+    def _unlink(self, name):
+        # Remove the file unless it was uploaded again in the meantime
+        if not ImageBlob.objects.filter(name=name).exists():
+            super().delete(name)
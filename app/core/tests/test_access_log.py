@@ -0,0 +1,89 @@
+import json
+import logging
+import os
+import tempfile
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework.test import APIClient
+
+from core import middleware
+from core.access_log import BackgroundHandler, JSONFormatter
+
+
+TAGS_URL = reverse('recipe:tag-list')
+
+
+class BackgroundHandlerTests(TestCase):
+
+    def setUp(self):
+        descriptor, self.path = tempfile.mkstemp()
+        os.close(descriptor)
+        self.addCleanup(os.remove, self.path)
+
+    def test_records_written_as_json(self):
+        # Test records are written by the background thread as JSON
+        handler = BackgroundHandler(filename=self.path)
+        handler.setFormatter(JSONFormatter())
+        logger = logging.getLogger('test.access')
+        logger.addHandler(handler)
+        self.addCleanup(logger.removeHandler, handler)
+
+        logger.warning('GET %s', '/a/', extra={'fields': {'status': 200}})
+        logger.warning('GET %s', '/b/', extra={'fields': {'status': 404}})
+        handler.flush()
+        handler.close()
+
+        with open(self.path) as f:
+            lines = [json.loads(line) for line in f]
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(lines[0]['message'], 'GET /a/')
+        self.assertEqual(lines[0]['status'], 200)
+        self.assertEqual(lines[1]['status'], 404)
+
+    def test_records_dropped_when_queue_full(self):
+        # Test a full queue drops records instead of blocking
+        handler = BackgroundHandler(filename=self.path, maxsize=1)
+        record = logging.makeLogRecord({'msg': 'GET /'})
+
+        handler.enqueue(record)
+        handler.enqueue(record)
+
+        self.assertEqual(handler.dropped, 1)
+        handler.close()
+
+
+@override_settings(ACCESS_LOG_ENABLED=True)
+class AccessLogMiddlewareTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'test@email.com',
+            'test1234'
+        )
+        self.client.force_authenticate(self.user)
+
+    @patch.object(middleware.access_logger, 'info')
+    def test_request_logged(self, info):
+        # Test a request is logged with its user, view and costs
+        res = self.client.get(TAGS_URL)
+
+        fields = info.call_args[1]['extra']['fields']
+        self.assertEqual(fields['user_id'], self.user.id)
+        self.assertEqual(fields['view'], 'TagViewSet')
+        self.assertEqual(fields['action'], 'list')
+        self.assertEqual(fields['status'], 200)
+        self.assertEqual(fields['bytes'], len(res.content))
+        self.assertGreaterEqual(fields['queries'], 1)
+
+    @override_settings(ACCESS_LOG_SAMPLE_RATE=0)
+    @patch.object(middleware.access_logger, 'info')
+    def test_requests_sampled(self, info):
+        # Test requests left out of the sample are not logged
+        self.client.get(TAGS_URL)
+
+        info.assert_not_called()
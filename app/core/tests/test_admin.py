@@ -2,6 +2,9 @@ from django.test import TestCase, Client
 from django.contrib.auth import get_user_model
 from django.urls import reverse
 
+from core import models
+from core.admin import EstimatedCountPaginator
+
 
 class AdminSiteTests(TestCase):
 
@@ -42,3 +45,45 @@ class AdminSiteTests(TestCase):
         res = self.client.get(url)
 
         self.assertEqual(res.status_code, 200)
+
+    def test_recipe_pages(self):
+        # test that the recipe list, search and change pages work
+        tag = models.Tag.objects.create(user=self.user, name='Vegan')
+        recipe = models.Recipe.objects.create(
+            user=self.user, title='Tofu curry', time_minutes=10, price=5.00
+        )
+        recipe.tags.add(tag)
+
+        res1 = self.client.get(reverse('admin:core_recipe_changelist'))
+        res2 = self.client.get(
+            reverse('admin:core_recipe_changelist'), {'q': 'tofu'}
+        )
+        res3 = self.client.get(
+            reverse('admin:core_recipe_change', args=[recipe.id])
+        )
+
+        self.assertContains(res1, recipe.title)
+        self.assertContains(res2, recipe.title)
+        self.assertEqual(res3.status_code, 200)
+
+    def test_tag_autocomplete(self):
+        # test that tags can be searched by the autocomplete widget
+        models.Tag.objects.create(user=self.user, name='Vegan')
+        models.Tag.objects.create(user=self.user, name='Dessert')
+
+        url = reverse('admin:core_tag_autocomplete')
+        res = self.client.get(url, {'term': 've'})
+
+        self.assertContains(res, 'Vegan')
+        self.assertNotContains(res, 'Dessert')
+
+    def test_estimated_count_falls_back_to_count(self):
+        # test that small or filtered tables are counted exactly
+        models.Tag.objects.create(user=self.user, name='Vegan')
+        models.Tag.objects.create(user=self.user, name='Dessert')
+        tags = models.Tag.objects.order_by('id')
+
+        self.assertEqual(EstimatedCountPaginator(tags, 10).count, 2)
+        self.assertEqual(
+            EstimatedCountPaginator(tags.filter(name='Vegan'), 10).count, 1
+        )
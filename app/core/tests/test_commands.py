@@ -1,8 +1,17 @@
+import os
+import shutil
+import tempfile
+import time
+from io import StringIO
 from unittest.mock import patch
 
+from django.contrib.auth import get_user_model
 from django.core.management import call_command
 from django.db.utils import OperationalError
-from django.test import TestCase
+from django.test import TestCase, override_settings
+
+from core.management.commands.profile_startup import parse_import_times
+from core.models import Recipe, RecipeStats
 
 
 class CommandTests(TestCase):
@@ -28,3 +37,103 @@ class CommandTests(TestCase):
             gi.side_effect = [OperationalError] * 5 + [True]
             call_command('wait_for_db')
             self.assertEqual(gi.call_count, 6)
+
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class SweepMediaCommandTests(TestCase):
+
+    def setUp(self):
+        self.directory = os.path.join(MEDIA_ROOT, 'uploads/recipe')
+        os.makedirs(self.directory, exist_ok=True)
+        user = get_user_model().objects.create_user(
+            'test@email.com', 'test1234'
+        )
+        Recipe.objects.create(
+            user=user, title='Ceviche', time_minutes=10, price=20.00,
+            image='uploads/recipe/used.jpg'
+        )
+        self.used = self._create_file('used.jpg', age=7200)
+        self.orphan = self._create_file('orphan.jpg', age=7200)
+        self.recent = self._create_file('recent.jpg', age=0)
+
+    def tearDown(self):
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def _create_file(self, name, age):
+        # create an image file modified age seconds ago
+        path = os.path.join(self.directory, name)
+        with open(path, 'wb') as f:
+            f.write(b'image')
+        modified = time.time() - age
+        os.utime(path, (modified, modified))
+        return path
+
+    def test_sweep_deletes_old_orphans(self):
+        # Test only orphans older than the grace period are deleted
+        call_command(
+            'sweep_media', grace_seconds=3600, batch_size=2, stdout=StringIO()
+        )
+
+        self.assertTrue(os.path.exists(self.used))
+        self.assertFalse(os.path.exists(self.orphan))
+        self.assertTrue(os.path.exists(self.recent))
+
+    def test_sweep_dry_run(self):
+        # Test a dry run reports orphans without deleting them
+        out = StringIO()
+        call_command(
+            'sweep_media', grace_seconds=3600, dry_run=True, stdout=out
+        )
+
+        self.assertTrue(os.path.exists(self.orphan))
+        self.assertIn('Would delete uploads/recipe/orphan.jpg', out.getvalue())
+
+
+class RebuildRecipeStatsCommandTests(TestCase):
+
+    def test_rebuild_recipe_stats(self):
+        # Test the stats of a user are counted again from the recipes
+        user = get_user_model().objects.create_user(
+            'test@email.com', 'test1234'
+        )
+        Recipe.objects.create(
+            user=user, title='Soup', time_minutes=15, price=7
+        )
+        RecipeStats.objects.filter(user=user).update(recipe_count=9)
+        out = StringIO()
+
+        call_command('rebuild_recipe_stats', user=[user.id], stdout=out)
+
+        stats = RecipeStats.objects.get(user=user)
+        self.assertEqual(stats.recipe_count, 1)
+        self.assertEqual(stats.time_minutes_total, 15)
+        self.assertIn('Rebuilt the recipe stats of 1 users.', out.getvalue())
+
+
+class ProfileStartupCommandTests(TestCase):
+
+    def test_profile_startup(self):
+        # Test the boot of a fresh worker is timed per module and app
+        out = StringIO()
+        call_command('profile_startup', limit=50, stdout=out)
+        output = out.getvalue()
+
+        self.assertIn('first request to /api/recipe/tags/', output)
+        self.assertIn('401 Unauthorized', output)
+        self.assertIn('django.core.wsgi', output)
+        self.assertRegex(output, r'\d+\.\d  recipe\n')
+
+    def test_parse_import_times(self):
+        # Test the module, times and depth are read from -X importtime
+        lines = [
+            'import time: self [us] | cumulative | imported package',
+            'import time:       120 |        300 |   recipe.cache',
+            'import time:       180 |        480 | recipe.views',
+        ]
+
+        self.assertEqual(list(parse_import_times(lines)), [
+            ('recipe.cache', 120, 300, 1), ('recipe.views', 180, 480, 0),
+        ])
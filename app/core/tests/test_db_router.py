@@ -0,0 +1,61 @@
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.test import SimpleTestCase, RequestFactory, override_settings
+from rest_framework.authtoken.models import Token
+
+from core import db_router
+from core.middleware import ReplicaRoutingMiddleware
+from core.models import Recipe
+
+
+@override_settings(DATABASE_REPLICAS=['replica_0'])
+class ReplicaRoutingTests(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.router = db_router.PrimaryReplicaRouter()
+        self.factory = RequestFactory()
+        self.used = []
+
+        # record the replica chosen for each request
+        def get_response(request):
+            self.used.append(getattr(db_router._state, 'replica', None))
+            return HttpResponse()
+
+        self.middleware = ReplicaRoutingMiddleware(get_response)
+
+    def test_reads_use_primary_by_default(self):
+        # Test reads go to the primary outside a request
+        self.assertEqual(self.router.db_for_read(Recipe), 'default')
+
+    def test_reads_use_replica(self):
+        # Test reads go to the replica chosen for the request
+        with db_router.use_replica('replica_0'):
+            self.assertEqual(self.router.db_for_read(Recipe), 'replica_0')
+            self.assertEqual(self.router.db_for_write(Recipe), 'default')
+            self.assertEqual(self.router.db_for_read(Token), 'default')
+
+    def test_safe_api_request_uses_replica(self):
+        # Test GET requests to the API read from a replica
+        self.middleware(self.factory.get('/api/recipe/recipes/'))
+        self.middleware(self.factory.get('/admin/'))
+
+        self.assertEqual(self.used, ['replica_0', None])
+
+    def test_client_sticks_to_primary_after_write(self):
+        # Test a client that wrote reads from the primary
+        auth = {'HTTP_AUTHORIZATION': 'Token abc'}
+        self.middleware(self.factory.post('/api/recipe/recipes/', **auth))
+        self.middleware(self.factory.get('/api/recipe/recipes/', **auth))
+        self.middleware(self.factory.get(
+            '/api/recipe/recipes/', HTTP_AUTHORIZATION='Token xyz'
+        ))
+
+        self.assertEqual(self.used, [None, None, 'replica_0'])
+
+    @override_settings(CACHE_SHARED=False)
+    def test_primary_without_shared_cache(self):
+        # Test reads stay on the primary when writes can't pin clients
+        self.middleware(self.factory.get('/api/recipe/recipes/'))
+
+        self.assertEqual(self.used, [None])
@@ -0,0 +1,148 @@
+import threading
+import time
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Tag, Recipe
+from recipe.views import TagViewSet
+
+
+TAGS_URL = reverse('recipe:tag-list')
+RECIPES_URL = reverse('recipe:recipe-list')
+CREATE_USER_URL = reverse('user:create')
+
+
+class IdempotencyKeyTests(TestCase):
+    # Test retried POST requests with an Idempotency-Key
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'test@email.com',
+            'test1234'
+        )
+        self.client.force_authenticate(self.user)
+
+    def test_retry_replays_response(self):
+        # Test a retry gets the first response without creating a row
+        payload = {'title': 'Curry', 'time_minutes': 10, 'price': 5.00}
+        res1 = self.client.post(RECIPES_URL, payload, HTTP_IDEMPOTENCY_KEY='a')
+        res2 = self.client.post(RECIPES_URL, payload, HTTP_IDEMPOTENCY_KEY='a')
+
+        self.assertEqual(res1.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(res2.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(res2.data, res1.data)
+        self.assertEqual(res2['Idempotent-Replayed'], 'true')
+        self.assertEqual(Recipe.objects.filter(user=self.user).count(), 1)
+
+    def test_keys_are_separate(self):
+        # Test requests without a key or with other keys are not replayed
+        self.client.post(TAGS_URL, {'name': 'Vegan'}, HTTP_IDEMPOTENCY_KEY='a')
+        self.client.post(TAGS_URL, {'name': 'Vegan'}, HTTP_IDEMPOTENCY_KEY='b')
+        self.client.post(TAGS_URL, {'name': 'Vegan'})
+
+        self.assertEqual(Tag.objects.filter(user=self.user).count(), 3)
+
+    def test_key_reused_for_other_payload(self):
+        # Test a key can't be reused for a different request
+        self.client.post(TAGS_URL, {'name': 'Vegan'}, HTTP_IDEMPOTENCY_KEY='a')
+        res = self.client.post(
+            TAGS_URL, {'name': 'Dessert'}, HTTP_IDEMPOTENCY_KEY='a'
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertEqual(Tag.objects.filter(user=self.user).count(), 1)
+
+    def test_failed_request_is_not_stored(self):
+        # Test a retry of a rejected request runs again
+        res1 = self.client.post(TAGS_URL, {'name': ''},
+                                HTTP_IDEMPOTENCY_KEY='a')
+        res2 = self.client.post(TAGS_URL, {'name': ''},
+                                HTTP_IDEMPOTENCY_KEY='a')
+
+        self.assertEqual(res1.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(res2.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertNotIn('Idempotent-Replayed', res2)
+
+    @override_settings(IDEMPOTENCY_WAIT_SECONDS=0)
+    def test_request_in_progress(self):
+        # Test a duplicate gives up on a request that doesn't finish
+        responses = []
+
+        def perform_create(view, serializer):
+            # the duplicate arrives while the first request runs
+            responses.append(self.client.post(
+                TAGS_URL, {'name': 'Vegan'}, HTTP_IDEMPOTENCY_KEY='a'
+            ))
+            serializer.save(user=view.request.user)
+
+        with patch.object(TagViewSet, 'perform_create', perform_create):
+            res = self.client.post(
+                TAGS_URL, {'name': 'Vegan'}, HTTP_IDEMPOTENCY_KEY='a'
+            )
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(responses[0].status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(Tag.objects.filter(user=self.user).count(), 1)
+
+    def test_duplicate_waits_for_first_request(self):
+        # Test a concurrent duplicate gets the response of the first request
+        responses = []
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        def duplicate():
+            responses.append(client.post(
+                TAGS_URL, {'name': 'Vegan'}, HTTP_IDEMPOTENCY_KEY='a'
+            ))
+
+        thread = threading.Thread(target=duplicate)
+
+        def perform_create(view, serializer):
+            thread.start()
+            time.sleep(0.2)
+            serializer.save(user=view.request.user)
+
+        with patch.object(TagViewSet, 'perform_create', perform_create):
+            res = self.client.post(
+                TAGS_URL, {'name': 'Vegan'}, HTTP_IDEMPOTENCY_KEY='a'
+            )
+        thread.join()
+
+        self.assertEqual(responses[0].status_code, status.HTTP_201_CREATED)
+        self.assertEqual(responses[0].data, res.data)
+        self.assertEqual(responses[0]['Idempotent-Replayed'], 'true')
+        self.assertEqual(Tag.objects.filter(user=self.user).count(), 1)
+
+    def test_create_user_replayed(self):
+        # Test a retried sign up doesn't fail on the existing email
+        client = APIClient()
+        payload = {
+            'email': 'new@email.com', 'password': 'testpass', 'name': 'New'
+        }
+        res1 = client.post(CREATE_USER_URL, payload, HTTP_IDEMPOTENCY_KEY='a')
+        res2 = client.post(CREATE_USER_URL, payload, HTTP_IDEMPOTENCY_KEY='a')
+
+        self.assertEqual(res1.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(res2.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(res2.data, res1.data)
+
+    @override_settings(CACHE_SHARED=False)
+    def test_key_ignored_without_shared_cache(self):
+        # Test a key is not claimed in a cache local to the process
+        payload = {'name': 'Vegan'}
+        with patch('core.idempotency.cache') as mock_cache, \
+                self.assertLogs('core.idempotency', 'WARNING'):
+            res = self.client.post(TAGS_URL, payload, HTTP_IDEMPOTENCY_KEY='a')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertFalse(res.has_header('Idempotent-Replayed'))
+        mock_cache.add.assert_not_called()
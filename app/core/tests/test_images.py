@@ -0,0 +1,115 @@
+import io
+import os
+import shutil
+import tempfile
+import threading
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from PIL import Image
+
+from core import images
+
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, MEDIA_SERVE_MODE='python')
+class ImageVariantTests(TestCase):
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        shutil.rmtree(images.derived_root(), ignore_errors=True)
+        os.makedirs(os.path.join(MEDIA_ROOT, 'uploads/recipe'), exist_ok=True)
+        Image.new('RGB', (800, 400), 'red').save(
+            os.path.join(MEDIA_ROOT, 'uploads/recipe/a.jpg')
+        )
+        self.url = '/images/uploads/recipe/a.jpg'
+
+    def _image(self, res):
+        return Image.open(io.BytesIO(b''.join(res.streaming_content)))
+
+    def test_resized_variant(self):
+        # Test a variant is resized, converted and cached by clients
+        res = self.client.get(self.url, {'width': 160, 'format': 'webp'})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res['Content-Type'], 'image/webp')
+        self.assertIn('immutable', res['Cache-Control'])
+        image = self._image(res)
+        self.assertEqual(image.format, 'WEBP')
+        self.assertEqual(image.size, (160, 80))
+
+    def test_variant_generated_once(self):
+        # Test later requests are served from the disk cache
+        resize = images._resize
+        with patch('core.images._resize', side_effect=resize) as mock:
+            self.client.get(self.url, {'width': 320})
+            res = self.client.get(self.url, {'width': 320})
+
+        self.assertEqual(mock.call_count, 1)
+        self.assertEqual(self._image(res).size, (320, 160))
+
+    def test_concurrent_requests_coalesced(self):
+        # Test a variant requested while it is generated is made once
+        resize = images._resize
+        started, release = threading.Event(), threading.Event()
+
+        def slow_resize(*args):
+            started.set()
+            release.wait(5)
+            resize(*args)
+
+        with patch('core.images._resize', side_effect=slow_resize) as mock:
+            first = threading.Thread(
+                target=images.variants.get,
+                args=('uploads/recipe/a.jpg', 640, 'jpeg', 80)
+            )
+            first.start()
+            started.wait(5)
+            threading.Timer(0.2, release.set).start()
+            relative = images.variants.get(
+                'uploads/recipe/a.jpg', 640, 'jpeg', 80
+            )
+            first.join()
+
+        self.assertEqual(mock.call_count, 1)
+        self.assertTrue(os.path.exists(os.path.join(MEDIA_ROOT, relative)))
+
+    def test_invalid_parameters(self):
+        # Test only the configured widths, formats and qualities are used
+        res1 = self.client.get(self.url, {'width': 161})
+        res2 = self.client.get(self.url, {'width': 160, 'format': 'gif'})
+        res3 = self.client.get(self.url, {'width': 160, 'quality': 0})
+        res4 = self.client.get(self.url, {'width': 160, 'quality': 81})
+        res5 = self.client.get('/images/uploads/recipe/missing.jpg',
+                               {'width': 160})
+
+        self.assertEqual(res1.status_code, 400)
+        self.assertEqual(res2.status_code, 400)
+        self.assertEqual(res3.status_code, 400)
+        self.assertEqual(res4.status_code, 400)
+        self.assertEqual(res5.status_code, 404)
+
+    @override_settings(IMAGE_DERIVATIVE_CACHE_BYTES=250)
+    def test_least_recently_used_evicted(self):
+        # Test the variants used last are kept within the cache size
+        directory = os.path.join(images.derived_root(), 'ab')
+        os.makedirs(directory)
+        for position, name in enumerate(['old', 'recent', 'newest']):
+            path = os.path.join(directory, name)
+            with open(path, 'wb') as f:
+                f.write(b'x' * 100)
+            os.utime(path, (1000 + position, 1000))
+
+        size = images.variants.evict()
+
+        self.assertEqual(size, 200)
+        self.assertEqual(sorted(os.listdir(directory)), ['newest', 'recent'])
@@ -0,0 +1,128 @@
+import json
+import os
+import shutil
+import tempfile
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework.test import APIClient
+
+from core.metrics import MetricsRegistry, registry
+
+
+TAGS_URL = reverse('recipe:tag-list')
+
+
+class MetricsRegistryTests(TestCase):
+
+    def setUp(self):
+        self.registry = MetricsRegistry((0.1, 1.0))
+
+    def test_render_histogram(self):
+        # Test histogram buckets are rendered cumulative
+        labels = (('action', 'list'), ('view', 'TagViewSet'))
+        for value in (0.05, 0.5, 0.5, 3):
+            self.registry.observe(
+                'api_request_duration_seconds', labels, value
+            )
+        output = self.registry.render()
+
+        prefix = 'api_request_duration_seconds_bucket{action="list",' \
+                 'view="TagViewSet",le='
+        self.assertIn(f'{prefix}"0.1"}} 1\n', output)
+        self.assertIn(f'{prefix}"1.0"}} 3\n', output)
+        self.assertIn(f'{prefix}"+Inf"}} 4\n', output)
+        self.assertIn('api_request_duration_seconds_count{action="list",'
+                      'view="TagViewSet"} 4\n', output)
+        self.assertIn('# TYPE api_request_duration_seconds histogram', output)
+
+    def test_workers_added_up(self):
+        # Test the files of every worker in the directory are added up
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        labels = (('view', 'TagViewSet'),)
+        with open(os.path.join(directory, '1.json'), 'w') as f:
+            json.dump({
+                'buckets': [0.1, 1.0],
+                'counters': [['api_requests_total', [['view', 'TagViewSet']],
+                              2]],
+                'histograms': [],
+            }, f)
+        self.registry.inc('api_requests_total', labels, 3)
+
+        with override_settings(METRICS_DIR=directory):
+            output = self.registry.render()
+
+        self.assertIn('api_requests_total{view="TagViewSet"} 5\n', output)
+        self.assertTrue(
+            os.path.exists(os.path.join(directory, f'{os.getpid()}.json'))
+        )
+
+
+@override_settings(METRICS_TOKEN='secret')
+class MetricsMiddlewareTests(TestCase):
+
+    def setUp(self):
+        registry.clear()
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'test@email.com',
+            'test1234'
+        )
+        self.client.force_authenticate(self.user)
+
+    def _metrics(self):
+        return self.client.get(
+            '/metrics', HTTP_AUTHORIZATION='Bearer secret'
+        )
+
+    def test_requests_recorded_per_view_and_action(self):
+        # Test requests are counted and timed by view and action
+        self.client.get(TAGS_URL)
+        self.client.post(TAGS_URL, {'name': 'Vegan'})
+        res = self._metrics()
+        output = res.content.decode()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(
+            'api_requests_total{action="list",method="GET",status="200",'
+            'view="TagViewSet"} 1\n', output
+        )
+        self.assertIn(
+            'api_requests_total{action="create",method="POST",status="201",'
+            'view="TagViewSet"} 1\n', output
+        )
+        self.assertIn(
+            'api_request_db_seconds_count{action="list",'
+            'view="TagViewSet"} 1\n', output
+        )
+
+    def test_unresolved_requests(self):
+        # Test requests matching no view share the same labels
+        self.client.get('/api/recipe/missing/')
+        output = self._metrics().content.decode()
+
+        self.assertIn(
+            'api_requests_total{action="none",method="GET",status="404",'
+            'view="none"} 1\n', output
+        )
+
+    def test_metrics_token(self):
+        # Test the metrics endpoint can require a bearer token
+        res1 = self.client.get('/metrics')
+        res2 = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+
+        self.assertEqual(res1.status_code, 401)
+        self.assertEqual(res2.status_code, 200)
+
+    @override_settings(METRICS_TOKEN='')
+    def test_metrics_without_token(self):
+        # Test metrics without a token are only served in development
+        res1 = self.client.get('/metrics')
+        with override_settings(DEBUG=True):
+            res2 = self.client.get('/metrics')
+
+        self.assertEqual(res1.status_code, 404)
+        self.assertEqual(res2.status_code, 200)
@@ -81,6 +81,20 @@ class ModelTests(TestCase):
 
         self.assertEqual(str(recipe), recipe.title)
 
+    def test_recipe_owner_changed(self):
+        # Test a recipe can be given to another user
+        recipe = models.Recipe.objects.create(
+            user=sample_user(), title='ceviche', time_minutes=10, price=20
+        )
+        other = sample_user('other@email.com')
+
+        recipe = models.Recipe.objects.get(pk=recipe.pk)
+        recipe.user = other
+        recipe.save()
+
+        self.assertEqual(models.Recipe.objects.count(), 1)
+        self.assertEqual(models.Recipe.objects.get().user, other)
+
     # uuid module, uuid4 function to generate unique uid
     @patch('uuid.uuid4')
     def test_recipe_file_name_uuid(self, mock_uuid):
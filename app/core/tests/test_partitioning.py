@@ -0,0 +1,119 @@
+import re
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework.test import APIClient
+
+from core import partitioning
+from core.admin import EstimatedCountPaginator
+from core.models import Recipe, Tag
+
+
+RECIPES_URL = reverse('recipe:recipe-list')
+
+
+# the tables are partitioned by every test, whatever the environment
+@override_settings(RECIPE_PARTITIONS=4)
+class PartitionRecipesTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'test@email.com', 'test1234'
+        )
+        self.other = get_user_model().objects.create_user(
+            'test2@email.com', 'test1234'
+        )
+        self.tag = Tag.objects.create(user=self.user, name='Vegan')
+        for user in (self.user, self.other):
+            for title in ('Soup', 'Curry', 'Salad'):
+                Recipe.objects.create(
+                    user=user, title=title, time_minutes=10, price=5
+                )
+        self.recipe = Recipe.objects.filter(user=self.user).first()
+        self.recipe.tags.add(self.tag)
+
+    def _partition(self, **options):
+        out = StringIO()
+        call_command(
+            'partition_recipes', partitions=4, batch_size=2, stdout=out,
+            **options
+        )
+
+        return out.getvalue()
+
+    def test_migrations_keep_plain_tables(self):
+        # Test only the command partitions the tables
+        for table, _ in partitioning.TABLES:
+            self.assertFalse(partitioning.is_partitioned(connection, table))
+
+    def test_rows_moved_to_partitions(self):
+        # Test the recipes and their links are kept by the move
+        output = self._partition()
+
+        self.assertIn('core_recipe: 6 rows copied', output)
+        self.assertIn('7 rows moved.', output)
+        for table, _ in partitioning.TABLES:
+            self.assertTrue(partitioning.is_partitioned(connection, table))
+        self.assertEqual(Recipe.objects.count(), 6)
+        self.assertEqual(list(self.recipe.tags.all()), [self.tag])
+
+    def test_recipe_writes_after_move(self):
+        # Test recipes are created, updated and listed as before
+        self._partition()
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        res = client.post(RECIPES_URL, {
+            'title': 'Stew', 'time_minutes': 60, 'price': '9.00',
+            'tags': [self.tag.id],
+        })
+        recipe = Recipe.objects.get(id=res.data['id'])
+        recipe.title = 'Beef stew'
+        recipe.save()
+
+        res = client.get(RECIPES_URL, {'tags': self.tag.id})
+        self.assertEqual(
+            [item['title'] for item in res.data], ['Beef stew', 'Soup']
+        )
+
+    def test_owner_changed_after_move(self):
+        # Test a recipe given to another user moves to their partition
+        self._partition()
+        recipe = Recipe.objects.get(pk=self.recipe.pk)
+        recipe.user = self.other
+        recipe.save()
+
+        self.assertEqual(Recipe.objects.filter(user=self.other).count(), 4)
+        self.assertEqual(Recipe.objects.count(), 6)
+
+    def test_user_queries_pruned_to_one_partition(self):
+        # Test the recipes of a user are read from a single partition
+        self._partition()
+
+        plan = Recipe.objects.filter(user=self.user).order_by('-id').explain()
+
+        self.assertEqual(len(re.findall(r' on core_recipe_p\d+', plan)), 1)
+
+    def test_partitioned_once(self):
+        # Test partitioned tables are not partitioned again
+        self._partition()
+
+        with self.assertRaises(CommandError):
+            self._partition()
+
+    @override_settings(ADMIN_ESTIMATED_COUNT_THRESHOLD=1)
+    def test_estimated_count_of_partitions(self):
+        # Test the admin estimate adds up the rows of the partitions
+        self._partition()
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE core_recipe')
+
+        paginator = EstimatedCountPaginator(Recipe.objects.all(), 10)
+
+        self.assertEqual(paginator.count, 6)
@@ -0,0 +1,115 @@
+import io
+import os
+import shutil
+import tempfile
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+
+from PIL import Image
+from rest_framework.test import APIClient
+
+from core.models import ImageBlob, Recipe
+from core.storage import ContentAddressedStorage
+
+
+class ContentAddressedStorageTests(TransactionTestCase):
+
+    def setUp(self):
+        self.location = tempfile.mkdtemp()
+        self.storage = ContentAddressedStorage(location=self.location)
+
+    def tearDown(self):
+        shutil.rmtree(self.location, ignore_errors=True)
+
+    def test_file_named_by_content(self):
+        # Test files are named after the hash of their content
+        name = self.storage.save(
+            'uploads/recipe/photo.JPG', ContentFile(b'image')
+        )
+        digest = \
+            '6105d6cc76af400325e94d588ce511be5bfdbb73b437dc51eca43917d7a43e3d'
+
+        self.assertEqual(name, f'uploads/recipe/61/{digest}.jpg')
+        self.assertTrue(self.storage.exists(name))
+
+    def test_same_content_stored_once(self):
+        # Test uploading the same content twice writes it once
+        name1 = self.storage.save('uploads/recipe/a.jpg', ContentFile(b'x'))
+        with patch.object(self.storage, '_save') as mock_save:
+            name2 = self.storage.save(
+                'uploads/recipe/b.jpg', ContentFile(b'x')
+            )
+
+        self.assertEqual(name1, name2)
+        mock_save.assert_not_called()
+        self.assertEqual(ImageBlob.objects.get(name=name1).ref_count, 2)
+
+    def test_delete_last_reference_removes_file(self):
+        # Test the file is kept until its last reference is deleted
+        name = self.storage.save('uploads/recipe/a.jpg', ContentFile(b'x'))
+        self.storage.save('uploads/recipe/b.jpg', ContentFile(b'x'))
+
+        self.storage.delete(name)
+        self.assertTrue(os.path.exists(self.storage.path(name)))
+        self.assertEqual(ImageBlob.objects.get(name=name).ref_count, 1)
+
+        self.storage.delete(name)
+        self.assertFalse(os.path.exists(self.storage.path(name)))
+        self.assertFalse(ImageBlob.objects.filter(name=name).exists())
+
+    def test_delete_rolled_back_keeps_file(self):
+        # Test the file is only removed once the delete is committed
+        name = self.storage.save('uploads/recipe/a.jpg', ContentFile(b'x'))
+
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            self.storage.delete(name)
+            raise RuntimeError()
+
+        self.assertTrue(os.path.exists(self.storage.path(name)))
+        self.assertEqual(ImageBlob.objects.get(name=name).ref_count, 1)
+
+
+class RecipeImageReferenceTests(TestCase):
+
+    def setUp(self):
+        self.location = tempfile.mkdtemp()
+        self.storage = ContentAddressedStorage(location=self.location)
+        field = Recipe._meta.get_field('image')
+        patcher = patch.object(field, 'storage', self.storage)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = get_user_model().objects.create_user(
+            'test@email.com', 'test1234'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.recipe = Recipe.objects.create(
+            user=self.user, title='Soup', time_minutes=10, price=5
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.location, ignore_errors=True)
+
+    def _upload(self):
+        image = io.BytesIO()
+        Image.new('RGB', (10, 10), 'red').save(image, 'JPEG')
+        url = reverse('recipe:recipe-upload-image', args=[self.recipe.id])
+
+        return self.client.post(url, {'image': SimpleUploadedFile(
+            'photo.jpg', image.getvalue(), content_type='image/jpeg'
+        )}, format='multipart')
+
+    def test_same_image_uploaded_again(self):
+        # Test uploading the same image to a recipe keeps one reference
+        self._upload()
+        self._upload()
+
+        self.recipe.refresh_from_db()
+        blob = ImageBlob.objects.get(name=self.recipe.image.name)
+        self.assertEqual(blob.ref_count, 1)
@@ -0,0 +1,95 @@
+import os
+import shutil
+import tempfile
+
+from django.test import TestCase, override_settings
+
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, MEDIA_SERVE_MODE='python')
+class MediaServingTests(TestCase):
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        os.makedirs(os.path.join(MEDIA_ROOT, 'uploads/recipe'), exist_ok=True)
+        self.content = bytes(range(256)) * 4
+        with open(os.path.join(MEDIA_ROOT, 'uploads/recipe/a.jpg'), 'wb') \
+                as f:
+            f.write(self.content)
+        self.url = '/media/uploads/recipe/a.jpg'
+
+    def test_serve_file_with_cache_headers(self):
+        # Test media files are served with validators and cache headers
+        res = self.client.get(self.url)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(b''.join(res.streaming_content), self.content)
+        self.assertEqual(res['Content-Type'], 'image/jpeg')
+        self.assertEqual(res['Content-Length'], str(len(self.content)))
+        self.assertIn('ETag', res)
+        self.assertIn('Last-Modified', res)
+        self.assertIn('immutable', res['Cache-Control'])
+
+    def test_not_modified(self):
+        # Test a matching If-None-Match returns 304
+        etag = self.client.get(self.url)['ETag']
+
+        res = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(res.status_code, 304)
+
+    def test_range_request(self):
+        # Test a byte range returns a partial response
+        res = self.client.get(self.url, HTTP_RANGE='bytes=10-19')
+
+        self.assertEqual(res.status_code, 206)
+        self.assertEqual(b''.join(res.streaming_content), self.content[10:20])
+        self.assertEqual(
+            res['Content-Range'], f'bytes 10-19/{len(self.content)}'
+        )
+
+    def test_suffix_range_request(self):
+        # Test a suffix range returns the end of the file
+        res = self.client.get(self.url, HTTP_RANGE='bytes=-5')
+
+        self.assertEqual(res.status_code, 206)
+        self.assertEqual(b''.join(res.streaming_content), self.content[-5:])
+
+    def test_range_not_satisfiable(self):
+        # Test a range past the end of the file returns 416
+        res = self.client.get(self.url, HTTP_RANGE='bytes=5000-')
+
+        self.assertEqual(res.status_code, 416)
+        self.assertFalse(res.has_header('Cache-Control'))
+        self.assertFalse(res.has_header('ETag'))
+
+    def test_reversed_range_ignored(self):
+        # Test a range ending before its start returns the whole file
+        res = self.client.get(self.url, HTTP_RANGE='bytes=5-2')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(b''.join(res.streaming_content), self.content)
+
+    @override_settings(MEDIA_SERVE_MODE='x-accel-redirect')
+    def test_internal_redirect(self):
+        # Test the file delivery is handed to the web server
+        res = self.client.get(self.url)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(
+            res['X-Accel-Redirect'], '/protected-media/uploads/recipe/a.jpg'
+        )
+        self.assertEqual(res.content, b'')
+
+    def test_missing_file(self):
+        # Test missing files and paths outside the media root return 404
+        self.assertEqual(self.client.get('/media/nope.jpg').status_code, 404)
+        self.assertEqual(
+            self.client.get('/media/../settings.py').status_code, 404
+        )
@@ -0,0 +1,213 @@
+import mimetypes
+import os
+import posixpath
+import re
+import stat
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import (
+    FileResponse, Http404, HttpResponse, HttpResponseBadRequest,
+    StreamingHttpResponse
+)
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.crypto import constant_time_compare
+from django.utils.http import http_date
+from django.views.decorators.http import require_safe
+
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+CHUNK_SIZE = 64 * 1024
+# responses of serve_file carrying the file validators and cache headers
+CACHEABLE_STATUSES = (200, 206, 304)
+
+
+def _parse_range(header, size):
+    # Return the (start, end) of a single byte range, both inclusive
+    # None when the header is missing or not a single range we handle
+    # raises ValueError when the range can't be satisfied
+    match = RANGE_RE.match(header or '')
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # suffix range, the last n bytes of the file
+        length = int(last)
+        if not length:
+            raise ValueError('Empty suffix range')
+        return max(size - length, 0), size - 1
+    start = int(first)
+    if last and int(last) < start:
+        # an invalid range is ignored, the whole file is returned
+        return None
+    if start >= size:
+        raise ValueError('Range not satisfiable')
+    end = min(int(last), size - 1) if last else size - 1
+
+    return start, end
+
+
+def _file_range_iterator(path, start, length):
+    # Stream length bytes of a file starting at start
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def serve_file(request, full_path, internal_url=None):
+    # Serve a file with validators, long lived cache headers and ranges
+    # internal_url hands the delivery to the front web server
+    try:
+        file_stat = os.stat(full_path)
+    except OSError:
+        raise Http404('File not found')
+    if not stat.S_ISREG(file_stat.st_mode):
+        raise Http404('File not found')
+
+    size = file_stat.st_size
+    etag = '"{:x}-{:x}"'.format(int(file_stat.st_mtime), size)
+    last_modified = http_date(file_stat.st_mtime)
+    content_type, encoding = mimetypes.guess_type(full_path)
+    content_type = content_type or 'application/octet-stream'
+
+    # answer If-None-Match and If-Modified-Since without opening the file
+    response = get_conditional_response(
+        request, etag=etag, last_modified=int(file_stat.st_mtime)
+    )
+    if response is None:
+        mode = settings.MEDIA_SERVE_MODE
+        if mode == 'x-accel-redirect' and internal_url:
+            # nginx reads the file and handles ranges itself
+            response = HttpResponse(content_type=content_type)
+            response['X-Accel-Redirect'] = internal_url
+        elif mode == 'x-sendfile':
+            response = HttpResponse(content_type=content_type)
+            response['X-Sendfile'] = full_path
+        else:
+            response = _python_file_response(
+                request, full_path, size, etag, content_type
+            )
+
+    response['Accept-Ranges'] = 'bytes'
+    # errors like 416 and 412 must not be pinned by caches for a year
+    if response.status_code in CACHEABLE_STATUSES:
+        response['ETag'] = etag
+        response['Last-Modified'] = last_modified
+        response['Cache-Control'] = (
+            f'public, max-age={settings.MEDIA_CACHE_MAX_AGE}, immutable'
+        )
+        if encoding:
+            response['Content-Encoding'] = encoding
+
+    return response
+
+
+def _python_file_response(request, full_path, size, etag, content_type):
+    # Stream the file from the worker, honoring a single byte range
+    range_header = request.META.get('HTTP_RANGE')
+    if_range = request.META.get('HTTP_IF_RANGE')
+    # a stale If-Range means the client wants the whole new file
+    if if_range and if_range != etag:
+        range_header = None
+
+    try:
+        byte_range = _parse_range(range_header, size)
+    except ValueError:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    if byte_range is None:
+        response = FileResponse(
+            open(full_path, 'rb'), content_type=content_type
+        )
+        response['Content-Length'] = size
+        return response
+
+    start, end = byte_range
+    length = end - start + 1
+    response = StreamingHttpResponse(
+        _file_range_iterator(full_path, start, length),
+        status=206,
+        content_type=content_type
+    )
+    response['Content-Length'] = length
+    response['Content-Range'] = f'bytes {start}-{end}/{size}'
+
+    return response
+
+
+@require_safe
+def serve_media(request, path):
+    # Serve an uploaded media file
+    path = posixpath.normpath(path).lstrip('/')
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404('File not found')
+    internal_url = settings.MEDIA_ACCEL_REDIRECT_URL + quote(path)
+
+    return serve_file(request, full_path, internal_url)
+
+
+@require_safe
+def serve_image_variant(request, path):
+    # Serve an uploaded image resized to ?width=, in ?format= and
+    # ?quality=, variants are generated once and kept in an LRU cache
+    from core.images import FORMATS, ImageError, variants
+
+    path = posixpath.normpath(path).lstrip('/')
+    if path.startswith(('.', settings.IMAGE_DERIVATIVE_DIR + '/')):
+        raise Http404('File not found')
+    try:
+        width = int(request.GET.get('width', ''))
+        quality = int(request.GET.get(
+            'quality', settings.IMAGE_DERIVATIVE_DEFAULT_QUALITY
+        ))
+    except ValueError:
+        return HttpResponseBadRequest('Provide a width and a quality.')
+    # a fixed set of widths and qualities bounds the variants a client
+    # can ask for
+    if width not in settings.IMAGE_DERIVATIVE_WIDTHS:
+        return HttpResponseBadRequest('Unsupported width.')
+    if quality not in settings.IMAGE_DERIVATIVE_QUALITIES:
+        return HttpResponseBadRequest('Unsupported quality.')
+    image_format = request.GET.get('format', 'jpeg')
+    if image_format not in FORMATS:
+        return HttpResponseBadRequest('Unsupported format.')
+
+    try:
+        relative = variants.get(path, width, image_format, quality)
+    except ImageError:
+        raise Http404('Image not found')
+    full_path = os.path.join(settings.MEDIA_ROOT, relative)
+    internal_url = settings.MEDIA_ACCEL_REDIRECT_URL + quote(relative)
+
+    return serve_file(request, full_path, internal_url)
+
+
+@require_safe
+def metrics(request):
+    # Serve the request metrics of every worker in the Prometheus format
+    from core.metrics import registry
+
+    token = settings.METRICS_TOKEN
+    if not token and not settings.DEBUG:
+        # never served to anyone without a token outside development
+        raise Http404()
+    if token and not constant_time_compare(
+            request.META.get('HTTP_AUTHORIZATION', ''), f'Bearer {token}'):
+        return HttpResponse(status=401)
+
+    return HttpResponse(
+        registry.render(), content_type='text/plain; version=0.0.4'
+    )
@@ -0,0 +1,172 @@
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+
+def _timeout(name):
+    # Return the timeout of a cache setting, 0 when it is disabled
+    # entries are invalidated by the worker handling the write, a cache
+    # local to each process would serve the others stale entries
+    return getattr(settings, name) if settings.CACHE_SHARED else 0
+
+
+def _now_and_on_commit(func):
+    # Run an invalidation now and again once the transaction commits
+    # a read racing the write could cache the old rows in between
+    func()
+    transaction.on_commit(func)
+
+
+# every user has a version token for their recipe collection
+# any write to their recipes, tags or ingredients replaces the token
+# so everything cached under the old token is never read again
+def _collection_version_key(user_id):
+    return f'recipe:collection-version:{user_id}'
+
+
+def get_collection_version(user_id):
+    # Return the current collection version token for a user
+    key = _collection_version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        version = uuid.uuid4().hex
+        # add is a no-op if another request set the token first
+        cache.add(key, version, None)
+        version = cache.get(key, version)
+
+    return version
+
+
+def bump_collection_version(user_id):
+    # Replace the collection version token for a user
+    # a random token instead of a counter never collides with a
+    # token cached before the cache was flushed
+    _now_and_on_commit(lambda: cache.set(
+        _collection_version_key(user_id), uuid.uuid4().hex, None
+    ))
+
+
+def get_facets(user_id, version, filter_key):
+    # Return the cached facet counts for a user and filter combination
+    # under the collection version read before the counts are queried
+    if not _timeout('RECIPE_FACETS_CACHE_TIMEOUT'):
+        return None
+
+    return cache.get(f'recipe:facets:{user_id}:{version}:{filter_key}')
+
+
+def set_facets(user_id, version, filter_key, facets):
+    # Store the facet counts for a user and filter combination
+    # a write during the query replaced the version so the counts
+    # are stored under a token that is never read again
+    timeout = _timeout('RECIPE_FACETS_CACHE_TIMEOUT')
+    if not timeout:
+        return
+    cache.set(
+        f'recipe:facets:{user_id}:{version}:{filter_key}', facets, timeout
+    )
+
+
+# rendered recipe detail payloads, one entry per recipe
+# the entry keeps the owner so it is never served to another user
+# and the version token of the recipe it was rendered under, a payload
+# rendered before a write is stored under the token the write replaced
+def _recipe_detail_key(recipe_id):
+    return f'recipe:detail:{recipe_id}'
+
+
+def _recipe_detail_version_key(recipe_id):
+    return f'recipe:detail-version:{recipe_id}'
+
+
+def _recipe_detail_versions(recipe_ids, found):
+    # Return the version token of every recipe, creating missing ones
+    versions = {}
+    for recipe_id in recipe_ids:
+        key = _recipe_detail_version_key(recipe_id)
+        version = found.get(key)
+        if version is None:
+            version = uuid.uuid4().hex
+            # add is a no-op if another request set the token first
+            cache.add(key, version, None)
+            version = cache.get(key, version)
+        versions[recipe_id] = version
+
+    return versions
+
+
+def get_recipe_details(recipe_ids, user_id):
+    # Return a dict of the cached detail payloads found for the recipes
+    # and a dict of the version tokens to store the missing ones under
+    if not _timeout('RECIPE_DETAIL_CACHE_TIMEOUT'):
+        return {}, {}
+    found = cache.get_many([
+        key(recipe_id) for recipe_id in recipe_ids
+        for key in (_recipe_detail_key, _recipe_detail_version_key)
+    ])
+    versions = _recipe_detail_versions(recipe_ids, found)
+
+    return {
+        recipe_id: entry[2]
+        for recipe_id, entry in (
+            (recipe_id, found.get(_recipe_detail_key(recipe_id)))
+            for recipe_id in recipe_ids
+        )
+        if entry is not None and
+        entry[:2] == (user_id, versions[recipe_id])
+    }, versions
+
+
+def get_recipe_detail(recipe_id, user_id):
+    # Return the cached detail payload of a recipe owned by the user
+    # or None, and the version token to store a new payload under
+    details, versions = get_recipe_details([recipe_id], user_id)
+
+    return details.get(recipe_id), versions.get(recipe_id)
+
+
+def set_recipe_details(details, user_id, versions):
+    # Store a dict of detail payloads keyed by recipe id
+    # under the version tokens returned with the cache lookup
+    timeout = _timeout('RECIPE_DETAIL_CACHE_TIMEOUT')
+    if timeout and details:
+        cache.set_many({
+            _recipe_detail_key(recipe_id): (
+                user_id, versions[recipe_id], data
+            )
+            for recipe_id, data in details.items()
+        }, timeout)
+
+
+def set_recipe_detail(recipe_id, user_id, version, data):
+    # Store the detail payload of a recipe
+    set_recipe_details({recipe_id: data}, user_id, {recipe_id: version})
+
+
+def invalidate_recipe_details(recipe_ids):
+    # Drop the cached detail payloads of the given recipes
+    # and replace their version tokens so a payload rendered before
+    # the transaction commits is never read
+    recipe_ids = list(recipe_ids)
+    if not recipe_ids:
+        return
+
+    def invalidate():
+        cache.delete_many(
+            [_recipe_detail_key(recipe_id) for recipe_id in recipe_ids]
+        )
+        cache.set_many({
+            _recipe_detail_version_key(recipe_id): uuid.uuid4().hex
+            for recipe_id in recipe_ids
+        }, None)
+
+    _now_and_on_commit(invalidate)
+
+
+def invalidate_recipes(user_id, recipe_ids):
+    # Drop everything cached for recipes changed without model signals
+    # bulk queryset updates and inserts don't send save or m2m signals
+    bump_collection_version(user_id)
+    invalidate_recipe_details(recipe_ids)
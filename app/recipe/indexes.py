@@ -0,0 +1,295 @@
+import heapq
+import math
+import threading
+from bisect import bisect_left
+from collections import Counter, OrderedDict
+from itertools import islice, takewhile
+
+from django.conf import settings
+
+from core.models import Recipe, Tag, Ingredient
+from recipe import cache
+
+
+# number of set bits, int.bit_count only exists from python 3.10
+_popcount = getattr(int, 'bit_count', None) or (lambda n: bin(n).count('1'))
+
+
+class UserIndexRegistry:
+    # Keep an in-memory index per user for the recent users
+    # an index is tagged with the collection version it was built from
+    # and rebuilt lazily once another write has replaced that version
+
+    def __init__(self, builder):
+        self.builder = builder
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        # Return an up to date index for the user
+        if not settings.CACHE_SHARED:
+            # writes on other workers don't reach the version of this
+            # process, a kept index could be stale forever
+            return self.builder(user_id)
+        version = cache.get_collection_version(user_id)
+        with self._lock:
+            index = self._indexes.get(user_id)
+            if index is not None and index.version == version:
+                self._indexes.move_to_end(user_id)
+                return index
+
+        # build outside the lock, other users keep being served
+        index = self.builder(user_id)
+        index.version = version
+        with self._lock:
+            self._indexes[user_id] = index
+            self._indexes.move_to_end(user_id)
+            while len(self._indexes) > settings.RECIPE_INDEX_MAX_USERS:
+                self._indexes.popitem(last=False)
+
+        return index
+
+    def update(self, user_id, previous_version, func):
+        # Apply an incremental change to the index of a user
+        # the index is only kept if it had every change before this one,
+        # otherwise it is dropped and rebuilt on the next read
+        with self._lock:
+            index = self._indexes.get(user_id)
+            if index is None:
+                return
+            if index.version != previous_version:
+                del self._indexes[user_id]
+                return
+            with index.lock:
+                func(index)
+            index.version = cache.get_collection_version(user_id)
+
+
+def _feature_rows(user_id):
+    # Yield (recipe id, feature) for the tags and ingredients of a user
+    tags = Recipe.tags.through.objects.filter(
+        recipe__user_id=user_id
+    ).values_list('recipe_id', 'tag_id')
+    for recipe_id, tag_id in tags.iterator():
+        yield recipe_id, ('tag', tag_id)
+    ingredients = Recipe.ingredients.through.objects.filter(
+        recipe__user_id=user_id
+    ).values_list('recipe_id', 'ingredient_id')
+    for recipe_id, ingredient_id in ingredients.iterator():
+        yield recipe_id, ('ingredient', ingredient_id)
+
+
+class SimilarityIndex:
+    # Sparse recipe x feature matrix of the tags and ingredients of a user
+    # kept both ways: the features of each recipe (rows) and the recipes
+    # of each feature (columns, the posting lists)
+
+    def __init__(self):
+        self.features = {}
+        self.postings = {}
+        self.version = None
+        # incremental updates and reads of other threads wait for each other
+        self.lock = threading.Lock()
+
+    @classmethod
+    def build(cls, user_id):
+        # Build the index of a user from two queries
+        index = cls()
+        for recipe_id, feature in _feature_rows(user_id):
+            index.add(recipe_id, [feature])
+
+        return index
+
+    def add(self, recipe_id, features):
+        # Link features to a recipe
+        row = self.features.setdefault(recipe_id, set())
+        for feature in features:
+            row.add(feature)
+            self.postings.setdefault(feature, set()).add(recipe_id)
+
+    def remove(self, recipe_id, features=None):
+        # Unlink features from a recipe, all of them by default
+        row = self.features.get(recipe_id, set())
+        for feature in list(row if features is None else features):
+            row.discard(feature)
+            posting = self.postings.get(feature)
+            if posting is not None:
+                posting.discard(recipe_id)
+                if not posting:
+                    del self.postings[feature]
+        if not row:
+            self.features.pop(recipe_id, None)
+
+    def remove_feature(self, feature):
+        # Unlink a deleted tag or ingredient from every recipe
+        for recipe_id in self.postings.pop(feature, ()):
+            row = self.features[recipe_id]
+            row.discard(feature)
+            if not row:
+                del self.features[recipe_id]
+
+    def similar(self, recipe_id, limit, metric='jaccard'):
+        # Return the (recipe id, score) pairs of the closest recipes
+        with self.lock:
+            return self._similar(recipe_id, limit, metric)
+
+    def _similar(self, recipe_id, limit, metric):
+        row = self.features.get(recipe_id)
+        if not row:
+            return []
+
+        # sparse matrix times the recipe vector, only recipes sharing a
+        # feature are touched and Counter.update counts each posting in C
+        overlap = Counter()
+        for feature in row:
+            overlap.update(self.postings[feature])
+        del overlap[recipe_id]
+
+        size = len(row)
+        features = self.features
+        if metric == 'cosine':
+            scores = (
+                (shared / math.sqrt(size * len(features[other])), other)
+                for other, shared in overlap.items()
+            )
+        else:
+            scores = (
+                (shared / (size + len(features[other]) - shared), other)
+                for other, shared in overlap.items()
+            )
+
+        # best score first, lowest id breaks ties
+        best = heapq.nsmallest(
+            limit, scores, key=lambda item: (-item[0], item[1])
+        )
+        return [(other, score) for score, other in best]
+
+
+similarity_indexes = UserIndexRegistry(SimilarityIndex.build)
+
+
+class IngredientBitsetIndex:
+    # The ingredients of every recipe of a user as one integer bitset
+    # scoring a recipe against the ingredients on hand is an AND and
+    # a popcount, rebuilt lazily after any change to the collection
+
+    def __init__(self):
+        # ingredient id -> bit, bit -> ingredient id
+        self.bits = {}
+        self.ingredients = []
+        # (recipe id, ingredient bitset, number of ingredients)
+        self.recipes = []
+        self.version = None
+
+    @classmethod
+    def build(cls, user_id):
+        # Build the index of a user from a single query
+        index = cls()
+        rows = Recipe.ingredients.through.objects.filter(
+            recipe__user_id=user_id
+        ).values_list('recipe_id', 'ingredient_id').order_by('recipe_id')
+        current, mask = None, 0
+        for recipe_id, ingredient_id in rows.iterator():
+            if recipe_id != current:
+                index._append(current, mask)
+                current, mask = recipe_id, 0
+            mask |= 1 << index._bit(ingredient_id)
+        index._append(current, mask)
+
+        return index
+
+    def _bit(self, ingredient_id):
+        bit = self.bits.get(ingredient_id)
+        if bit is None:
+            bit = self.bits[ingredient_id] = len(self.ingredients)
+            self.ingredients.append(ingredient_id)
+
+        return bit
+
+    def _append(self, recipe_id, mask):
+        if recipe_id is not None:
+            self.recipes.append((recipe_id, mask, _popcount(mask)))
+
+    def _missing(self, mask, have):
+        # Return the ingredient ids of a bitset that are not on hand
+        missing = mask & ~have
+        ids = []
+        while missing:
+            low = missing & -missing
+            ids.append(self.ingredients[low.bit_length() - 1])
+            missing ^= low
+
+        return ids
+
+    def rank(self, ingredient_ids, limit, min_coverage=0.0):
+        # Return (recipe id, coverage, missing ingredient ids) of the
+        # recipes best covered by the ingredients on hand
+        have = 0
+        for ingredient_id in ingredient_ids:
+            bit = self.bits.get(ingredient_id)
+            if bit is not None:
+                have |= 1 << bit
+        if not have:
+            return []
+
+        scores = []
+        for recipe_id, mask, count in self.recipes:
+            covered = _popcount(mask & have)
+            if covered:
+                coverage = covered / count
+                if coverage >= min_coverage:
+                    scores.append((coverage, count - covered, recipe_id, mask))
+
+        # best coverage first, then fewest missing ingredients
+        best = heapq.nsmallest(
+            limit, scores, key=lambda item: (-item[0], item[1], item[2])
+        )
+        return [
+            (recipe_id, coverage, self._missing(mask, have))
+            for coverage, _, recipe_id, mask in best
+        ]
+
+
+cookable_indexes = UserIndexRegistry(IngredientBitsetIndex.build)
+
+
+class PrefixIndex:
+    # Names of the tags or ingredients of a user sorted case insensitively
+    # a prefix lookup is a binary search and a scan of the matches
+
+    def __init__(self, entries):
+        entries = sorted(
+            (name.lower(), pk, name) for pk, name in entries
+        )
+        self.keys = [key for key, _, _ in entries]
+        self.items = [{'id': pk, 'name': name} for _, pk, name in entries]
+        self.version = None
+        self.lock = threading.Lock()
+
+    @classmethod
+    def builder(cls, model):
+        # Return the function building the index of a model for a user
+        def build(user_id):
+            return cls(
+                model.objects.filter(user_id=user_id).values_list('id', 'name')
+            )
+
+        return build
+
+    def search(self, prefix, limit):
+        # Return up to limit items whose name starts with prefix
+        prefix = prefix.lower()
+        start = bisect_left(self.keys, prefix)
+        # the matches are contiguous, stop at the first name that differs
+        positions = takewhile(
+            lambda position: self.keys[position].startswith(prefix),
+            range(start, len(self.keys))
+        )
+
+        return [self.items[position] for position in islice(positions, limit)]
+
+
+prefix_indexes = {
+    model: UserIndexRegistry(PrefixIndex.builder(model))
+    for model in (Tag, Ingredient)
+}
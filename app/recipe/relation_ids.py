@@ -0,0 +1,45 @@
+from django.contrib.postgres.fields import ArrayField
+from django.db.models import F, Func, IntegerField, OuterRef, Subquery, Value
+
+from core.models import Recipe
+
+
+# array column of Recipe copying the ids linked through each m2m table
+RELATIONS = {
+    'tag': ('tag_ids', Recipe.tags.through),
+    'ingredient': ('ingredient_ids', Recipe.ingredients.through),
+}
+
+
+class ArraySubquery(Subquery):
+    # Subquery returning its single column as one array
+    template = 'ARRAY(%(subquery)s)'
+    output_field = ArrayField(IntegerField())
+
+
+def _linked_ids(kind):
+    _, through = RELATIONS[kind]
+    return ArraySubquery(through.objects.filter(
+        recipe_id=OuterRef('pk')
+    ).order_by(f'{kind}_id').values(f'{kind}_id'))
+
+
+def refresh(user_id, recipe_ids, kinds=('tag', 'ingredient')):
+    # Copy the linked ids of recipes of a user from the m2m tables,
+    # sorted, a single UPDATE whatever the number of recipes
+    Recipe.objects.filter(user_id=user_id, id__in=recipe_ids).update(**{
+        RELATIONS[kind][0]: _linked_ids(kind) for kind in kinds
+    })
+
+
+def forget(user_id, kind, pk):
+    # Remove a deleted tag or ingredient from the recipes holding it
+    field, _ = RELATIONS[kind]
+    Recipe.objects.filter(
+        user_id=user_id, **{f'{field}__contains': [pk]}
+    ).update(**{
+        field: Func(
+            F(field), Value(pk), function='array_remove',
+            output_field=ArrayField(IntegerField())
+        )
+    })
@@ -1,6 +1,19 @@
-from rest_framework import serializers
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from rest_framework import serializers, status
+from rest_framework.exceptions import APIException
 
+from core import images
 from core.models import Tag, Ingredient, Recipe
+from recipe import cache, stats
+
+
+class PreconditionFailed(APIException):
+    # The recipe version sent by the client is not the current one
+    status_code = status.HTTP_412_PRECONDITION_FAILED
+    default_detail = 'The recipe was changed by another request.'
+    default_code = 'precondition_failed'
 
 
 # create model serializer link it to tag model
@@ -23,25 +36,69 @@ class IngredientSerializer(serializers.ModelSerializer):
         read_only_fields = ('id',)
 
 
+class RelatedIdsField(serializers.ManyRelatedField):
+    # Ids written to a m2m field and read from the array column that
+    # copies them, listing recipes doesn't join the m2m tables
+
+    def __init__(self, ids_attribute, queryset, **kwargs):
+        self.ids_attribute = ids_attribute
+        super().__init__(
+            child_relation=serializers.PrimaryKeyRelatedField(
+                queryset=queryset
+            ),
+            **kwargs
+        )
+
+    def get_attribute(self, instance):
+        return getattr(instance, self.ids_attribute)
+
+    def to_representation(self, ids):
+        return list(ids)
+
+
 class RecipeSerializer(serializers.ModelSerializer):
     # serializer for recipe objects
     # listing only the ids
-    ingredients = serializers.PrimaryKeyRelatedField(
-        many=True,
-        queryset=Ingredient.objects.all()
-    )
+    ingredients = RelatedIdsField('ingredient_ids', Ingredient.objects.all())
 
-    tags = serializers.PrimaryKeyRelatedField(
-        many=True,
-        queryset=Tag.objects.all()
-    )
+    tags = RelatedIdsField('tag_ids', Tag.objects.all())
 
     class Meta:
         model = Recipe
         fields = ('id', 'title', 'ingredients',
-                  'tags', 'time_minutes', 'price', 'link')
+                  'tags', 'time_minutes', 'price', 'link', 'version')
         # prevent updating the foreign key
-        read_only_fields = ('id',)
+        read_only_fields = ('id', 'version')
+
+    # no row lock is held between the read and the write, the UPDATE
+    # only matches the row if it still has the version the client read
+    def update(self, instance, validated_data):
+        # Update a recipe with a compare-and-set on its version
+        expected_version = self.context.get('expected_version')
+        relations = {
+            name: validated_data.pop(name)
+            for name in ('tags', 'ingredients') if name in validated_data
+        }
+
+        with transaction.atomic(), \
+                stats.bulk_change(instance.user_id, [instance.pk]):
+            rows = Recipe.objects.filter(
+                user_id=instance.user_id, pk=instance.pk
+            )
+            if expected_version is not None:
+                rows = rows.filter(version=expected_version)
+            if not rows.update(version=F('version') + 1, **validated_data):
+                raise PreconditionFailed()
+            for name, values in relations.items():
+                getattr(instance, name).set(values)
+            # queryset updates don't send post_save
+            cache.invalidate_recipes(instance.user_id, [instance.pk])
+
+        for attr, value in validated_data.items():
+            setattr(instance, attr, value)
+        instance.refresh_from_db(fields=['version'])
+
+        return instance
 
 
 # Serialize a recipe detail using as base RecipeSerializer
@@ -54,11 +111,71 @@ class RecipeDetailSerializer(RecipeSerializer):
     tags = TagSerializer(many=True, read_only=True)
 
 
+def reencode_image(upload):
+    # Return the compact copy of an uploaded image that gets stored
+    return images.reencode(
+        upload,
+        settings.RECIPE_IMAGE_FORMAT,
+        settings.RECIPE_IMAGE_QUALITY,
+        settings.RECIPE_IMAGE_MAX_DIMENSION
+    )
+
+
 class RecipeImageSerializer(serializers.ModelSerializer):
     # Serializer for uploading images to recipes
 
     class Meta:
         model = Recipe
         # accept only image field we want to upload
-        fields = ('id', 'image')
-        read_only_fields = ('id',)
+        fields = ('id', 'image', 'image_original_bytes', 'image_bytes')
+        read_only_fields = ('id', 'image_original_bytes', 'image_bytes')
+
+    def validate(self, attrs):
+        # Store a compact copy of the upload instead of the upload itself
+        upload = attrs.get('image')
+        if upload:
+            try:
+                attrs['image'] = reencode_image(upload)
+            except images.ImageError:
+                raise serializers.ValidationError(
+                    {'image': 'Upload a valid image.'}
+                )
+            attrs['image_original_bytes'] = upload.size
+            attrs['image_bytes'] = attrs['image'].size
+
+        return attrs
+
+
+class RecipeBulkDeleteSerializer(serializers.Serializer):
+    # Serializer for the recipes affected by a bulk request
+    ids = serializers.ListField(
+        child=serializers.IntegerField(),
+        allow_empty=False,
+        max_length=settings.RECIPE_BULK_MAX_IDS
+    )
+
+
+class RecipeBulkUpdateSerializer(RecipeBulkDeleteSerializer):
+    # Serializer for changes applied to many recipes at once
+    # the fields match the recipe model, all of them are optional
+    title = serializers.CharField(max_length=255, required=False)
+    time_minutes = serializers.IntegerField(required=False)
+    price = serializers.DecimalField(
+        max_digits=5, decimal_places=2, required=False
+    )
+    link = serializers.CharField(
+        max_length=255, allow_blank=True, required=False
+    )
+    # tags and ingredients are added to or removed from the current set
+    add_tags = serializers.ListField(
+        child=serializers.IntegerField(), required=False
+    )
+    remove_tags = serializers.ListField(
+        child=serializers.IntegerField(), required=False
+    )
+    add_ingredients = serializers.ListField(
+        child=serializers.IntegerField(), required=False
+    )
+    remove_ingredients = serializers.ListField(
+        child=serializers.IntegerField(), required=False
+    )
@@ -0,0 +1,247 @@
+from django.db.models.signals import (
+    pre_save, post_save, pre_delete, post_delete, m2m_changed
+)
+from django.db import transaction
+from django.dispatch import receiver
+
+from core.models import Tag, Ingredient, Recipe
+from recipe import cache, relation_ids, stats
+from recipe.indexes import similarity_indexes
+
+
+def _no_change(index):
+    pass
+
+
+def collection_changed(user_id, change=_no_change):
+    # Bump the collection version of a user, invalidating the cached
+    # facets, and apply the change to the in-memory indexes once it is
+    # committed, a rolled back change never reaches them
+    previous = cache.get_collection_version(user_id)
+    cache.bump_collection_version(user_id)
+    transaction.on_commit(
+        lambda: similarity_indexes.update(user_id, previous, change)
+    )
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+def collection_object_saved(sender, instance, **kwargs):
+    # Record a change to the collection of the owner
+    collection_changed(instance.user_id)
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_deleted(sender, instance, **kwargs):
+    # Remove a deleted recipe from the collection
+    collection_changed(
+        instance.user_id, lambda index: index.remove(instance.id)
+    )
+
+
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+def recipe_attr_deleted(sender, instance, **kwargs):
+    # Remove a deleted tag or ingredient from the collection
+    feature = (sender._meta.model_name, instance.id)
+    collection_changed(
+        instance.user_id, lambda index: index.remove_feature(feature)
+    )
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def recipe_changed(sender, instance, **kwargs):
+    # Drop the cached detail of a saved or deleted recipe
+    cache.invalidate_recipe_details([instance.id])
+
+
+@receiver(post_save, sender=Tag)
+@receiver(pre_delete, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+@receiver(pre_delete, sender=Ingredient)
+def recipe_attr_changed(sender, instance, created=False, **kwargs):
+    # Drop the cached details of the recipes showing a renamed or
+    # deleted tag/ingredient, deletes remove the links without
+    # sending m2m_changed so the recipes are found before
+    if created:
+        return
+    cache.invalidate_recipe_details(
+        instance.recipe_set.values_list('id', flat=True)
+    )
+
+
+def _relations_change(kind, instance, action, reverse, pk_set):
+    # Return the index change for linking tags or ingredients
+    # kind is 'tag' or 'ingredient', the model of the features
+    if not reverse:
+        features = [(kind, pk) for pk in pk_set or ()]
+        if action == 'post_add':
+            return lambda index: index.add(instance.id, features)
+        if action == 'post_remove':
+            return lambda index: index.remove(instance.id, features)
+        return lambda index: index.remove(instance.id, [
+            feature for feature in index.features.get(instance.id, ())
+            if feature[0] == kind
+        ])
+
+    feature = (kind, instance.id)
+    if action == 'post_clear':
+        return lambda index: index.remove_feature(feature)
+
+    def change(index):
+        for recipe_id in pk_set:
+            if action == 'post_add':
+                index.add(recipe_id, [feature])
+            else:
+                index.remove(recipe_id, [feature])
+
+    return change
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def recipe_relations_changed(sender, instance, action, reverse, pk_set,
+                             **kwargs):
+    # Invalidate caches when tags or ingredients are linked
+    # instance is a recipe, or a tag/ingredient for reverse changes
+    if reverse and action == 'pre_clear':
+        # the recipes losing the link are only known before the clear
+        cache.invalidate_recipe_details(
+            instance.recipe_set.values_list('id', flat=True)
+        )
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    kind = 'tag' if sender is Recipe.tags.through else 'ingredient'
+    collection_changed(
+        instance.user_id,
+        _relations_change(kind, instance, action, reverse, pk_set)
+    )
+    if not reverse:
+        cache.invalidate_recipe_details([instance.id])
+    elif pk_set:
+        cache.invalidate_recipe_details(pk_set)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def recipe_relation_ids_changed(sender, instance, action, reverse, pk_set,
+                                **kwargs):
+    # Copy the linked ids to the array columns of the recipes
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    kind = 'tag' if sender is Recipe.tags.through else 'ingredient'
+    # tags and ingredients only link recipes of their own user
+    if not reverse:
+        relation_ids.refresh(instance.user_id, [instance.id], [kind])
+        # serialized right after by the create and update views
+        field = relation_ids.RELATIONS[kind][0]
+        setattr(instance, field, Recipe.objects.filter(
+            user_id=instance.user_id, pk=instance.pk
+        ).values_list(field, flat=True).get())
+    elif action == 'post_clear':
+        relation_ids.forget(instance.user_id, kind, instance.id)
+    elif pk_set:
+        relation_ids.refresh(instance.user_id, pk_set, [kind])
+
+
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+def recipe_attr_ids_deleted(sender, instance, **kwargs):
+    # The links of a deleted tag/ingredient go without m2m_changed
+    relation_ids.forget(
+        instance.user_id, sender._meta.model_name, instance.id
+    )
+
+
+# per user recipe stats, writes that bypass these signals (queryset
+# updates and bulk deletes) go through stats.bulk_change instead
+STATS_FIELDS = {'user', 'time_minutes', 'price'}
+
+
+@receiver(pre_save, sender=Recipe)
+def recipe_stats_before_save(sender, instance, update_fields=None,
+                             **kwargs):
+    # Keep the totals a saved recipe had to replace them after the save
+    if instance.pk is None or stats.is_paused():
+        return
+    if update_fields is not None and not STATS_FIELDS & set(update_fields):
+        return
+    previous = Recipe.objects.filter(
+        user_id=instance.stored_user_id, pk=instance.pk
+    ).first()
+    if previous is not None:
+        # a recipe given to another user leaves the stats of its owner
+        instance._stats_previous = (
+            previous.user_id, stats.Delta.of_recipe(previous)
+        )
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_stats_after_save(sender, instance, created, **kwargs):
+    # Add a new recipe to the stats, or its new time and price
+    # the tags follow through m2m_changed
+    previous = instance.__dict__.pop('_stats_previous', None)
+    if created:
+        stats.apply(instance.user_id, stats.Delta.of_recipe(instance))
+    elif previous is not None:
+        previous_user_id, delta = previous
+        with transaction.atomic():
+            stats.apply(previous_user_id, delta, -1)
+            stats.apply(instance.user_id, stats.Delta.of_recipe(instance))
+
+
+@receiver(pre_delete, sender=Recipe)
+def recipe_stats_deleted(sender, instance, **kwargs):
+    # Take a deleted recipe out of the stats, tags included since the
+    # links are deleted without m2m_changed
+    if stats.is_paused():
+        return
+    tag_ids = instance.tags.values_list('id', flat=True)
+    stats.apply(
+        instance.user_id, stats.Delta.of_recipe(instance, tag_ids), -1
+    )
+
+
+@receiver(pre_delete, sender=Tag)
+def tag_stats_deleted(sender, instance, **kwargs):
+    stats.tag_deleted(instance.user_id, instance.id)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def recipe_tags_stats_changed(sender, instance, action, reverse, pk_set,
+                              **kwargs):
+    # Count the recipes of each tag as links are added and removed
+    if stats.is_paused():
+        return
+    if action == 'pre_clear':
+        # the links going away are only known before the clear
+        if reverse:
+            stats.tag_deleted(instance.user_id, instance.id)
+        else:
+            stats.tags_changed(
+                instance.user_id,
+                instance.tags.values_list('id', flat=True), -1
+            )
+    elif action == 'pre_remove':
+        # remove sends every id it was given, linked or not, the links
+        # actually going away are only known before the delete
+        if reverse:
+            linked = sender.objects.filter(
+                tag_id=instance.id, recipe_id__in=pk_set
+            ).values_list('recipe_id', flat=True)
+        else:
+            linked = sender.objects.filter(
+                recipe_id=instance.id, tag_id__in=pk_set
+            ).values_list('tag_id', flat=True)
+        instance._stats_removed_ids = list(linked)
+    elif action in ('post_add', 'post_remove'):
+        if action == 'post_add':
+            # add only sends the ids that were not linked yet
+            sign, ids = 1, pk_set
+        else:
+            sign, ids = -1, instance.__dict__.pop('_stats_removed_ids', ())
+        # reverse changes link one tag to many recipes
+        tag_ids = [instance.id] * len(ids) if reverse else ids
+        stats.tags_changed(instance.user_id, tag_ids, sign)
@@ -0,0 +1,197 @@
+import threading
+from bisect import bisect_right
+from collections import Counter
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+
+from core.models import Recipe, RecipeStats
+
+
+# the signal handlers stand by while a bulk write is accounted for
+# with aggregate queries, see bulk_change
+_state = threading.local()
+
+
+class Delta:
+    # Totals of some recipes, added to or taken from the stats of a user
+
+    def __init__(self, count=0, time_minutes=0, price=Decimal(0),
+                 histogram=None, tags=None):
+        self.count = count
+        self.time_minutes = time_minutes
+        self.price = price
+        self.histogram = histogram or [0] * (
+            len(settings.RECIPE_STATS_PRICE_BUCKETS) + 1
+        )
+        self.tags = tags or Counter()
+
+    @classmethod
+    def of_recipe(cls, recipe, tag_ids=()):
+        # Return the totals of one recipe without a query
+        delta = cls(1, recipe.time_minutes, Decimal(str(recipe.price)))
+        delta.histogram[_bucket(recipe.price)] += 1
+        delta.tags.update(tag_ids)
+
+        return delta
+
+    @classmethod
+    def of_queryset(cls, recipes):
+        # Return the totals of a queryset of recipes with two queries
+        bounds = settings.RECIPE_STATS_PRICE_BUCKETS
+        ranges = zip((None,) + bounds, bounds + (None,))
+        buckets = {
+            f'bucket{position}': Count('id', filter=_price_range(low, high))
+            for position, (low, high) in enumerate(ranges)
+        }
+        # named apart from the fields, the bucket filters refer to price
+        totals = recipes.aggregate(
+            recipes=Count('id'),
+            time_minutes_total=Sum('time_minutes'),
+            price_total=Sum('price'),
+            **buckets
+        )
+        tags = Recipe.tags.through.objects.filter(
+            recipe__in=recipes
+        ).values_list('tag_id').annotate(count=Count('id')).order_by()
+
+        return cls(
+            totals['recipes'],
+            totals['time_minutes_total'] or 0,
+            totals['price_total'] or Decimal(0),
+            [totals[f'bucket{position}'] for position in range(len(buckets))],
+            Counter(dict(tags)),
+        )
+
+
+def _bucket(price):
+    # new instances can still hold the float they were created with
+    return bisect_right(
+        settings.RECIPE_STATS_PRICE_BUCKETS, Decimal(str(price))
+    )
+
+
+def _price_range(low, high):
+    condition = Q()
+    if low is not None:
+        condition &= Q(price__gte=low)
+    if high is not None:
+        condition &= Q(price__lt=high)
+
+    return condition
+
+
+def _valid(stats):
+    # Stats counted with other price buckets have to be rebuilt
+    return len(stats.price_histogram) == len(
+        settings.RECIPE_STATS_PRICE_BUCKETS
+    ) + 1
+
+
+def apply(user_id, delta, sign=1):
+    # Add (sign 1) or take (sign -1) totals to the stats of a user
+    # the row stays locked until the transaction of the write commits
+    # so concurrent writes of a user are applied one after the other
+    if is_paused():
+        return
+    with transaction.atomic():
+        stats = RecipeStats.objects.select_for_update().filter(
+            user_id=user_id
+        ).first()
+        if stats is None or not _valid(stats):
+            # built from scratch once the write is visible
+            transaction.on_commit(lambda: rebuild(user_id))
+            return
+
+        stats.recipe_count = max(stats.recipe_count + sign * delta.count, 0)
+        stats.time_minutes_total += sign * delta.time_minutes
+        stats.price_total += sign * delta.price
+        stats.price_histogram = [
+            max(count + sign * change, 0)
+            for count, change in zip(stats.price_histogram, delta.histogram)
+        ]
+        tag_counts = Counter({
+            int(tag_id): count for tag_id, count in stats.tag_counts.items()
+        })
+        for tag_id, change in delta.tags.items():
+            tag_counts[tag_id] += sign * change
+        stats.tag_counts = {
+            str(tag_id): count
+            for tag_id, count in tag_counts.items() if count > 0
+        }
+        stats.save()
+
+
+def tags_changed(user_id, tag_ids, sign=1):
+    # Count recipes linked (sign 1) or unlinked (sign -1) to tags
+    apply(user_id, Delta(tags=Counter(tag_ids)), sign)
+
+
+def tag_deleted(user_id, tag_id):
+    # Forget a deleted tag, its links go without m2m signals
+    if is_paused():
+        return
+    with transaction.atomic():
+        stats = RecipeStats.objects.select_for_update().filter(
+            user_id=user_id
+        ).first()
+        if stats is not None and stats.tag_counts.pop(str(tag_id), None):
+            stats.save(update_fields=['tag_counts', 'updated_at'])
+
+
+def rebuild(user_id):
+    # Compute the stats of a user from their recipes
+    with transaction.atomic():
+        stats, _ = RecipeStats.objects.get_or_create(user_id=user_id)
+        stats = RecipeStats.objects.select_for_update().get(pk=stats.pk)
+        delta = Delta.of_queryset(Recipe.objects.filter(user_id=user_id))
+        stats.recipe_count = delta.count
+        stats.time_minutes_total = delta.time_minutes
+        stats.price_total = delta.price
+        stats.price_histogram = delta.histogram
+        stats.tag_counts = {
+            str(tag_id): count for tag_id, count in delta.tags.items()
+        }
+        stats.save()
+
+    return stats
+
+
+def is_paused():
+    return getattr(_state, 'paused', False)
+
+
+@contextmanager
+def paused():
+    # Skip the stats updates of the signal handlers in this thread
+    previous = is_paused()
+    _state.paused = True
+    try:
+        yield
+    finally:
+        _state.paused = previous
+
+
+@contextmanager
+def bulk_change(user_id, recipe_ids):
+    # Account for a write to many recipes with aggregate queries
+    # the recipes are taken out of the stats before the write and added
+    # back after it, deleted recipes are simply not found anymore
+    recipes = Recipe.objects.filter(user_id=user_id, id__in=recipe_ids)
+    with transaction.atomic():
+        apply(user_id, Delta.of_queryset(recipes), -1)
+        with paused():
+            yield
+        apply(user_id, Delta.of_queryset(recipes))
+
+
+def get_stats(user_id):
+    # Return the stats row of a user, built on first use
+    stats = RecipeStats.objects.filter(user_id=user_id).first()
+    if stats is None or not _valid(stats):
+        stats = rebuild(user_id)
+
+    return stats
@@ -0,0 +1,58 @@
+from django.test import SimpleTestCase
+
+from recipe.indexes import SimilarityIndex, IngredientBitsetIndex
+
+
+class SimilarityIndexTests(SimpleTestCase):
+
+    def setUp(self):
+        self.index = SimilarityIndex()
+        self.index.add(1, [('tag', 1), ('tag', 2), ('ingredient', 1)])
+        self.index.add(2, [('tag', 1), ('tag', 2)])
+        self.index.add(3, [('tag', 1), ('ingredient', 2)])
+        self.index.add(4, [('ingredient', 3)])
+
+    def test_jaccard_scores(self):
+        # Test recipes are ranked by jaccard similarity
+        self.assertEqual(self.index.similar(1, 10), [(2, 2 / 3), (3, 1 / 4)])
+
+    def test_cosine_scores(self):
+        # Test recipes are ranked by cosine similarity
+        results = self.index.similar(1, 1, metric='cosine')
+
+        self.assertEqual(results[0][0], 2)
+        self.assertAlmostEqual(results[0][1], 2 / (3 * 2) ** 0.5)
+
+    def test_remove_updates_scores(self):
+        # Test unlinking features updates the scores
+        self.index.remove(2, [('tag', 2)])
+        self.index.remove_feature(('tag', 1))
+
+        self.assertEqual(self.index.similar(1, 10), [])
+        self.assertNotIn(2, self.index.features)
+
+
+class IngredientBitsetIndexTests(SimpleTestCase):
+
+    def setUp(self):
+        self.index = IngredientBitsetIndex()
+        for recipe_id, ingredient_ids in ((1, [10, 11]), (2, [10, 12, 13]),
+                                          (3, [14])):
+            mask = 0
+            for ingredient_id in ingredient_ids:
+                mask |= 1 << self.index._bit(ingredient_id)
+            self.index._append(recipe_id, mask)
+
+    def test_rank_by_coverage(self):
+        # Test recipes are ranked by the share of ingredients on hand
+        self.assertEqual(self.index.rank([10, 11, 12], 10), [
+            (1, 1.0, []),
+            (2, 2 / 3, [13]),
+        ])
+
+    def test_rank_min_coverage_and_unknown_ingredients(self):
+        # Test low coverage and unknown ingredients are left out
+        self.assertEqual(self.index.rank([10, 99], 10, min_coverage=0.5), [
+            (1, 0.5, [11]),
+        ])
+        self.assertEqual(self.index.rank([99], 10), [])
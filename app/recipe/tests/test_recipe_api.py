@@ -1,23 +1,37 @@
+import io
 import tempfile
 # allows to create path name and check if file exists in system
 import os
+from unittest.mock import patch
 
 # image model from pillow libry
 from PIL import Image
 
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import DatabaseError, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
 from django.urls import reverse
 
 from rest_framework import status
 from rest_framework.test import APIClient
 
-from core.models import Recipe, Tag, Ingredient
+from core.models import Recipe, RecipeStats, Tag, Ingredient
 
+from recipe import stats
 from recipe.serializers import RecipeSerializer, RecipeDetailSerializer
+from recipe.views import RecipeViewSet
 
 
 RECIPES_URL = reverse('recipe:recipe-list')
+FACETS_URL = reverse('recipe:recipe-facets')
+BATCH_URL = reverse('recipe:recipe-batch')
+BULK_UPDATE_URL = reverse('recipe:recipe-bulk-update')
+BULK_DELETE_URL = reverse('recipe:recipe-bulk-delete')
+COOKABLE_URL = reverse('recipe:recipe-cookable')
+BULK_UPLOAD_IMAGE_URL = reverse('recipe:recipe-bulk-upload-image')
+STATS_URL = reverse('recipe:recipe-stats')
 
 
 def image_upload_url(recipe_id):
@@ -26,6 +40,11 @@ def image_upload_url(recipe_id):
     return reverse('recipe:recipe-upload-image', args=[recipe_id])
 
 
+def similar_url(recipe_id):
+    # Return the similar recipes URL
+    return reverse('recipe:recipe-similar', args=[recipe_id])
+
+
 def detail_url(recipe_id):
     # Return recipe detail URL
     return reverse('recipe:recipe-detail', args=[recipe_id])
@@ -70,6 +89,7 @@ class PrivateRecipeApiTests(TestCase):
     # Test unauthenticated recipe API access
 
     def setUp(self):
+        cache.clear()
         self.client = APIClient()
         self.user = get_user_model().objects.create_user(
             'test@email.com',
@@ -275,6 +295,51 @@ class RecipeImageUploadTests(TestCase):
 
         self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def test_upload_image_reencoded(self):
+        # Test uploads are stored upright, without metadata, recompressed
+        url = image_upload_url(self.recipe.id)
+        exif = Image.Exif()
+        # rotated 90 degrees by the camera
+        exif[0x0112] = 6
+        exif[0x010f] = 'Camera maker'
+        with tempfile.NamedTemporaryFile(suffix='.jpg') as ntf:
+            Image.new('RGB', (300, 100)).save(
+                ntf, format='JPEG', quality=100, exif=exif.tobytes()
+            )
+            ntf.seek(0)
+            res = self.client.post(url, {'image': ntf}, format='multipart')
+
+        self.recipe.refresh_from_db()
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        with Image.open(self.recipe.image.path) as stored:
+            self.assertEqual(stored.format, 'JPEG')
+            self.assertEqual(stored.size, (100, 300))
+            self.assertTrue(stored.info.get('progressive'))
+            self.assertNotIn('exif', stored.info)
+        self.assertEqual(
+            self.recipe.image_bytes, os.path.getsize(self.recipe.image.path)
+        )
+        self.assertLess(
+            self.recipe.image_bytes, self.recipe.image_original_bytes
+        )
+        self.assertEqual(res.data['image_bytes'], self.recipe.image_bytes)
+
+    @override_settings(RECIPE_IMAGE_FORMAT='webp',
+                       RECIPE_IMAGE_MAX_DIMENSION=100)
+    def test_upload_image_scaled_down(self):
+        # Test uploads are scaled down and converted to the set format
+        url = image_upload_url(self.recipe.id)
+        with tempfile.NamedTemporaryFile(suffix='.png') as ntf:
+            Image.new('RGBA', (400, 200)).save(ntf, format='PNG')
+            ntf.seek(0)
+            self.client.post(url, {'image': ntf}, format='multipart')
+
+        self.recipe.refresh_from_db()
+        self.assertTrue(self.recipe.image.name.endswith('.webp'))
+        with Image.open(self.recipe.image.path) as stored:
+            self.assertEqual(stored.format, 'WEBP')
+            self.assertEqual(stored.size, (100, 50))
+
     def test_filter_recipes_by_tags(self):
         # Test returning recipes with specific tags
         recipe1 = sample_recipe(user=self.user, title='Thai vegetable curry')
@@ -319,3 +384,863 @@ class RecipeImageUploadTests(TestCase):
         self.assertIn(serializer1.data, res.data)
         self.assertIn(serializer2.data, res.data)
         self.assertNotIn(serializer3.data, res.data)
+
+    def test_filter_recipes_matching_all_tags(self):
+        # Test match=all returns only recipes with every tag
+        tag1 = sample_tag(user=self.user, name='Vegan')
+        tag2 = sample_tag(user=self.user, name='Quick')
+        recipe1 = sample_recipe(user=self.user)
+        recipe2 = sample_recipe(user=self.user)
+        recipe1.tags.add(tag1, tag2)
+        recipe2.tags.add(tag1)
+
+        res = self.client.get(
+            RECIPES_URL, {'tags': f'{tag1.id},{tag2.id}', 'match': 'all'}
+        )
+
+        self.assertEqual([item['id'] for item in res.data], [recipe1.id])
+
+    def test_list_ids_read_from_recipe_rows(self):
+        # Test listing recipes doesn't query the tags and ingredients
+        recipe = sample_recipe(user=self.user)
+        recipe.tags.add(sample_tag(user=self.user))
+        recipe.ingredients.add(sample_ingredient(user=self.user))
+
+        with self.assertNumQueries(1):
+            res = self.client.get(RECIPES_URL)
+
+        self.assertEqual(res.data[0]['tags'], recipe.tag_ids)
+        self.assertEqual(len(res.data[0]['ingredients']), 1)
+
+    def test_relation_ids_follow_links(self):
+        # Test the id arrays follow reverse links and deleted tags
+        tag1 = sample_tag(user=self.user, name='Vegan')
+        tag2 = sample_tag(user=self.user, name='Quick')
+        recipe = sample_recipe(user=self.user)
+
+        tag2.recipe_set.add(recipe)
+        tag1.recipe_set.add(recipe)
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.tag_ids, sorted([tag1.id, tag2.id]))
+
+        tag1.delete()
+        tag2.recipe_set.clear()
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.tag_ids, [])
+
+
+class RecipeFacetsApiTests(TestCase):
+    # Test the recipe facet counts
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'test@email.com',
+            'test1234'
+        )
+        self.client.force_authenticate(self.user)
+        self.vegan = sample_tag(user=self.user, name='Vegan')
+        self.dessert = sample_tag(user=self.user, name='Dessert')
+        self.sugar = sample_ingredient(user=self.user, name='Sugar')
+        recipe1 = sample_recipe(user=self.user, title='Vegan cake')
+        recipe1.tags.add(self.vegan, self.dessert)
+        recipe1.ingredients.add(self.sugar)
+        recipe2 = sample_recipe(user=self.user, title='Tofu curry')
+        recipe2.tags.add(self.vegan)
+
+    def test_facet_counts(self):
+        # Test counting recipes per tag and ingredient
+        res = self.client.get(FACETS_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['tags'], [
+            {'id': self.vegan.id, 'name': 'Vegan', 'count': 2},
+            {'id': self.dessert.id, 'name': 'Dessert', 'count': 1},
+        ])
+        self.assertEqual(res.data['ingredients'], [
+            {'id': self.sugar.id, 'name': 'Sugar', 'count': 1},
+        ])
+
+    def test_facet_counts_filtered(self):
+        # Test facet counts apply the recipe list filters
+        res = self.client.get(FACETS_URL, {'tags': f'{self.dessert.id}'})
+
+        self.assertEqual(res.data['tags'], [
+            {'id': self.dessert.id, 'name': 'Dessert', 'count': 1},
+            {'id': self.vegan.id, 'name': 'Vegan', 'count': 1},
+        ])
+
+    def test_facet_counts_range_filtered(self):
+        # Test range filters get their own cached facet counts
+        sample_recipe(user=self.user, price=50).tags.add(self.dessert)
+        self.client.get(FACETS_URL)
+
+        res = self.client.get(FACETS_URL, {'min_price': '20'})
+
+        self.assertEqual(res.data['tags'], [
+            {'id': self.dessert.id, 'name': 'Dessert', 'count': 1},
+        ])
+
+    def test_facet_counts_invalid_ids(self):
+        # Test ids that are not numbers are rejected
+        res = self.client.get(FACETS_URL, {'tags': 'vegan'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('tags', res.data)
+
+    def test_facet_counts_limited_to_user(self):
+        # Test facet counts only include the user recipes
+        user2 = get_user_model().objects.create_user(
+            'test2@email.com',
+            'test1234'
+        )
+        recipe = sample_recipe(user=user2)
+        recipe.tags.add(sample_tag(user=user2, name='Other'))
+
+        res = self.client.get(FACETS_URL)
+
+        self.assertEqual(len(res.data['tags']), 2)
+
+    def test_facet_cache_invalidated(self):
+        # Test cached facet counts are refreshed after a change
+        self.client.get(FACETS_URL)
+        recipe = sample_recipe(user=self.user, title='Fruit salad')
+        recipe.tags.add(self.dessert)
+
+        res = self.client.get(FACETS_URL)
+
+        self.assertEqual(res.data['tags'][0]['count'], 2)
+        self.assertEqual(res.data['tags'][1]['count'], 2)
+
+    def test_facets_counted_during_change_not_cached(self):
+        # Test counts racing a change are not served after it
+        count_related = RecipeViewSet._count_related
+
+        def change_during_query(view, *args):
+            counts = count_related(view, *args)
+            sample_recipe(user=self.user).tags.add(self.dessert)
+            return counts
+
+        with patch.object(
+            RecipeViewSet, '_count_related', change_during_query
+        ):
+            self.client.get(FACETS_URL)
+        res = self.client.get(FACETS_URL)
+
+        # a recipe was added after each of the two counts
+        self.assertEqual(res.data['tags'][0], {
+            'id': self.dessert.id, 'name': 'Dessert', 'count': 3
+        })
+
+
+class RecipeDetailCacheTests(TestCase):
+    # Test the cached recipe detail payloads
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'test@email.com',
+            'test1234'
+        )
+        self.client.force_authenticate(self.user)
+        self.recipe = sample_recipe(user=self.user)
+        self.tag = sample_tag(user=self.user)
+        self.recipe.tags.add(self.tag)
+        self.url = detail_url(self.recipe.id)
+
+    def test_detail_served_from_cache(self):
+        # Test a repeated detail read runs no queries
+        res1 = self.client.get(self.url)
+
+        with self.assertNumQueries(0):
+            res2 = self.client.get(self.url)
+
+        self.assertEqual(res1.data, res2.data)
+
+    @override_settings(CACHE_SHARED=False)
+    def test_detail_not_cached_without_shared_cache(self):
+        # Test a process local cache is not used for recipe details
+        self.client.get(self.url)
+
+        with self.assertNumQueries(3):
+            self.client.get(self.url)
+
+    def test_cache_not_shared_between_users(self):
+        # Test a cached detail is not returned to another user
+        self.client.get(self.url)
+        user2 = get_user_model().objects.create_user(
+            'test2@email.com',
+            'test1234'
+        )
+        self.client.force_authenticate(user2)
+
+        res = self.client.get(self.url)
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_cache_invalidated_on_recipe_update(self):
+        # Test saving the recipe refreshes its detail
+        self.client.get(self.url)
+        self.recipe.title = 'Updated'
+        self.recipe.save()
+
+        res = self.client.get(self.url)
+
+        self.assertEqual(res.data['title'], 'Updated')
+
+    def test_cache_invalidated_on_relation_change(self):
+        # Test linking an ingredient refreshes the detail
+        self.client.get(self.url)
+        ingredient = sample_ingredient(user=self.user)
+        ingredient.recipe_set.add(self.recipe)
+
+        res = self.client.get(self.url)
+
+        self.assertEqual(res.data['ingredients'][0]['id'], ingredient.id)
+
+    def test_cache_invalidated_on_tag_rename_and_delete(self):
+        # Test renaming or deleting a linked tag refreshes the detail
+        self.client.get(self.url)
+        self.tag.name = 'Renamed'
+        self.tag.save()
+
+        res = self.client.get(self.url)
+        self.assertEqual(res.data['tags'][0]['name'], 'Renamed')
+
+        self.tag.delete()
+        res = self.client.get(self.url)
+        self.assertEqual(res.data['tags'], [])
+
+    def test_detail_rendered_during_update_not_cached(self):
+        # Test a detail read racing an update is not served after it
+        get_object = RecipeViewSet.get_object
+
+        def update_during_read(view):
+            recipe = get_object(view)
+            self.recipe.title = 'Updated'
+            self.recipe.save()
+            return recipe
+
+        with patch.object(RecipeViewSet, 'get_object', update_during_read):
+            self.client.get(self.url)
+        res = self.client.get(self.url)
+
+        self.assertEqual(res.data['title'], 'Updated')
+
+
+class RecipeBatchApiTests(TestCase):
+    # Test retrieving many recipes at once
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'test@email.com',
+            'test1234'
+        )
+        self.client.force_authenticate(self.user)
+
+    def test_batch_keeps_requested_order(self):
+        # Test the details are returned in the order of the ids
+        recipe1 = sample_recipe(user=self.user, title='First')
+        recipe1.tags.add(sample_tag(user=self.user))
+        recipe2 = sample_recipe(user=self.user, title='Second')
+
+        res = self.client.get(BATCH_URL, {'ids': f'{recipe2.id},{recipe1.id}'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data, [
+            RecipeDetailSerializer(recipe2).data,
+            RecipeDetailSerializer(recipe1).data,
+        ])
+
+    def test_batch_limited_to_user(self):
+        # Test recipes of other users are left out
+        user2 = get_user_model().objects.create_user(
+            'test2@email.com',
+            'test1234'
+        )
+        recipe1 = sample_recipe(user=self.user)
+        recipe2 = sample_recipe(user=user2)
+
+        res = self.client.get(BATCH_URL, {'ids': f'{recipe1.id},{recipe2.id}'})
+
+        self.assertEqual([item['id'] for item in res.data], [recipe1.id])
+
+    def test_batch_uses_cached_details(self):
+        # Test cached details are reused by the batch request
+        recipe1 = sample_recipe(user=self.user)
+        recipe2 = sample_recipe(user=self.user)
+        self.client.get(detail_url(recipe1.id))
+        self.client.get(detail_url(recipe2.id))
+
+        with self.assertNumQueries(0):
+            res = self.client.get(
+                BATCH_URL, {'ids': f'{recipe1.id},{recipe2.id}'}
+            )
+
+        self.assertEqual(len(res.data), 2)
+
+    def test_batch_rendered_during_update_not_cached(self):
+        # Test details racing an update are not served after it
+        recipe = sample_recipe(user=self.user, title='First')
+        get_serializer = RecipeViewSet.get_serializer
+
+        def update_during_read(view, *args, **kwargs):
+            serializer = get_serializer(view, *args, **kwargs)
+            serializer.data
+            recipe.title = 'Updated'
+            recipe.save()
+            return serializer
+
+        with patch.object(
+            RecipeViewSet, 'get_serializer', update_during_read
+        ):
+            self.client.get(BATCH_URL, {'ids': f'{recipe.id}'})
+        res = self.client.get(BATCH_URL, {'ids': f'{recipe.id}'})
+
+        self.assertEqual(res.data[0]['title'], 'Updated')
+
+    def test_batch_invalid_ids(self):
+        # Test invalid ids return a bad request
+        res = self.client.get(BATCH_URL, {'ids': 'a,b'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class RecipeBulkApiTests(TestCase):
+    # Test changing many recipes at once
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'test@email.com',
+            'test1234'
+        )
+        self.client.force_authenticate(self.user)
+        self.recipe1 = sample_recipe(user=self.user)
+        self.recipe2 = sample_recipe(user=self.user)
+        self.other = sample_recipe(user=get_user_model().objects.create_user(
+            'test2@email.com',
+            'test1234'
+        ))
+
+    def test_bulk_update_fields_and_relations(self):
+        # Test updating fields and tags of many recipes
+        old_tag = sample_tag(user=self.user, name='Old')
+        new_tag = sample_tag(user=self.user, name='New')
+        self.recipe1.tags.add(old_tag)
+        payload = {
+            'ids': [self.recipe1.id, self.recipe2.id, self.other.id],
+            'price': '7.50',
+            'add_tags': [new_tag.id],
+            'remove_tags': [old_tag.id],
+        }
+
+        res = self.client.patch(BULK_UPDATE_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['results'], [
+            {'id': self.recipe1.id, 'status': 'updated'},
+            {'id': self.recipe2.id, 'status': 'updated'},
+            {'id': self.other.id, 'status': 'not_found'},
+        ])
+        for recipe in (self.recipe1, self.recipe2):
+            recipe.refresh_from_db()
+            self.assertEqual(str(recipe.price), '7.50')
+            self.assertEqual(list(recipe.tags.all()), [new_tag])
+            self.assertEqual(recipe.tag_ids, [new_tag.id])
+        self.other.refresh_from_db()
+        self.assertEqual(self.other.price, 5)
+
+    def test_bulk_update_refreshes_cached_detail(self):
+        # Test cached details are dropped by a bulk update
+        url = detail_url(self.recipe1.id)
+        self.client.get(url)
+        payload = {'ids': [self.recipe1.id], 'title': 'Bulk title'}
+
+        self.client.patch(BULK_UPDATE_URL, payload, format='json')
+
+        self.assertEqual(self.client.get(url).data['title'], 'Bulk title')
+
+    def test_bulk_update_rejects_foreign_tags(self):
+        # Test tags of other users can't be added
+        tag = sample_tag(user=self.other.user)
+        payload = {'ids': [self.recipe1.id], 'add_tags': [tag.id]}
+
+        res = self.client.patch(BULK_UPDATE_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.recipe1.tags.count(), 0)
+
+    def test_bulk_delete(self):
+        # Test deleting many recipes limited to the user
+        payload = {'ids': [self.recipe1.id, self.other.id]}
+
+        res = self.client.post(BULK_DELETE_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['results'], [
+            {'id': self.recipe1.id, 'status': 'deleted'},
+            {'id': self.other.id, 'status': 'not_found'},
+        ])
+        self.assertFalse(Recipe.objects.filter(id=self.recipe1.id).exists())
+        self.assertTrue(Recipe.objects.filter(id=self.other.id).exists())
+
+
+class RecipeRangeOrderingApiTests(TestCase):
+    # Test filtering recipes on ranges and sorting them
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'test@email.com',
+            'test1234'
+        )
+        self.client.force_authenticate(self.user)
+        self.quick = sample_recipe(
+            user=self.user, title='Toast', time_minutes=5, price=2.00
+        )
+        self.medium = sample_recipe(
+            user=self.user, title='Curry', time_minutes=25, price=12.00
+        )
+        self.slow = sample_recipe(
+            user=self.user, title='Stew', time_minutes=120, price=8.00
+        )
+
+    def _ids(self, params):
+        res = self.client.get(RECIPES_URL, params)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return [item['id'] for item in res.data]
+
+    def test_filter_time_and_price_ranges(self):
+        # Test recipes are filtered on time and price ranges
+        self.assertEqual(
+            self._ids({'max_time': 30}), [self.medium.id, self.quick.id]
+        )
+        self.assertEqual(
+            self._ids({'max_price': '10', 'min_time': 10}), [self.slow.id]
+        )
+
+    def test_ordering(self):
+        # Test recipes are sorted by the whitelisted fields
+        self.assertEqual(
+            self._ids({'ordering': 'price'}),
+            [self.quick.id, self.slow.id, self.medium.id]
+        )
+        self.assertEqual(
+            self._ids({'ordering': '-time_minutes'}),
+            [self.slow.id, self.medium.id, self.quick.id]
+        )
+        self.assertEqual(
+            self._ids({'ordering': 'title'}),
+            [self.medium.id, self.slow.id, self.quick.id]
+        )
+
+    def test_invalid_params(self):
+        # Test unknown ordering fields and bad ranges are rejected
+        res1 = self.client.get(RECIPES_URL, {'ordering': 'user'})
+        res2 = self.client.get(RECIPES_URL, {'max_price': 'cheap'})
+
+        self.assertEqual(res1.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(res2.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_non_finite_price_rejected(self):
+        # Test NaN and Infinity prices are rejected
+        for value in ('NaN', 'Infinity', '-inf', 'sNaN'):
+            res = self.client.get(RECIPES_URL, {'min_price': value})
+
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class RecipeSimilarApiTests(TransactionTestCase):
+    # Test the similar recipes endpoint
+    # the indexes are only patched once a change is committed
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'test@email.com',
+            'test1234'
+        )
+        self.client.force_authenticate(self.user)
+        self.vegan = sample_tag(user=self.user, name='Vegan')
+        self.curry = sample_tag(user=self.user, name='Curry')
+        self.recipe = sample_recipe(user=self.user, title='Tofu curry')
+        self.recipe.tags.add(self.vegan, self.curry)
+        self.close = sample_recipe(user=self.user, title='Chickpea curry')
+        self.close.tags.add(self.vegan, self.curry)
+        self.far = sample_recipe(user=self.user, title='Vegan cake')
+        self.far.tags.add(self.vegan)
+        sample_recipe(user=self.user, title='Steak')
+
+    def test_similar_recipes_ranked(self):
+        # Test recipes are ranked by shared tags and ingredients
+        res = self.client.get(similar_url(self.recipe.id))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [(item['id'], item['score']) for item in res.data],
+            [(self.close.id, 1.0), (self.far.id, 0.5)]
+        )
+
+    def test_index_updated_incrementally(self):
+        # Test linking a tag updates the built index without a rebuild
+        self.client.get(similar_url(self.recipe.id))
+        self.far.tags.add(self.curry)
+
+        # recipe lookup and similar recipes, ids read from the arrays
+        with self.assertNumQueries(2):
+            res = self.client.get(similar_url(self.recipe.id))
+
+        self.assertEqual(
+            [item['score'] for item in res.data], [1.0, 1.0]
+        )
+
+    def test_index_ignores_rolled_back_change(self):
+        # Test a change rolled back is not kept in the built index
+        self.client.get(similar_url(self.recipe.id))
+        try:
+            with transaction.atomic():
+                self.far.tags.add(self.curry)
+                raise DatabaseError('Rolled back')
+        except DatabaseError:
+            pass
+
+        res = self.client.get(similar_url(self.recipe.id))
+
+        self.assertEqual(
+            [item['score'] for item in res.data], [1.0, 0.5]
+        )
+
+    def test_similar_limited_to_user(self):
+        # Test recipes of other users are not found
+        user2 = get_user_model().objects.create_user(
+            'test2@email.com',
+            'test1234'
+        )
+        other = sample_recipe(user=user2)
+
+        res = self.client.get(similar_url(other.id))
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class RecipeCookableApiTests(TestCase):
+    # Test ranking recipes by the ingredients on hand
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'test@email.com',
+            'test1234'
+        )
+        self.client.force_authenticate(self.user)
+        self.egg = sample_ingredient(user=self.user, name='Egg')
+        self.flour = sample_ingredient(user=self.user, name='Flour')
+        self.milk = sample_ingredient(user=self.user, name='Milk')
+        self.pancakes = sample_recipe(user=self.user, title='Pancakes')
+        self.pancakes.ingredients.add(self.egg, self.flour, self.milk)
+        self.omelette = sample_recipe(user=self.user, title='Omelette')
+        self.omelette.ingredients.add(self.egg)
+
+    def test_rank_recipes_by_coverage(self):
+        # Test recipes are ranked by the share of ingredients on hand
+        res = self.client.get(
+            COOKABLE_URL, {'ingredients': f'{self.egg.id},{self.flour.id}'}
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [(item['id'], item['coverage']) for item in res.data],
+            [(self.omelette.id, 1.0), (self.pancakes.id, 0.6667)]
+        )
+        self.assertEqual(res.data[1]['missing_ingredients'], [self.milk.id])
+
+    def test_index_invalidated_on_change(self):
+        # Test the index is rebuilt after the ingredients change
+        params = {'ingredients': f'{self.milk.id}'}
+        self.client.get(COOKABLE_URL, params)
+        self.omelette.ingredients.add(self.milk)
+
+        res = self.client.get(COOKABLE_URL, params)
+
+        self.assertEqual(
+            [item['id'] for item in res.data],
+            [self.omelette.id, self.pancakes.id]
+        )
+
+
+class RecipeStatsApiTests(TestCase):
+    # Test the recipe stats kept up to date by every write
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'test@email.com',
+            'test1234'
+        )
+        self.client.force_authenticate(self.user)
+        self.tag = sample_tag(user=self.user, name='Vegan')
+        stats.rebuild(self.user.id)
+
+    def assertStatsCurrent(self):
+        # the incremental stats match stats counted from scratch
+        current = RecipeStats.objects.get(user=self.user)
+        expected = stats.Delta.of_queryset(
+            Recipe.objects.filter(user=self.user)
+        )
+        self.assertEqual(current.recipe_count, expected.count)
+        self.assertEqual(current.time_minutes_total, expected.time_minutes)
+        self.assertEqual(current.price_total, expected.price)
+        self.assertEqual(current.price_histogram, expected.histogram)
+        self.assertEqual(current.tag_counts, {
+            str(tag_id): count for tag_id, count in expected.tags.items()
+        })
+
+    def test_stats_summary(self):
+        # Test averages, price distribution and top tags are returned
+        other_tag = sample_tag(user=self.user, name='Quick')
+        recipe1 = sample_recipe(user=self.user, time_minutes=10, price=4)
+        recipe2 = sample_recipe(user=self.user, time_minutes=20, price=12)
+        recipe1.tags.add(self.tag, other_tag)
+        recipe2.tags.add(self.tag)
+
+        res = self.client.get(STATS_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['recipe_count'], 2)
+        self.assertEqual(res.data['average_time_minutes'], 15)
+        self.assertEqual(res.data['average_price'], '8.00')
+        self.assertEqual(res.data['price_distribution'], [
+            {'min': None, 'max': 5, 'count': 1},
+            {'min': 5, 'max': 10, 'count': 0},
+            {'min': 10, 'max': 20, 'count': 1},
+            {'min': 20, 'max': 50, 'count': 0},
+            {'min': 50, 'max': None, 'count': 0},
+        ])
+        self.assertEqual(res.data['top_tags'], [
+            {'id': self.tag.id, 'name': 'Vegan', 'count': 2},
+            {'id': other_tag.id, 'name': 'Quick', 'count': 1},
+        ])
+
+    def test_stats_follow_api_writes(self):
+        # Test creating, updating and deleting recipes keep stats current
+        res = self.client.post(RECIPES_URL, {
+            'title': 'Curry', 'time_minutes': 30, 'price': '9.00',
+            'tags': [self.tag.id],
+        })
+        self.assertStatsCurrent()
+
+        url = detail_url(res.data['id'])
+        self.client.patch(url, {'price': '25.00', 'tags': []})
+        self.assertStatsCurrent()
+
+        self.client.delete(url)
+        self.assertStatsCurrent()
+        self.assertEqual(
+            RecipeStats.objects.get(user=self.user).recipe_count, 0
+        )
+
+    def test_stats_follow_bulk_writes(self):
+        # Test the bulk paths that bypass signals keep stats current
+        recipe1 = sample_recipe(user=self.user)
+        recipe2 = sample_recipe(user=self.user, price=30)
+        recipe1.tags.add(self.tag)
+
+        self.client.patch(BULK_UPDATE_URL, {
+            'ids': [recipe1.id, recipe2.id], 'price': '60.00',
+            'add_tags': [self.tag.id],
+        }, format='json')
+        self.assertStatsCurrent()
+
+        self.client.post(BULK_DELETE_URL, {'ids': [recipe1.id]},
+                         format='json')
+        self.assertStatsCurrent()
+
+    def test_stats_follow_owner_change(self):
+        # Test a recipe given to another user leaves the owner stats
+        recipe = sample_recipe(user=self.user)
+        recipe = Recipe.objects.get(pk=recipe.pk)
+        recipe.user = get_user_model().objects.create_user(
+            'test2@email.com', 'test1234'
+        )
+        recipe.save()
+
+        self.assertStatsCurrent()
+
+    def test_stats_ignore_removing_unlinked_tags(self):
+        # Test removing tags a recipe doesn't have changes no count
+        other_tag = sample_tag(user=self.user, name='Quick')
+        recipe1 = sample_recipe(user=self.user)
+        recipe2 = sample_recipe(user=self.user)
+        recipe1.tags.add(self.tag, other_tag)
+
+        recipe2.tags.remove(self.tag)
+        self.assertStatsCurrent()
+
+        self.tag.recipe_set.remove(recipe1, recipe2)
+        self.assertStatsCurrent()
+
+    def test_deleted_tag_forgotten(self):
+        # Test a deleted tag is no longer counted
+        sample_recipe(user=self.user).tags.add(self.tag)
+
+        self.tag.delete()
+
+        self.assertStatsCurrent()
+
+    def test_stats_built_on_first_use(self):
+        # Test stats missing for a user are computed from the recipes
+        RecipeStats.objects.filter(user=self.user).delete()
+        sample_recipe(user=self.user)
+
+        res = self.client.get(STATS_URL)
+
+        self.assertEqual(res.data['recipe_count'], 1)
+        self.assertStatsCurrent()
+
+
+class RecipeConditionalUpdateTests(TestCase):
+    # Test optimistic concurrency control of recipe updates
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'test@email.com',
+            'test1234'
+        )
+        self.client.force_authenticate(self.user)
+        self.recipe = sample_recipe(user=self.user)
+        self.url = detail_url(self.recipe.id)
+
+    def test_detail_has_etag(self):
+        # Test the recipe version is returned as ETag
+        res = self.client.get(self.url)
+
+        self.assertEqual(res['ETag'], '"1"')
+        self.assertEqual(res.data['version'], 1)
+
+    def test_update_with_current_version(self):
+        # Test an update with the current version succeeds
+        res = self.client.patch(
+            self.url, {'title': 'New title'}, HTTP_IF_MATCH='"1"'
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res['ETag'], '"2"')
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.title, 'New title')
+        self.assertEqual(self.recipe.version, 2)
+
+    def test_update_with_list_body(self):
+        # Test a body that is not an object is rejected
+        res = self.client.patch(self.url, [1, 2], format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_update_with_stale_version(self):
+        # Test an update based on an old version is rejected
+        self.client.patch(self.url, {'title': 'First'}, HTTP_IF_MATCH='"1"')
+
+        res1 = self.client.patch(
+            self.url, {'title': 'Second'}, HTTP_IF_MATCH='"1"'
+        )
+        payload = {
+            'title': 'Third', 'time_minutes': 5, 'price': 1.00, 'version': 1
+        }
+        res2 = self.client.put(self.url, payload)
+
+        self.assertEqual(
+            res1.status_code, status.HTTP_412_PRECONDITION_FAILED
+        )
+        self.assertEqual(
+            res2.status_code, status.HTTP_412_PRECONDITION_FAILED
+        )
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.title, 'First')
+
+    def test_update_without_version(self):
+        # Test updates without a version still bump it
+        self.client.patch(self.url, {'title': 'New title'})
+
+        res = self.client.get(self.url)
+
+        self.assertEqual(res.data['title'], 'New title')
+        self.assertEqual(res.data['version'], 2)
+
+
+class RecipeBulkImageUploadTests(TestCase):
+    # Test uploading images to many recipes at once
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'test@email.com',
+            'test1234'
+        )
+        self.client.force_authenticate(self.user)
+        self.recipe1 = sample_recipe(user=self.user)
+        self.recipe2 = sample_recipe(user=self.user)
+        other = get_user_model().objects.create_user(
+            'other@email.com',
+            'test1234'
+        )
+        self.other_recipe = sample_recipe(user=other)
+
+    def tearDown(self):
+        for recipe in Recipe.objects.exclude(image=''):
+            recipe.image.delete()
+
+    def _image(self, name):
+        output = io.BytesIO()
+        Image.new('RGB', (40, 20), 'green').save(output, format='JPEG')
+
+        return SimpleUploadedFile(
+            name, output.getvalue(), content_type='image/jpeg'
+        )
+
+    def test_bulk_upload_images(self):
+        # Test each recipe gets its image and its own result
+        payload = {
+            str(self.recipe1.id): self._image('a.jpg'),
+            str(self.recipe2.id): SimpleUploadedFile('b.jpg', b'not image'),
+            str(self.other_recipe.id): self._image('c.jpg'),
+        }
+        res = self.client.post(
+            BULK_UPLOAD_IMAGE_URL, payload, format='multipart'
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        results = {item['id']: item for item in res.data['results']}
+        self.assertEqual(results[self.recipe1.id]['status'], 'uploaded')
+        self.assertEqual(results[self.recipe2.id]['status'], 'invalid')
+        self.assertEqual(
+            results[self.other_recipe.id]['status'], 'not_found'
+        )
+        self.recipe1.refresh_from_db()
+        self.other_recipe.refresh_from_db()
+        self.assertTrue(os.path.exists(self.recipe1.image.path))
+        self.assertEqual(
+            results[self.recipe1.id]['image_bytes'], self.recipe1.image_bytes
+        )
+        self.assertFalse(self.other_recipe.image)
+
+    def test_bulk_upload_requires_recipe_ids(self):
+        # Test the files must be sent under recipe ids
+        res1 = self.client.post(
+            BULK_UPLOAD_IMAGE_URL, {'image': self._image('a.jpg')},
+            format='multipart'
+        )
+        res2 = self.client.post(BULK_UPLOAD_IMAGE_URL, {}, format='multipart')
+
+        self.assertEqual(res1.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(res2.status_code, status.HTTP_400_BAD_REQUEST)
@@ -1,6 +1,7 @@
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.urls import reverse
-from django.test import TestCase
+from django.test import TestCase, override_settings
 
 from rest_framework import status
 from rest_framework.test import APIClient
@@ -13,6 +14,7 @@ from recipe.serializers import TagSerializer
 
 # for listing tags
 TAGS_URL = reverse('recipe:tag-list')
+AUTOCOMPLETE_URL = reverse('recipe:tag-autocomplete')
 
 
 # Test login required
@@ -144,3 +146,49 @@ class PrivateTagsApiTest(TestCase):
         res = self.client.get(TAGS_URL, {'assigned_only': 1})
         # verify if only 1 item is returned
         self.assertEqual(len(res.data), 1)
+
+
+class TagAutocompleteApiTest(TestCase):
+    # Test the tag prefix search
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            'test@email.com',
+            'test1234'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        for name in ('vegetarian', 'Vegan', 'Dessert', 'Veal'):
+            Tag.objects.create(user=self.user, name=name)
+        user2 = get_user_model().objects.create_user(
+            'test2@email.com',
+            'test1234'
+        )
+        Tag.objects.create(user=user2, name='Vegetables')
+
+    def _names(self, params):
+        res = self.client.get(AUTOCOMPLETE_URL, params)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return [item['name'] for item in res.data]
+
+    def test_prefix_search(self):
+        # Test tags are matched on a case insensitive prefix
+        self.assertEqual(
+            self._names({'q': 'VEG'}), ['Vegan', 'vegetarian']
+        )
+        self.assertEqual(self._names({'q': 've', 'limit': 2}),
+                         ['Veal', 'Vegan'])
+        self.assertEqual(self._names({'q': ''}), [])
+
+    @override_settings(RECIPE_AUTOCOMPLETE_IN_MEMORY=True)
+    def test_prefix_search_in_memory(self):
+        # Test the in-memory index returns the same matches
+        self.assertEqual(
+            self._names({'q': 'VEG'}), ['Vegan', 'vegetarian']
+        )
+        Tag.objects.create(user=self.user, name='Vegetable stock')
+
+        self.assertEqual(
+            self._names({'q': 'vege'}), ['Vegetable stock', 'vegetarian']
+        )
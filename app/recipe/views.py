@@ -1,22 +1,38 @@
+import heapq
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Count, F
+from django.db.models.functions import Lower
+
 # decorator to add a custom action to viewsets
 from rest_framework.decorators import action
 # returns a custom response
 from rest_framework.response import Response
 # generate status for our custom action
 from rest_framework import viewsets, mixins, status
+from rest_framework.exceptions import ValidationError
 # authenticate the request
 from rest_framework.authentication import TokenAuthentication
 # add the permission
 from rest_framework.permissions import IsAuthenticated
 
+from core import images
+from core.idempotency import IdempotentCreateMixin
 # import the tag and the serializer
 from core.models import Tag, Ingredient, Recipe
-from recipe import serializers
+from recipe import serializers, cache, relation_ids, stats
+from recipe.indexes import (
+    similarity_indexes, cookable_indexes, prefix_indexes
+)
 
 
 # new base class to refactor Tag and Ingredient viewsets
 # listmodelmixin to give us support to list ingredients
-class BaseRecipeAttrViewSet(viewsets.GenericViewSet,
+class BaseRecipeAttrViewSet(IdempotentCreateMixin,
+                            viewsets.GenericViewSet,
                             mixins.ListModelMixin,
                             mixins.CreateModelMixin):
     # Base viewset for user owned recipe attributes
@@ -56,6 +72,36 @@ class BaseRecipeAttrViewSet(viewsets.GenericViewSet,
         # set the user to the authenticated user
         serializer.save(user=self.request.user)
 
+    # tags/autocomplete/?q=veg&limit=5
+    @action(methods=['GET'], detail=False)
+    def autocomplete(self, request):
+        # Return the names starting with a prefix, case insensitive
+        prefix = request.query_params.get('q', '').strip()
+        try:
+            limit = int(request.query_params.get(
+                'limit', settings.RECIPE_AUTOCOMPLETE_LIMIT
+            ))
+        except ValueError:
+            raise ValidationError({'limit': 'Provide a number.'})
+        limit = max(1, min(limit, 50))
+        if not prefix:
+            return Response([], status=status.HTTP_200_OK)
+
+        if settings.RECIPE_AUTOCOMPLETE_IN_MEMORY:
+            # sorted names kept between keystrokes, rebuilt after a change
+            index = prefix_indexes[self.queryset.model].get(request.user.id)
+            return Response(
+                index.search(prefix, limit), status=status.HTTP_200_OK
+            )
+
+        # backed by the (user_id, UPPER(name)) prefix index
+        matches = self.queryset.filter(
+            user=request.user, name__istartswith=prefix
+        ).order_by(Lower('name'), 'id')[:limit]
+        serializer = self.get_serializer(matches, many=True)
+
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
 
 # Manage tags in the database
 class TagViewSet(BaseRecipeAttrViewSet):
@@ -71,7 +117,27 @@ class IngredientViewSet(BaseRecipeAttrViewSet):
     serializer_class = serializers.IngredientSerializer
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+def _finite_decimal(value):
+    # Parse a price, NaN and Infinity are valid decimals but not prices
+    value = Decimal(value)
+    if not value.is_finite():
+        raise ValueError('Not a finite number')
+
+    return value
+
+
+# query param, lookup and conversion of the recipe range filters
+RANGE_FILTERS = (
+    ('min_time', 'time_minutes__gte', int),
+    ('max_time', 'time_minutes__lte', int),
+    ('min_price', 'price__gte', _finite_decimal),
+    ('max_price', 'price__lte', _finite_decimal),
+)
+# fields recipes can be sorted by, each backed by an index
+ORDERING_FIELDS = ('id', 'title', 'time_minutes', 'price')
+
+
+class RecipeViewSet(IdempotentCreateMixin, viewsets.ModelViewSet):
     # Manage recipes in the database
     serializer_class = serializers.RecipeSerializer
     queryset = Recipe.objects.all()
@@ -84,6 +150,26 @@ class RecipeViewSet(viewsets.ModelViewSet):
         # Returns a list of string IDs to a list of integers
         return [int(str_id) for str_id in qs.split(',')]
 
+    def _count_related(self, through, field_name, recipes):
+        # Count the recipes linked to each tag or ingredient
+        # a single grouped query on the through table
+        rows = through.objects.filter(
+            recipe_id__in=recipes.values('id')
+        ).values(
+            f'{field_name}_id', f'{field_name}__name'
+        ).annotate(
+            count=Count('recipe_id')
+        ).order_by('-count', f'{field_name}__name')
+
+        return [
+            {
+                'id': row[f'{field_name}_id'],
+                'name': row[f'{field_name}__name'],
+                'count': row['count'],
+            }
+            for row in rows
+        ]
+
     # actions defined as functions in the viewset
     def get_queryset(self):
         # request object has a varible called query_params (is a dict)
@@ -91,18 +177,64 @@ class RecipeViewSet(viewsets.ModelViewSet):
         ingredients = self.request.query_params.get('ingredients')
         # we dont want to reassign with the filter options
         queryset = self.queryset
+        # recipes with any of the ids (&&), or all of them (@>) with
+        # match=all, on the GIN indexed arrays copying the m2m links
+        lookup = 'contains' if self.request.query_params.get(
+            'match'
+        ) == 'all' else 'overlap'
         if tags:
             # converts a list of individual ids
             tag_ids = self._params_to_ints(tags)
-            # tags__id__in django syntax for filtering on foreignkey objects
-            # return all the tags where id is in this list we provide
-            queryset = queryset.filter(tags__id__in=tag_ids)
+            queryset = queryset.filter(**{f'tag_ids__{lookup}': tag_ids})
         if ingredients:
             ingredient_ids = self._params_to_ints(ingredients)
-            queryset = queryset.filter(ingredients__id__in=ingredient_ids)
+            queryset = queryset.filter(
+                **{f'ingredient_ids__{lookup}': ingredient_ids}
+            )
+        queryset = self._filter_ranges(queryset)
 
         # Retrieve the recipes for the authenticated user
-        return queryset.filter(user=self.request.user)
+        # sorted on a column of a (user, column, id) index of Recipe
+        # the user also prunes partitioned tables to a single partition
+        return queryset.filter(user=self.request.user).order_by(
+            *self._ordering()
+        )
+
+    def _filter_ranges(self, queryset):
+        # Filter on the min/max query params of time_minutes and price
+        params = self.request.query_params
+        for param, lookup, convert in RANGE_FILTERS:
+            value = params.get(param)
+            if not value:
+                continue
+            try:
+                value = convert(value)
+            except (ValueError, InvalidOperation):
+                raise ValidationError({param: 'Provide a number.'})
+            queryset = queryset.filter(**{lookup: value})
+
+        return queryset
+
+    def _ordering(self):
+        # Return the order_by fields from the ordering query param
+        # id breaks ties in the same direction so the index is used
+        ordering = self.request.query_params.get('ordering', '-id')
+        if ordering.lstrip('-') not in ORDERING_FIELDS:
+            raise ValidationError({
+                'ordering': f'Order by one of {", ".join(ORDERING_FIELDS)}.'
+            })
+        direction = '-' if ordering.startswith('-') else ''
+
+        return ordering, f'{direction}id'
+
+    def _limit(self, default=10, maximum=50):
+        # Return the limit query param of the ranking actions
+        try:
+            limit = int(self.request.query_params.get('limit', default))
+        except ValueError:
+            raise ValidationError({'limit': 'Provide a number.'})
+
+        return max(1, min(limit, maximum))
 
     # override get_serializer_class function
     # this function is called to retrieve the serializer class
@@ -111,11 +243,15 @@ class RecipeViewSet(viewsets.ModelViewSet):
     def get_serializer_class(self):
         # Return appropiate serializer class
         # verify the action being used for our current request
-        if self.action == 'retrieve':
+        if self.action in ('retrieve', 'batch'):
             return serializers.RecipeDetailSerializer
         # check action
         elif self.action == 'upload_image':
             return serializers.RecipeImageSerializer
+        elif self.action == 'bulk_update':
+            return serializers.RecipeBulkUpdateSerializer
+        elif self.action == 'bulk_delete':
+            return serializers.RecipeBulkDeleteSerializer
 
         return self.serializer_class
 
@@ -124,6 +260,409 @@ class RecipeViewSet(viewsets.ModelViewSet):
         # assign the authenticated user to model once it has been created
         serializer.save(user=self.request.user)
 
+    def _expected_version(self):
+        # Return the recipe version the client based its update on
+        # from the If-Match header or a version field in the body
+        header = self.request.META.get('HTTP_IF_MATCH')
+        if not isinstance(self.request.data, dict):
+            raise ValidationError(
+                {'non_field_errors': 'Send the recipe fields as an object.'}
+            )
+        value = self.request.data.get('version')
+        if header:
+            header = header.strip()
+            if header == '*':
+                return None
+            # strong or weak validator: "3" or W/"3"
+            value = header[2:] if header.startswith('W/') else header
+            value = value.strip('"')
+        if value in (None, ''):
+            return None
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            raise ValidationError({'version': 'Provide a recipe version.'})
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.action in ('update', 'partial_update'):
+            context['expected_version'] = self._expected_version()
+
+        return context
+
+    def _with_etag(self, response):
+        # Expose the version of the recipe as its ETag
+        if isinstance(response.data, dict) and 'version' in response.data:
+            response['ETag'] = f'"{response.data["version"]}"'
+
+        return response
+
+    def update(self, request, *args, **kwargs):
+        return self._with_etag(super().update(request, *args, **kwargs))
+
+    # serve the detail from the cache, it is invalidated by the signals
+    # in recipe.signals whenever the recipe or its tags/ingredients change
+    def retrieve(self, request, *args, **kwargs):
+        # Return the rendered recipe detail
+        try:
+            recipe_id = int(kwargs[self.lookup_field])
+        except ValueError:
+            recipe_id = None
+        data, version = cache.get_recipe_detail(recipe_id, request.user.id)
+        if data is not None:
+            return self._with_etag(Response(data))
+
+        response = super().retrieve(request, *args, **kwargs)
+        cache.set_recipe_detail(
+            recipe_id, request.user.id, version, response.data
+        )
+
+        return self._with_etag(response)
+
+    # recipes/batch/?ids=3,1,2
+    @action(methods=['GET'], detail=False)
+    def batch(self, request):
+        # Return the details of many recipes in the requested order
+        try:
+            ids = self._params_to_ints(request.query_params.get('ids', ''))
+        except ValueError:
+            raise ValidationError({'ids': 'Provide comma separated ids.'})
+        ids = list(dict.fromkeys(ids))
+        if len(ids) > settings.RECIPE_BATCH_MAX_IDS:
+            raise ValidationError({'ids': 'Too many ids requested.'})
+
+        details, versions = cache.get_recipe_details(ids, request.user.id)
+        missing = [recipe_id for recipe_id in ids if recipe_id not in details]
+        if missing:
+            recipes = self.get_queryset().filter(
+                id__in=missing
+            ).prefetch_related('tags', 'ingredients')
+            serializer = self.get_serializer(recipes, many=True)
+            found = {item['id']: item for item in serializer.data}
+            cache.set_recipe_details(found, request.user.id, versions)
+            details.update(found)
+
+        # ids of recipes that don't exist or belong to someone else
+        # are left out of the response
+        return Response(
+            [details[recipe_id] for recipe_id in ids if recipe_id in details],
+            status=status.HTTP_200_OK
+        )
+
+    def _bulk_results(self, ids, found, done):
+        # Return the outcome for every requested recipe
+        return {'results': [
+            {'id': recipe_id, 'status': done if recipe_id in found
+             else 'not_found'}
+            for recipe_id in ids
+        ]}
+
+    def _check_owned(self, model, ids, field):
+        # Make sure every tag/ingredient id belongs to the user
+        ids = set(ids)
+        owned = model.objects.filter(user=self.request.user, id__in=ids)
+        if owned.count() != len(ids):
+            raise ValidationError({field: 'Unknown ids provided.'})
+
+    def _bulk_relations(self, through, field_name, recipe_ids, add, remove):
+        # Add and remove m2m links with one insert and one delete
+        if add:
+            through.objects.bulk_create([
+                through(recipe_id=recipe_id, **{f'{field_name}_id': pk})
+                for recipe_id in recipe_ids
+                for pk in set(add)
+            ], ignore_conflicts=True)
+        if remove:
+            through.objects.filter(
+                recipe_id__in=recipe_ids,
+                **{f'{field_name}_id__in': remove}
+            ).delete()
+        if add or remove:
+            # neither sends m2m_changed
+            relation_ids.refresh(
+                self.request.user.id, recipe_ids, [field_name]
+            )
+
+    # recipes/bulk-update
+    # {"ids": [1, 2], "price": "9.99", "add_tags": [3], ...}
+    @action(methods=['PATCH'], detail=False, url_path='bulk-update')
+    def bulk_update(self, request):
+        # Apply the same changes to many recipes in one transaction
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        fields = dict(serializer.validated_data)
+        ids = list(dict.fromkeys(fields.pop('ids')))
+        relations = {
+            name: fields.pop(name, [])
+            for name in ('add_tags', 'remove_tags',
+                         'add_ingredients', 'remove_ingredients')
+        }
+        self._check_owned(
+            Tag, relations['add_tags'] + relations['remove_tags'], 'tags'
+        )
+        self._check_owned(
+            Ingredient,
+            relations['add_ingredients'] + relations['remove_ingredients'],
+            'ingredients'
+        )
+
+        recipes = Recipe.objects.filter(user=request.user, id__in=ids)
+        with transaction.atomic():
+            found = list(recipes.values_list('id', flat=True))
+            with stats.bulk_change(request.user.id, found):
+                # a single set based UPDATE for every recipe
+                recipes.update(version=F('version') + 1, **fields)
+                self._bulk_relations(
+                    Recipe.tags.through, 'tag', found,
+                    relations['add_tags'], relations['remove_tags']
+                )
+                self._bulk_relations(
+                    Recipe.ingredients.through, 'ingredient', found,
+                    relations['add_ingredients'],
+                    relations['remove_ingredients']
+                )
+            cache.invalidate_recipes(request.user.id, found)
+
+        return Response(
+            self._bulk_results(ids, set(found), 'updated'),
+            status=status.HTTP_200_OK
+        )
+
+    # recipes/bulk-delete
+    # {"ids": [1, 2]}
+    @action(methods=['POST'], detail=False, url_path='bulk-delete')
+    def bulk_delete(self, request):
+        # Delete many recipes in one transaction
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = list(dict.fromkeys(serializer.validated_data['ids']))
+
+        recipes = Recipe.objects.filter(user=request.user, id__in=ids)
+        with transaction.atomic():
+            found = set(recipes.values_list('id', flat=True))
+            with stats.bulk_change(request.user.id, found):
+                recipes.delete()
+
+        return Response(
+            self._bulk_results(ids, found, 'deleted'),
+            status=status.HTTP_200_OK
+        )
+
+    def _store_image(self, recipe, upload):
+        # Re-encode an upload and write it to the storage, in a pool thread
+        try:
+            image = serializers.reencode_image(upload)
+            field = Recipe._meta.get_field('image')
+            name = field.storage.save(
+                field.generate_filename(recipe, image.name), image,
+                max_length=field.max_length
+            )
+            return name, upload.size, image.size
+        finally:
+            # storages counting references query from this thread
+            connections.close_all()
+
+    # recipes/bulk-upload-image, multipart with one image per recipe id
+    # {"12": <file>, "15": <file>}
+    @action(methods=['POST'], detail=False, url_path='bulk-upload-image')
+    def bulk_upload_image(self, request):
+        # Upload images to many recipes, encoded in parallel
+        uploads = {}
+        for key, upload in request.FILES.items():
+            try:
+                uploads[int(key)] = upload
+            except ValueError:
+                raise ValidationError({key: 'Use recipe ids as field names.'})
+        if not uploads:
+            raise ValidationError({'detail': 'Upload at least one image.'})
+        if len(uploads) > settings.RECIPE_BULK_MAX_IMAGES:
+            raise ValidationError({'detail': (
+                f'Upload at most {settings.RECIPE_BULK_MAX_IMAGES} images.'
+            )})
+
+        recipes = Recipe.objects.filter(user=request.user).in_bulk(
+            list(uploads)
+        )
+        # pillow releases the GIL while decoding and encoding, the
+        # threads use several cores and the files are written meanwhile
+        workers = min(settings.RECIPE_IMAGE_UPLOAD_WORKERS, len(recipes))
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+            stored = {
+                recipe_id: pool.submit(
+                    self._store_image, recipes[recipe_id], upload
+                )
+                for recipe_id, upload in uploads.items()
+                if recipe_id in recipes
+            }
+
+        results = []
+        with transaction.atomic():
+            for recipe_id in uploads:
+                if recipe_id not in stored:
+                    results.append({'id': recipe_id, 'status': 'not_found'})
+                    continue
+                try:
+                    name, original_bytes, image_bytes = \
+                        stored[recipe_id].result()
+                except images.ImageError:
+                    results.append({
+                        'id': recipe_id, 'status': 'invalid',
+                        'error': 'Upload a valid image.',
+                    })
+                    continue
+                recipe = recipes[recipe_id]
+                recipe.image = name
+                # the reference was added by the storage, see core.signals
+                recipe._image_stored = True
+                recipe.image_original_bytes = original_bytes
+                recipe.image_bytes = image_bytes
+                recipe.save(update_fields=[
+                    'image', 'image_original_bytes', 'image_bytes'
+                ])
+                results.append({
+                    'id': recipe_id, 'status': 'uploaded',
+                    'image': request.build_absolute_uri(recipe.image.url),
+                    'image_original_bytes': original_bytes,
+                    'image_bytes': image_bytes,
+                })
+
+        return Response({'results': results}, status=status.HTTP_200_OK)
+
+    # recipes/id/similar/?metric=cosine&limit=5
+    @action(methods=['GET'], detail=True)
+    def similar(self, request, pk=None):
+        # Return the recipes sharing the most tags and ingredients
+        recipe = self.get_object()
+        metric = request.query_params.get('metric', 'jaccard')
+        if metric not in ('jaccard', 'cosine'):
+            raise ValidationError({'metric': 'Use jaccard or cosine.'})
+
+        index = similarity_indexes.get(request.user.id)
+        scores = dict(index.similar(recipe.id, self._limit(), metric))
+        recipes = Recipe.objects.filter(
+            user=request.user, id__in=scores
+        )
+        serializer = serializers.RecipeSerializer(recipes, many=True)
+        results = [
+            dict(item, score=round(scores[item['id']], 4))
+            for item in serializer.data
+        ]
+        results.sort(key=lambda item: (-item['score'], item['id']))
+
+        return Response(results, status=status.HTTP_200_OK)
+
+    # recipes/cookable/?ingredients=1,2,3&min_coverage=0.5
+    @action(methods=['GET'], detail=False)
+    def cookable(self, request):
+        # Rank recipes by the share of their ingredients on hand
+        try:
+            ingredient_ids = self._params_to_ints(
+                request.query_params.get('ingredients', '')
+            )
+            min_coverage = float(
+                request.query_params.get('min_coverage', 0)
+            )
+        except ValueError:
+            raise ValidationError(
+                {'ingredients': 'Provide comma separated ids.'}
+            )
+
+        index = cookable_indexes.get(request.user.id)
+        ranked = index.rank(ingredient_ids, self._limit(), min_coverage)
+        recipes = Recipe.objects.filter(
+            user=request.user, id__in=[item[0] for item in ranked]
+        )
+        data = {
+            item['id']: item
+            for item in serializers.RecipeSerializer(recipes, many=True).data
+        }
+        results = [
+            dict(
+                data[recipe_id],
+                coverage=round(coverage, 4),
+                missing_ingredients=missing
+            )
+            for recipe_id, coverage, missing in ranked
+            if recipe_id in data
+        ]
+
+        return Response(results, status=status.HTTP_200_OK)
+
+    # recipes/stats
+    @action(methods=['GET'], detail=False)
+    def stats(self, request):
+        # Return the summary of the recipes of the user from one row
+        summary = stats.get_stats(request.user.id)
+        count = summary.recipe_count
+
+        bounds = settings.RECIPE_STATS_PRICE_BUCKETS
+        ranges = zip((None,) + bounds, bounds + (None,))
+        top_tags = heapq.nlargest(
+            settings.RECIPE_STATS_TOP_TAGS,
+            ((count, -int(tag_id)) for tag_id, count
+             in summary.tag_counts.items())
+        )
+        names = dict(Tag.objects.filter(
+            user=request.user, id__in=[-tag_id for _, tag_id in top_tags]
+        ).values_list('id', 'name'))
+
+        return Response({
+            'recipe_count': count,
+            'average_time_minutes': round(
+                summary.time_minutes_total / count, 1
+            ) if count else None,
+            'average_price': str(
+                (summary.price_total / count).quantize(Decimal('0.01'))
+            ) if count else None,
+            'price_distribution': [
+                {'min': low, 'max': high, 'count': recipes}
+                for (low, high), recipes
+                in zip(ranges, summary.price_histogram)
+            ],
+            'top_tags': [
+                {'id': -tag_id, 'name': names.get(-tag_id), 'count': count}
+                for count, tag_id in top_tags
+            ],
+        })
+
+    # recipes/facets
+    # same tags and ingredients filters as the recipe list
+    @action(methods=['GET'], detail=False)
+    def facets(self, request):
+        # Return the number of matching recipes per tag and ingredient
+        params = request.query_params
+        id_keys = []
+        for param in ('tags', 'ingredients'):
+            try:
+                id_keys.append(str(sorted(
+                    self._params_to_ints(params[param])
+                )) if params.get(param) else '')
+            except ValueError:
+                raise ValidationError(
+                    {param: 'Provide comma separated ids.'}
+                )
+        # every param get_queryset filters on is part of the key
+        filter_key = '|'.join(id_keys + [params.get('match', '')] + [
+            params.get(param, '') for param, _, _ in RANGE_FILTERS
+        ])
+        # read before the counts so a write during the query
+        # stores them under the version it replaced
+        version = cache.get_collection_version(request.user.id)
+        facets = cache.get_facets(request.user.id, version, filter_key)
+        if facets is None:
+            recipes = self.get_queryset()
+            facets = {
+                'tags': self._count_related(
+                    Recipe.tags.through, 'tag', recipes
+                ),
+                'ingredients': self._count_related(
+                    Recipe.ingredients.through, 'ingredient', recipes
+                ),
+            }
+            cache.set_facets(request.user.id, version, filter_key, facets)
+
+        return Response(facets, status=status.HTTP_200_OK)
+
     # define the method the action is going to accept
     # this action will be for the detail (specific recipe)
     # url_path is the path visible within the url
@@ -8,6 +8,9 @@ from django.urls import reverse
 from rest_framework.test import APIClient
 from rest_framework import status
 
+from core.models import Recipe, Tag, Ingredient, UserPurge
+from core.purge import run_purge
+
 # Upcase for convention, constant variable for our URL
 
 CREATE_USER_URL = reverse('user:create')
@@ -163,3 +166,59 @@ class PublicUserApiTests(TestCase):
             self.assertTrue(self.user.check_password(payload['password']))
             # make sure that it returns HTTP 200 response as expected
             self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+
+class DeleteUserApiTests(TestCase):
+    # Test deleting the authenticated user account
+
+    def setUp(self):
+        self.user = create_user(
+            email='test@email.com',
+            password='test1234',
+            name='name'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.tag = Tag.objects.create(user=self.user, name='Vegan')
+        Ingredient.objects.create(user=self.user, name='Salt')
+        for title in ('Soup', 'Salad', 'Stew'):
+            recipe = Recipe.objects.create(
+                user=self.user, title=title, time_minutes=10, price=5.00
+            )
+            recipe.tags.add(self.tag)
+
+    def test_delete_deactivates_and_schedules_purge(self):
+        # Test deleting the account deactivates it right away
+        res = self.client.delete(ME_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_202_ACCEPTED)
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.is_active)
+        purge = UserPurge.objects.get(id=res.data['purge_id'])
+        self.assertEqual(purge.status, UserPurge.PENDING)
+        # the data is left to the background purge
+        self.assertEqual(Recipe.objects.filter(user=self.user).count(), 3)
+
+    def test_purge_deletes_data_in_batches(self):
+        # Test the purge removes the data of the user and records progress
+        other = create_user(email='other@email.com', password='test1234')
+        Recipe.objects.create(
+            user=other, title='Other', time_minutes=10, price=5.00
+        )
+        self.client.delete(ME_URL)
+        purge = UserPurge.objects.get(user_id=self.user.id)
+
+        self.assertTrue(run_purge(purge, batch_size=2))
+
+        purge.refresh_from_db()
+        self.assertEqual(purge.status, UserPurge.DONE)
+        self.assertEqual(purge.recipes_deleted, 3)
+        self.assertEqual(purge.tags_deleted, 1)
+        self.assertEqual(purge.ingredients_deleted, 1)
+        self.assertFalse(
+            get_user_model().objects.filter(id=self.user.id).exists()
+        )
+        self.assertFalse(Recipe.tags.through.objects.exists())
+        self.assertEqual(Recipe.objects.count(), 1)
+        # a purge only runs once
+        self.assertFalse(run_purge(purge))
@@ -1,12 +1,16 @@
 # rest framework generic modules
-from rest_framework import generics, authentication, permissions
+from rest_framework import generics, authentication, permissions, status
 from rest_framework.authtoken.views import ObtainAuthToken
+from rest_framework.response import Response
 from rest_framework.settings import api_settings
 
+from core.idempotency import IdempotentCreateMixin
+from core.purge import schedule_purge
+
 from user.serializers import UserSerializer, AuthTokenSerializer
 
 
-class CreateUserView(generics.CreateAPIView):
+class CreateUserView(IdempotentCreateMixin, generics.CreateAPIView):
     # Create a new user in the system
     serializer_class = UserSerializer
 
@@ -19,7 +23,7 @@ class CreateTokenView(ObtainAuthToken):
 
 
 # create manage user view
-class ManageUserView(generics.RetrieveUpdateAPIView):
+class ManageUserView(generics.RetrieveUpdateDestroyAPIView):
     # Manage the authenticated user
     serializer_class = UserSerializer
     # get the authenticated user and assigning it to request
@@ -31,3 +35,14 @@ class ManageUserView(generics.RetrieveUpdateAPIView):
     def get_object(self):
         # Retrieve and return authentication user
         return self.request.user
+
+    # deleting the account deactivates it now and purges its data in
+    # small batches in the background, see core.purge
+    def destroy(self, request, *args, **kwargs):
+        # Schedule the deletion of the authenticated user
+        purge = schedule_purge(self.get_object())
+
+        return Response(
+            {'purge_id': purge.id, 'status': purge.status},
+            status=status.HTTP_202_ACCEPTED
+        )